@@ -0,0 +1,100 @@
+'''
+Compares full precision and dynamically int8 quantized text embedding and CLIP models on CPU.
+Reports inference speedup and cosine similarity between embeddings of both variants (drift) on the fixture corpus.
+
+Usage: python -m kfe.benchmarks.cpu_quantization [--language en|pl] [--threads N] [--repeats N]
+'''
+import argparse
+import os
+import time
+from typing import Callable
+
+import numpy as np
+
+from kfe.utils.constants import CPU_QUANTIZATION_ENV, DEVICE_ENV
+
+# models must be loaded in full precision on cpu, quantized variants are created by the benchmark
+os.environ[DEVICE_ENV] = 'cpu'
+os.environ[CPU_QUANTIZATION_ENV] = 'false'
+
+import torch
+
+from kfe.benchmarks.fixtures import EN_CORPUS, PL_CORPUS, generate_images
+from kfe.dependencies import get_clip_model, get_text_embedding_model
+from kfe.utils.cpu_inference import quantize_for_cpu
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+def _measure(fn: Callable[[], np.ndarray], repeats: int) -> tuple[np.ndarray, float]:
+    result = fn() # warmup
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return _normalize(result), (time.perf_counter() - start_time) / repeats
+
+def _report(name: str, float_result: tuple[np.ndarray, float], quantized_result: tuple[np.ndarray, float]):
+    (float_embeddings, float_time), (quantized_embeddings, quantized_time) = float_result, quantized_result
+    cosine = np.sum(float_embeddings * quantized_embeddings, axis=1)
+    # retrieval quality proxy: how often the nearest neighbor of each item stays the same
+    float_nn = np.argsort(float_embeddings @ float_embeddings.T, axis=1)[:, -2]
+    quantized_nn = np.argsort(quantized_embeddings @ quantized_embeddings.T, axis=1)[:, -2]
+    print(f'{name}:')
+    print(f'  float32: {float_time * 1000:.1f} ms, int8: {quantized_time * 1000:.1f} ms, speedup: {float_time / quantized_time:.2f}x')
+    print(f'  cosine similarity float32 vs int8: mean {cosine.mean():.4f}, min {cosine.min():.4f}')
+    print(f'  nearest neighbor agreement: {np.mean(float_nn == quantized_nn) * 100:.0f}%')
+
+def benchmark_text_embedding(language: str, repeats: int):
+    model_with_config = get_text_embedding_model(language)
+    corpus = EN_CORPUS if language == 'en' else PL_CORPUS
+    texts = [x + model_with_config.passage_prefix for x in corpus]
+    encode_kwargs = model_with_config.passage_encode_kwargs or {}
+    quantized_model = quantize_for_cpu(model_with_config.model)
+
+    def _encode(model) -> Callable[[], np.ndarray]:
+        def _do_encode():
+            with torch.no_grad():
+                return model.encode(texts, **encode_kwargs)
+        return _do_encode
+
+    _report(f'text embedding ({language})',
+        _measure(_encode(model_with_config.model), repeats),
+        _measure(_encode(quantized_model), repeats))
+
+def benchmark_clip(repeats: int):
+    processor, model = get_clip_model()
+    quantized_model = quantize_for_cpu(model)
+    images = generate_images()
+    text_inputs = processor(text=EN_CORPUS, images=None, return_tensors='pt', padding=True)
+    image_inputs = processor(text=None, images=images, return_tensors='pt', padding=True)
+
+    def _text(model) -> Callable[[], np.ndarray]:
+        def _do_encode():
+            with torch.no_grad():
+                return model.get_text_features(**text_inputs).float().numpy()
+        return _do_encode
+
+    def _image(model) -> Callable[[], np.ndarray]:
+        def _do_encode():
+            with torch.no_grad():
+                return model.get_image_features(**image_inputs).float().numpy()
+        return _do_encode
+
+    _report('clip text', _measure(_text(model), repeats), _measure(_text(quantized_model), repeats))
+    _report('clip image', _measure(_image(model), repeats), _measure(_image(quantized_model), repeats))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of int8 dynamic quantization for cpu inference')
+    parser.add_argument('--language', choices=['en', 'pl'], default='en')
+    parser.add_argument('--threads', type=int, default=None, help='number of intra-op threads, torch default if not set')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    print(f'running with {torch.get_num_threads()} threads, {args.repeats} repeats, {len(EN_CORPUS)} items per batch')
+    benchmark_text_embedding(args.language, args.repeats)
+    benchmark_clip(args.repeats)
+
+if __name__ == '__main__':
+    main()
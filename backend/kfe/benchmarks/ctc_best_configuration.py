@@ -0,0 +1,99 @@
+'''
+Compares the vectorized best ctc configuration dp of DictionaryAssistedDecoder with the previous loop based implementation.
+Scores batches of candidate words (like corrections found in the BK-tree) against spans of frames of recorded logits,
+or of synthetic logits if no recording is given. Recorded logits are (frames, vocabulary) array saved with numpy.save.
+
+Usage: python -m kfe.benchmarks.ctc_best_configuration [--logits path.npy] [--blank-token-id N] [--candidates N] [--repeats N]
+'''
+import argparse
+import time
+
+import numpy as np
+
+from kfe.features.audioutils.dictionary_assisted_decoder import \
+    get_best_configuration_log_probs
+
+
+def loop_best_configuration_log_prob(log_probs: np.ndarray, blank_token_id: int, tokens: list[int], start_idx: int, end_idx: int) -> float:
+    N = end_idx - start_idx + 1
+    if len(tokens) > N:
+        return -np.inf
+    F = np.zeros((len(tokens) + 1, N + 1), dtype=np.float32)
+    for i in range(1, N+1):
+        F[0, i] = F[0, i-1] + log_probs[start_idx + i - 1, blank_token_id]
+    for i in range(1, len(tokens) + 1):
+        for j in range(i, N + 1):
+            take_cur_lp = log_probs[start_idx + j - 1, tokens[i - 1]]
+            blank_lp = log_probs[start_idx + j - 1, blank_token_id]
+            if i == j:
+                F[i, j] = F[i-1, j-1] + take_cur_lp
+            else:
+                F[i, j] = max(F[i, j-1] + blank_lp, F[i-1, j-1] + take_cur_lp)
+    return F[len(tokens), N]
+
+def _synthetic_log_probs(frames: int, vocabulary_size: int, blank_token_id: int, rng: np.random.Generator) -> np.ndarray:
+    # ctc outputs are dominated by blanks with occasional confident letters
+    logits = rng.normal(0, 1, (frames, vocabulary_size))
+    logits[:, blank_token_id] += 4
+    letters = rng.random(frames) < 0.3
+    logits[letters, rng.integers(0, vocabulary_size, letters.sum())] += 8
+    logits -= logits.max(axis=1, keepdims=True)
+    return (logits - np.log(np.exp(logits).sum(axis=1, keepdims=True))).astype(np.float32)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of best ctc configuration dp used for dictionary assisted correction')
+    parser.add_argument('--logits', default=None, help='path to .npy file with (frames, vocabulary) log probabilities or logits')
+    parser.add_argument('--blank-token-id', type=int, default=0)
+    parser.add_argument('--candidates', type=int, default=20, help='number of candidate words scored for each span')
+    parser.add_argument('--spans', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    if args.logits is not None:
+        logits = np.load(args.logits).astype(np.float32)
+        logits = logits.reshape(-1, logits.shape[-1])
+        logits -= logits.max(axis=1, keepdims=True)
+        log_probs = logits - np.log(np.exp(logits).sum(axis=1, keepdims=True))
+    else:
+        log_probs = _synthetic_log_probs(5000, 40, args.blank_token_id, rng)
+    frames, vocabulary_size = log_probs.shape
+    letters = [x for x in range(vocabulary_size) if x != args.blank_token_id]
+
+    workload = []
+    for _ in range(args.spans):
+        span_length = int(rng.integers(10, 60))
+        start = int(rng.integers(0, max(1, frames - span_length)))
+        end = min(frames - 1, start + span_length - 1)
+        candidates = [list(rng.choice(letters, size=int(rng.integers(3, 14)))) for _ in range(args.candidates)]
+        workload.append((start, end, candidates))
+
+    def _run_loop() -> list[float]:
+        return [loop_best_configuration_log_prob(log_probs, args.blank_token_id, c, start, end)
+            for start, end, candidates in workload for c in candidates]
+
+    def _run_vectorized_single() -> list[float]:
+        return [float(get_best_configuration_log_probs(log_probs, args.blank_token_id, [c], start, end)[0])
+            for start, end, candidates in workload for c in candidates]
+
+    def _run_vectorized_batched() -> list[float]:
+        return [float(x) for start, end, candidates in workload
+            for x in get_best_configuration_log_probs(log_probs, args.blank_token_id, candidates, start, end)]
+
+    reference = None
+    print(f'{frames} frames, {vocabulary_size} tokens, {args.spans} spans x {args.candidates} candidates')
+    for name, fn in [('loop', _run_loop), ('vectorized, one candidate per call', _run_vectorized_single),
+                     ('vectorized, all candidates of span per call', _run_vectorized_batched)]:
+        start_time = time.perf_counter()
+        for _ in range(args.repeats):
+            result = np.array(fn())
+        elapsed = (time.perf_counter() - start_time) / args.repeats
+        if reference is None:
+            reference, reference_time = result, elapsed
+        finite = np.isfinite(reference)
+        max_diff = np.max(np.abs(result[finite] - reference[finite])) if finite.any() else 0.
+        print(f'{name}: {elapsed * 1000:.1f} ms, speedup: {reference_time / elapsed:.1f}x, ' +
+            f'max abs difference: {max_diff:.2e}, same infeasible: {np.array_equal(np.isfinite(result), finite)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+from PIL import Image, ImageDraw
+
+EN_CORPUS = [
+    'a dog running on the beach at sunset',
+    'screenshot of a spreadsheet with quarterly sales numbers',
+    'two people hiking in the mountains covered with snow',
+    'recipe for a chocolate cake with strawberries',
+    'a cat sleeping on a laptop keyboard',
+    'city skyline at night with illuminated skyscrapers',
+    'handwritten notes from a lecture about linear algebra',
+    'a red car parked in front of an old brick house',
+    'birthday party with balloons and a big cake',
+    'invoice for electricity bill due next month',
+    'children playing football in the park',
+    'a bowl of ramen with eggs and green onions',
+    'meme with a surprised cat and bold white text',
+    'boarding pass for a flight to Barcelona',
+    'a forest path covered with autumn leaves',
+    'presentation slide about neural network architectures',
+]
+
+PL_CORPUS = [
+    'pies biegnący po plaży o zachodzie słońca',
+    'zrzut ekranu arkusza kalkulacyjnego z wynikami sprzedaży',
+    'dwie osoby na wędrówce w zaśnieżonych górach',
+    'przepis na ciasto czekoladowe z truskawkami',
+    'kot śpiący na klawiaturze laptopa',
+    'panorama miasta nocą z oświetlonymi wieżowcami',
+    'odręczne notatki z wykładu z algebry liniowej',
+    'czerwony samochód zaparkowany przed starym ceglanym domem',
+    'przyjęcie urodzinowe z balonami i dużym tortem',
+    'faktura za prąd z terminem płatności w przyszłym miesiącu',
+    'dzieci grające w piłkę w parku',
+    'miska ramenu z jajkiem i szczypiorkiem',
+    'mem z zaskoczonym kotem i białym napisem',
+    'karta pokładowa na lot do Barcelony',
+    'leśna ścieżka pokryta jesiennymi liśćmi',
+    'slajd prezentacji o architekturach sieci neuronowych',
+]
+
+def generate_images(count: int=16, size: int=224) -> list[Image.Image]:
+    '''Deterministic synthetic images with shapes and gradients, so that benchmarks don't depend on external files'''
+    images = []
+    for i in range(count):
+        img = Image.new('RGB', (size, size), color=((37 * i) % 256, (91 * i) % 256, (151 * i) % 256))
+        draw = ImageDraw.Draw(img)
+        for j in range(i % 5 + 1):
+            offset = (j * 29 + i * 13) % (size // 2)
+            color = ((255 - 40 * j) % 256, (60 * j + 17 * i) % 256, (23 * i) % 256)
+            if (i + j) % 2 == 0:
+                draw.ellipse((offset, offset, offset + size // 3, offset + size // 4), fill=color)
+            else:
+                draw.rectangle((size - offset - size // 4, offset, size - offset, offset + size // 3), fill=color)
+        draw.text((10, size - 20), f'sample {i}', fill=(255, 255, 255))
+        images.append(img)
+    return images
@@ -1,7 +1,8 @@
 import asyncio
+import hashlib
 import os
 from pathlib import Path
-from typing import Annotated, Any, AsyncGenerator, Callable, Optional
+from typing import Annotated, Any, AsyncGenerator, Callable, Optional, Union
 
 import easyocr
 import spacy
@@ -17,38 +18,102 @@ from transformers import (AutoModelForCausalLM, AutoModelForSpeechSeq2Seq,
 
 from kfe.directory_context import DirectoryContext, DirectoryContextHolder
 from kfe.dtos.mappers import Mapper
+from kfe.features.ocr_engine import OCRConfig, OCRProcessPool
+from kfe.features.onnx_models import (OnnxCLIPModel, OnnxSentenceEncoder,
+                                      is_onnx_runtime_available)
 from kfe.features.text_embedding_engine import TextModelWithConfig
-from kfe.features.vision_lm_engine import VisionLMModel
+from kfe.features.transcriber import TranscriptionSettings
+from kfe.features.vision_lm_engine import VisionLMEngine, VisionLMModel
 from kfe.features.visionlmutils.janus.processing_vlm import VLChatProcessor
 from kfe.persistence.db import Database
+from kfe.persistence.derived_data_store import (DerivedArtifactType,
+                                                DerivedDataStore)
 from kfe.persistence.directory_repository import DirectoryRepository
+from kfe.persistence.embeddings import EmbeddingVersions, StoredEmbeddingType
 from kfe.persistence.file_metadata_repository import FileMetadataRepository
+from kfe.persistence.model import RegisteredDirectory
+from kfe.service.embedding_processor import ClipVideoFrameSelectionConfig
+from kfe.service.llm_description_scheduler import \
+    LLMDescriptionSchedulerConfig
 from kfe.service.metadata_editor import MetadataEditor
 from kfe.service.search import SearchService
 from kfe.service.thumbnails import ThumbnailManager
-from kfe.utils.constants import (DEVICE_ENV, DIRECTORY_NAME_HEADER,
-                                 LOG_SQL_ENV, TRANSCRIPTION_MODEL_ENV,
-                                 Language)
+from kfe.utils.constants import (BACKGROUND_LLM_DESCRIPTIONS_ENV, DEVICE_ENV,
+                                 DIRECTORY_NAME_HEADER, LOG_SQL_ENV,
+                                 MAX_CONCURRENT_DIRECTORY_INITS_ENV,
+                                 MICRO_BATCH_MAX_SIZE_ENV,
+                                 MICRO_BATCH_MAX_WAIT_MS_ENV,
+                                 MODEL_RAM_BUDGET_MB_ENV,
+                                 MODEL_VRAM_BUDGET_MB_ENV,
+                                 TRANSCRIPTION_MODEL_ENV, Language)
+from kfe.utils.cpu_inference import (CPUInferenceConfig,
+                                     configure_cpu_threads, quantize_for_cpu)
 from kfe.utils.hybrid_search_confidence_providers import (
     HybridSearchConfidenceProviderFactory,
     NarrowRangeSemanticConfidenceProvider)
 from kfe.utils.log import logger
-from kfe.utils.model_cache import get_cache_dir, try_loading_cached_or_download
-from kfe.utils.model_eager_loader import ModelEagerLoader
-from kfe.utils.model_manager import (ModelManager, ModelType,
-                                     SecondaryModelManager)
+from kfe.utils.micro_batcher import MicroBatcherConfig
+from kfe.utils.model_cache import (get_cache_dir, get_onnx_export_dir,
+                                   try_loading_cached_or_download)
+from kfe.utils.model_manager import (ModelManager, ModelMemoryBudget,
+                                     ModelType, SecondaryModelManager)
+from kfe.utils.model_prewarmer import ModelPrewarmer
 from kfe.utils.paths import CONFIG_DIR
-from kfe.utils.platform import is_apple_silicon, is_windows
+from kfe.utils.platform import (get_total_ram_bytes, is_apple_silicon,
+                                is_windows)
 
-REFRESH_PERIOD_SECONDS = 3600 * 24.
+REFRESH_PERIOD_SECONDS = 3600.
+CLIP_MODEL_ID = "openai/clip-vit-base-patch32"
+VISION_LM_MODEL_ID = "deepseek-ai/Janus-Pro-1B"
 
 device = torch.device('cuda' if torch.cuda.is_available() and os.getenv(DEVICE_ENV, 'cuda') == 'cuda' else 'cpu')
 if os.getenv(DEVICE_ENV) != 'cpu' and not is_apple_silicon() and not torch.cuda.is_available():
     logger.warning('GPU unavailable')
 
-def get_ocr_model(language: Language) -> easyocr.Reader:
+cpu_inference_config = CPUInferenceConfig.from_env()
+ocr_config = OCRConfig.from_env()
+if str(device) != 'cpu':
+    # process pool is useful only for cpu inference, gpu would be shared by processes anyway
+    ocr_config = ocr_config._replace(num_processes=1)
+
+# backends applied to loaded embedding models by model id, embeddings are comparable only within the same backend
+inference_backend_tags: dict[str, str] = {}
+
+def get_inference_backend_tag(onnx: bool=False, quantized: bool=False) -> str:
+    if str(device) != 'cpu':
+        return str(device)
+    return 'cpu' + ('-onnx' if onnx else '') + ('-int8' if quantized else '')
+
+def optimize_for_cpu_inference(model_id: str, model: torch.nn.Module, onnx_exporter: Callable[[Path], Any]) -> tuple[Any, str]:
+    '''Returns the model to use and tag of the backend that was actually applied to it'''
+    if str(device) != 'cpu':
+        return model, get_inference_backend_tag()
+    if cpu_inference_config.backend == 'onnx':
+        export_dir = get_onnx_export_dir(model_id, variant='int8' if cpu_inference_config.quantize else '')
+        if not is_onnx_runtime_available():
+            logger.warning('onnx runtime backend requested but onnxruntime is not installed, using pytorch')
+        elif export_dir is not None:
+            try:
+                return onnx_exporter(export_dir), get_inference_backend_tag(onnx=True, quantized=cpu_inference_config.quantize)
+            except Exception as e:
+                logger.warning(f'failed to serve {model_id} with onnx runtime, using pytorch', exc_info=e)
+    if cpu_inference_config.quantize:
+        logger.info(f'quantizing {model_id} for cpu inference')
+        return quantize_for_cpu(model), get_inference_backend_tag(quantized=True)
+    return model, get_inference_backend_tag()
+
+def optimize_text_embedding_model_for_cpu_inference(model_id: str, model: SentenceTransformer) -> Any:
+    optimized_model, inference_backend_tags[model_id] = optimize_for_cpu_inference(model_id, model, lambda export_dir: OnnxSentenceEncoder.export(
+        model, export_dir.joinpath('model.onnx'), quantize=cpu_inference_config.quantize, num_threads=cpu_inference_config.num_threads))
+    return optimized_model
+
+def get_ocr_model(language: Language) -> Union[easyocr.Reader, OCRProcessPool]:
+    languages = ['en'] if language == 'en' else [language, 'en']
+    if ocr_config.num_processes > 1:
+        logger.info(f'using {ocr_config.num_processes} processes for OCR')
+        return OCRProcessPool(languages, ocr_config.num_processes, cpu_inference_config.num_threads)
     reader = easyocr.Reader(
-        ['en'] if language == 'en' else [language, 'en'],
+        languages,
         gpu=str(device) == 'cuda'
     )
     try:
@@ -77,6 +142,13 @@ def get_lemmatizer_model(language: Language, download_on_loading_fail=True) -> s
         else:
             raise
 
+def get_text_embedding_model_id(language: Language) -> str:
+    if language == 'pl':
+        if str(device) == 'cuda' or is_apple_silicon():
+            return 'jinaai/jina-embeddings-v3'
+        return 'ipipan/silver-retriever-base-v1.1'
+    return 'BAAI/bge-large-en-v1.5'
+
 def get_text_embedding_model(language: Language, return_confidence_provider: bool=False) -> SentenceTransformer:
     # important: when embedding model is changed hybrid search confidence coefficients should be adjusted
     # by setting similarity scores that are considered as high or low for the selected model
@@ -88,10 +160,11 @@ def get_text_embedding_model(language: Language, return_confidence_provider: boo
             if return_confidence_provider:
                 return NarrowRangeSemanticConfidenceProvider(low_relevance_threshold=0.15, max_relevance=0.45)
             # this model is too large to work smoothly on cpu
+            inference_backend_tags[get_text_embedding_model_id(language)] = get_inference_backend_tag()
             return TextModelWithConfig(
                 # this seems to work fine offline even without try_loading_cached_or_download
                 # but doesn't work with local_files_only=True, so try_loading_cached_or_download can't be used
-                model=SentenceTransformer('jinaai/jina-embeddings-v3', cache_folder=get_cache_dir(),
+                model=SentenceTransformer(get_text_embedding_model_id(language), cache_folder=get_cache_dir(),
                     trust_remote_code=True, revision='62a81741b58448ed8f691764cec7aa5d3c045e4c',
                     config_kwargs={'use_flash_attn': False}).to(device),
                 query_prefix='',
@@ -108,22 +181,24 @@ def get_text_embedding_model(language: Language, return_confidence_provider: boo
         else:
             if return_confidence_provider:
                 return NarrowRangeSemanticConfidenceProvider(low_relevance_threshold=0.94, max_relevance=0.96)
+            model_id = get_text_embedding_model_id(language)
             return TextModelWithConfig(
-                model=try_loading_cached_or_download(
-                    'ipipan/silver-retriever-base-v1.1',
+                model=optimize_text_embedding_model_for_cpu_inference(model_id, try_loading_cached_or_download(
+                    model_id,
                     lambda x: SentenceTransformer(x.model_path, cache_folder=x.cache_dir, local_files_only=x.local_files_only)
-                ).to(device),
+                ).to(device)),
                 query_prefix='Pytanie: ',
                 passage_prefix='</s>',
             )
     else:
         if return_confidence_provider:
             return NarrowRangeSemanticConfidenceProvider(low_relevance_threshold=0.55, max_relevance=0.7)
+        model_id = get_text_embedding_model_id(language)
         return TextModelWithConfig(
-            model=try_loading_cached_or_download(
-                'BAAI/bge-large-en-v1.5',
+            model=optimize_text_embedding_model_for_cpu_inference(model_id, try_loading_cached_or_download(
+                model_id,
                 lambda x: SentenceTransformer(x.model_path, cache_folder=x.cache_dir, local_files_only=x.local_files_only)
-            ).to(device),
+            ).to(device)),
         )
 
 def get_clip_model(return_confidence_provider: bool=False) -> tuple[CLIPProcessor, CLIPModel]:
@@ -136,19 +211,20 @@ def get_clip_model(return_confidence_provider: bool=False) -> tuple[CLIPProcesso
 
     torch_dtype = torch.float16 if str(device) == 'cuda' else torch.float32
     clip_processor = try_loading_cached_or_download(
-        "openai/clip-vit-base-patch32",
+        CLIP_MODEL_ID,
         lambda x: CLIPProcessor.from_pretrained(x.model_path, cache_dir=x.cache_dir, local_files_only=x.local_files_only, torch_dtype=torch_dtype),
         cache_dir_must_have_file='preprocessor_config.json'
     )
     clip_model = try_loading_cached_or_download(
-        "openai/clip-vit-base-patch32",
+        CLIP_MODEL_ID,
         lambda x: CLIPModel.from_pretrained(x.model_path, cache_dir=x.cache_dir, local_files_only=x.local_files_only, torch_dtype=torch_dtype),
         cache_dir_must_have_file='pytorch_model.bin'
     ).to(device)
-    return clip_processor, clip_model
+    optimized_clip_model, inference_backend_tags[CLIP_MODEL_ID] = optimize_for_cpu_inference(CLIP_MODEL_ID, clip_model, lambda export_dir: OnnxCLIPModel.export(
+        clip_model, clip_processor, export_dir, quantize=cpu_inference_config.quantize, num_threads=cpu_inference_config.num_threads))
+    return clip_processor, optimized_clip_model
 
-def get_transcription_model() -> tuple[Pipeline, int]:
-    torch_dtype = torch.float16 if str(device) == 'cuda' else torch.float32
+def get_transcription_model_id() -> str:
     model_id = os.getenv(TRANSCRIPTION_MODEL_ENV)
     if model_id is None:
         if str(device) == 'cuda' or is_apple_silicon():
@@ -156,6 +232,11 @@ def get_transcription_model() -> tuple[Pipeline, int]:
         else:
             # see https://huggingface.co/openai/whisper-large-v3-turbo#model-details for alternatives
             model_id = "openai/whisper-base"
+    return model_id
+
+def get_transcription_model() -> tuple[Pipeline, int]:
+    torch_dtype = torch.float16 if str(device) == 'cuda' else torch.float32
+    model_id = get_transcription_model_id()
     # TODO flash attention
     model = try_loading_cached_or_download(
         model_id,
@@ -180,7 +261,7 @@ def get_transcription_model() -> tuple[Pipeline, int]:
     return pipe, sampling_rate
 
 def get_vision_lm_model() -> VisionLMModel:
-    model_id = "deepseek-ai/Janus-Pro-1B"
+    model_id = VISION_LM_MODEL_ID
     chat_processor = try_loading_cached_or_download(
         model_id,
         lambda x: VLChatProcessor.from_pretrained(x.model_path, cache_dir=x.cache_dir, local_files_only=x.local_files_only),
@@ -194,7 +275,23 @@ def get_vision_lm_model() -> VisionLMModel:
     ).to(device).eval()
     return VisionLMModel(model=model, chat_processor=chat_processor)
 
-pl_model_manager = ModelManager(model_providers={
+def get_model_memory_budget() -> ModelMemoryBudget:
+    # by default models can use half of RAM and most of GPU memory, the rest is left for inference and other applications
+    if (ram_budget_mb := os.getenv(MODEL_RAM_BUDGET_MB_ENV)) is not None:
+        ram_bytes = int(ram_budget_mb) * 2**20
+    elif (total_ram := get_total_ram_bytes()) is not None:
+        ram_bytes = total_ram // 2
+    else:
+        ram_bytes = None
+    if (vram_budget_mb := os.getenv(MODEL_VRAM_BUDGET_MB_ENV)) is not None:
+        vram_bytes = int(vram_budget_mb) * 2**20
+    elif str(device) == 'cuda':
+        vram_bytes = int(torch.cuda.get_device_properties(device).total_memory * 0.8)
+    else:
+        vram_bytes = None
+    return ModelMemoryBudget(ram_bytes=ram_bytes, vram_bytes=vram_bytes)
+
+pl_model_manager = ModelManager(name='pl', memory_budget=get_model_memory_budget(), model_providers={
     ModelType.OCR: lambda: get_ocr_model('pl'),
     ModelType.TRANSCRIBER: get_transcription_model,
     ModelType.TEXT_EMBEDDING: lambda: get_text_embedding_model('pl'),
@@ -203,7 +300,7 @@ pl_model_manager = ModelManager(model_providers={
     ModelType.VISION_LM: get_vision_lm_model
 })
 
-en_model_manager = SecondaryModelManager(primary=pl_model_manager, owned_model_providers={
+en_model_manager = SecondaryModelManager(primary=pl_model_manager, name='en', owned_model_providers={
     ModelType.OCR: lambda: get_ocr_model('en'),
     ModelType.TEXT_EMBEDDING: lambda: get_text_embedding_model('en'),
     ModelType.LEMMATIZER: lambda: get_lemmatizer_model('en'),
@@ -225,17 +322,72 @@ hybrid_search_confidence_provider_factories = {
     )
 }
 
+# shared by all directories, so that duplicated files are analyzed only once,
+# versions make sure that outputs of different models are not mixed
+derived_data_store = DerivedDataStore(CONFIG_DIR.joinpath('derived_data'), artifact_versions={
+    DerivedArtifactType.TRANSCRIPT: get_transcription_model_id() + '-' + TranscriptionSettings.from_env().get_version_tag(),
+    DerivedArtifactType.LLM_TEXT: VISION_LM_MODEL_ID + '-' + hashlib.sha256(
+        VisionLMEngine._get_image_description_prompt().encode(), usedforsecurity=False).hexdigest()[:8],
+    # replaced by versions of the backend actually applied to the model, see get_embedding_versions
+    DerivedArtifactType.CLIP_IMAGE: CLIP_MODEL_ID + '-' + get_inference_backend_tag(),
+    DerivedArtifactType.CLIP_VIDEO: CLIP_MODEL_ID + '-' + get_inference_backend_tag(),
+})
+
+async def get_embedding_versions(language: Language) -> EmbeddingVersions:
+    '''Returns versions of embeddings stored in directories, embedding models are loaded to find out which backends they use'''
+    model_manager = model_managers[language]
+    text_model_id = get_text_embedding_model_id(language)
+    for model_type, model_id in ((ModelType.TEXT_EMBEDDING, text_model_id), (ModelType.CLIP, CLIP_MODEL_ID)):
+        if model_id in inference_backend_tags:
+            continue
+        try:
+            async with model_manager.use(model_type):
+                await model_manager.get_model(model_type)
+        except Exception as e:
+            # embeddings can't be computed without the model anyway
+            logger.warning(f'failed to load {model_id} to check its inference backend', exc_info=e)
+            inference_backend_tags[model_id] = get_inference_backend_tag(
+                onnx=cpu_inference_config.backend == 'onnx' and is_onnx_runtime_available(), quantized=cpu_inference_config.quantize)
+
+    clip_version = CLIP_MODEL_ID + '-' + inference_backend_tags[CLIP_MODEL_ID]
+    derived_data_store.artifact_versions[DerivedArtifactType.CLIP_IMAGE] = clip_version
+    derived_data_store.artifact_versions[DerivedArtifactType.CLIP_VIDEO] = clip_version
+    text_types = (StoredEmbeddingType.DESCRIPTION, StoredEmbeddingType.OCR_TEXT, StoredEmbeddingType.TRANSCRIPTION_TEXT, StoredEmbeddingType.LLM_TEXT)
+    return EmbeddingVersions(
+        current={
+            **{emb_type: text_model_id + '-' + inference_backend_tags[text_model_id] for emb_type in text_types},
+            StoredEmbeddingType.CLIP_IMAGE: clip_version,
+            StoredEmbeddingType.CLIP_VIDEO: clip_version + '-' + ClipVideoFrameSelectionConfig().get_version_tag(),
+        },
+        # before versions were recorded models always ran with pytorch without quantization, clip video
+        # embeddings are not listed, they were computed from evenly spaced frames instead of keyframes
+        legacy={
+            **{emb_type: text_model_id + '-' + get_inference_backend_tag() for emb_type in text_types},
+            StoredEmbeddingType.CLIP_IMAGE: CLIP_MODEL_ID + '-' + get_inference_backend_tag(),
+        }
+    )
+
 directory_context_holder = DirectoryContextHolder(
     model_managers=model_managers,
     hybrid_search_confidence_provider_factories=hybrid_search_confidence_provider_factories,
-    device=device
+    device=device,
+    derived_data_store=derived_data_store,
+    max_concurrent_inits=int(os.getenv(MAX_CONCURRENT_DIRECTORY_INITS_ENV, '2')),
+    micro_batcher_config=MicroBatcherConfig(
+        max_wait_seconds=float(os.getenv(MICRO_BATCH_MAX_WAIT_MS_ENV, '3')) / 1000,
+        max_batch_size=int(os.getenv(MICRO_BATCH_MAX_SIZE_ENV, '32'))
+    ),
+    ocr_config=ocr_config,
+    llm_description_scheduler_config=LLMDescriptionSchedulerConfig.from_env()
+        if os.getenv(BACKGROUND_LLM_DESCRIPTIONS_ENV, 'true') == 'true' else None,
+    embedding_versions_provider=get_embedding_versions
 )
 
 app_db = Database(CONFIG_DIR, log_sql=os.getenv(LOG_SQL_ENV, 'false') == 'true')
 
-model_eager_loader = ModelEagerLoader(
+model_prewarmer = ModelPrewarmer(
     model_managers=model_managers,
-    model_types_to_eager_load=[ModelType.TEXT_EMBEDDING, ModelType.CLIP, ModelType.LEMMATIZER],
+    default_model_types=[ModelType.TEXT_EMBEDDING, ModelType.CLIP, ModelType.LEMMATIZER],
 )
 
 _teardown_requested = False
@@ -243,9 +395,17 @@ _init_schedule_periodic_refresh_task: Optional[asyncio.Task] = None
 _init_directories_in_background_task: Optional[asyncio.Task] = None
 
 async def on_http_request_middleware(request: Request, call_next: Callable[[Request], Any]) -> Any:
-    async with app_db.session() as sess:
-        used_languages = set(x.primary_language for x in await DirectoryRepository(sess).get_all())
-    await model_eager_loader.ensure_eager_models_loaded_in_background(used_languages)
+    if not (request.method == 'GET' and request.url.path.startswith('/directory/')):
+        # directory status is polled periodically by the frontend, that is not user activity
+        directory_context_holder.idle_monitor.on_activity()
+    await model_prewarmer.on_user_activity(directory_context_holder.get_used_languages())
+    if dir_name := request.headers.get(DIRECTORY_NAME_HEADER):
+        # user is looking at this directory, make it available sooner if it waits for initialization
+        directory_context_holder.prioritize_directory_initialization(dir_name)
+    if request.method == 'POST' and request.url.path.startswith('/files/'):
+        # search and find similar requests, models used by them will be prewarmed
+        with model_prewarmer.track_queries():
+            return await call_next(request)
     return await call_next(request)
 
 async def init():
@@ -254,6 +414,7 @@ async def init():
         os.environ["TOKENIZERS_PARALLELISM"] = "false"
     if is_windows() and 'HF_HUB_DISABLE_SYMLINKS_WARNING' not in os.environ:
         os.environ['HF_HUB_DISABLE_SYMLINKS_WARNING'] = "1"
+    configure_cpu_threads(cpu_inference_config)
     logger.info(f'initializing shared app db in directory: {CONFIG_DIR}')
     await app_db.init_db()
     async def init_directories_in_background():
@@ -261,7 +422,7 @@ async def init():
         global _init_schedule_periodic_refresh_task
         async with app_db.session() as sess:
             registered_directories = await DirectoryRepository(sess).get_all()
-        for directory in registered_directories:
+        async def register_directory(directory: RegisteredDirectory):
             logger.info(f'initializing registered directory: {directory.name}, from: {directory.path}')
             try:
                 await directory_context_holder.register_directory(directory.name, directory.path, directory.primary_language, directory.should_generate_llm_descriptions)
@@ -272,6 +433,9 @@ async def init():
                     raise
                 logger.error(f'Initialization of directory: {directory.name} has been cancelled, proceeding with remaining directories')
 
+        # directories are initialized concurrently, holder limits how many of them are processed at once
+        await asyncio.gather(*[register_directory(x) for x in registered_directories])
+
         directory_context_holder.set_initialized()
         _init_directories_in_background_task = None
         _init_schedule_periodic_refresh_task = asyncio.create_task(schedule_periodic_refresh())
@@ -281,20 +445,10 @@ async def init():
 async def schedule_periodic_refresh():
     global _init_schedule_periodic_refresh_task
     # since directory content change watching is not guaranteed to capture every change
-    # we schedule reloads to ensure consistency if app is not restarted for longer time
+    # we periodically reconcile directories with the file system, only changed files are processed
+    # and directories remain available
     await asyncio.sleep(REFRESH_PERIOD_SECONDS)
-    async with app_db.session() as sess:
-        registered_directories = await DirectoryRepository(sess).get_all()
-    for directory in registered_directories:
-        try:
-            await directory_context_holder.unregister_directory(directory.name)
-            await directory_context_holder.register_directory(directory.name, directory.path, directory.primary_language, directory.should_generate_llm_descriptions)
-        except Exception as e:
-            logger.error(f'Failed to refresh directory: {directory.name}', exc_info=e)
-        except asyncio.CancelledError as e:
-            if _teardown_requested:
-                raise
-            logger.error(f'Refreshing directory: {directory.name} has been cancelled, proceeding with remaining directories')
+    await directory_context_holder.reconcile_directories()
     _init_schedule_periodic_refresh_task = asyncio.create_task(schedule_periodic_refresh())
 
 def get_model_managers() -> dict[Language, ModelManager]:
@@ -342,6 +496,9 @@ def get_metadata_editor(
     ctx: Annotated[DirectoryContext, Depends(get_directory_context)],
     file_repo: Annotated[FileMetadataRepository, Depends(get_file_repo)]
 ) -> MetadataEditor:
+    if not ctx.context_ready:
+        # initialization might still process the file and would overwrite the changes
+        raise HTTPException(status_code=503, detail='directory is still initializing, editing is not available yet')
     return ctx.get_metadata_editor(file_repo)
 
 def get_search_service(
@@ -357,5 +514,5 @@ async def teardown():
         _init_directories_in_background_task.cancel()
     if _init_schedule_periodic_refresh_task is not None:
         _init_schedule_periodic_refresh_task.cancel()
-    await model_eager_loader.teardown()
+    await model_prewarmer.teardown()
     await directory_context_holder.teardown()
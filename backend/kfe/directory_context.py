@@ -1,24 +1,33 @@
 
 import asyncio
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional
+from typing import Any, Awaitable, Callable, Optional
 
 import torch
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from kfe.features.clip_engine import CLIPEngine
 from kfe.features.lemmatizer import Lemmatizer
-from kfe.features.ocr_engine import OCREngine
+from kfe.features.ocr_engine import OCRConfig, OCREngine
 from kfe.features.text_embedding_engine import TextEmbeddingEngine
-from kfe.features.transcriber import PipelineBasedTranscriber
+from kfe.features.transcriber import (PipelineBasedTranscriber,
+                                     TranscriberEngine, TranscriptionSettings)
 from kfe.features.vision_lm_engine import VisionLMEngine
 from kfe.persistence.db import Database
-from kfe.persistence.embeddings import EmbeddingPersistor
-from kfe.persistence.file_metadata_repository import FileMetadataRepository
-from kfe.persistence.model import FileType, RegisteredDirectory
+from kfe.persistence.derived_data_store import DerivedDataStore
+from kfe.persistence.embeddings import EmbeddingPersistor, EmbeddingVersions
+from kfe.persistence.file_metadata_repository import (FileMetadataRepository,
+                                                      get_changed_attributes)
+from kfe.persistence.model import (FileMetadata, FileType,
+                                   RegisteredDirectory)
 from kfe.search.query_parser import SearchQueryParser
 from kfe.service.embedding_processor import EmbeddingProcessor
-from kfe.service.file_indexer import FileIndexer
+from kfe.service.file_indexer import DirectoryDiff, FileIndexer
+from kfe.service.init_checkpointer import InitCheckpointer
+from kfe.service.llm_description_scheduler import (
+    LLMDescriptionScheduler, LLMDescriptionSchedulerConfig)
 from kfe.service.metadata_editor import MetadataEditor
 from kfe.service.ocr_service import OCRService
 from kfe.service.search import SearchService
@@ -27,15 +36,23 @@ from kfe.service.transcription_service import TranscriptionService
 from kfe.service.vision_lm_service import VisionLMService
 from kfe.utils.constants import (LOG_SQL_ENV, PRELOAD_THUMBNAILS_ENV,
                                  REGENERATE_LLM_DESCRIPTIONS_ENV,
-                                 RETRANSCRIBE_AUTO_TRANSCRIBED_ENV, Language)
+                                 RETRANSCRIBE_AUTO_TRANSCRIBED_ENV,
+                                 TRANSCRIPTION_BATCH_SIZE_ENV,
+                                 VISION_LM_BATCH_SIZE_ENV, Language)
+from kfe.utils.directory_init_scheduler import DirectoryInitScheduler
 from kfe.utils.file_change_watcher import FileChangeWatcher
+from kfe.utils.file_event_queue import FileEventBatch, FileEventQueue
+from kfe.utils.idle_monitor import IdleMonitor
 from kfe.utils.hybrid_search_confidence_providers import \
     HybridSearchConfidenceProviderFactory
-from kfe.utils.init_progress_tracker import InitProgressTracker
+from kfe.utils.init_progress_tracker import InitProgressTracker, InitState
 from kfe.utils.lexical_search_engine_initializer import \
     LexicalSearchEngineInitializer
 from kfe.utils.log import logger
+from kfe.utils.micro_batcher import MicroBatcherConfig
 from kfe.utils.model_manager import ModelManager, ModelType
+from kfe.utils.pipeline_scheduler import (PipelineScheduler, PipelineStage,
+                                          StageProcessor)
 from kfe.utils.query_results_cache import QueryResultsCache
 
 
@@ -43,13 +60,27 @@ class DirectoryContext:
     def __init__(self, root_dir: Path, db_dir: Path, model_manager: ModelManager,
                  hybrid_search_confidence_provider_factory: HybridSearchConfidenceProviderFactory,
                  primary_language: Language, init_progress_tracker: InitProgressTracker,
-                 should_generate_llm_descriptions: bool=False):
+                 derived_data_store: DerivedDataStore, should_generate_llm_descriptions: bool=False,
+                 text_embedding_engine: Optional[TextEmbeddingEngine]=None, clip_engine: Optional[CLIPEngine]=None,
+                 ocr_config: Optional[OCRConfig]=None, idle_monitor: Optional[IdleMonitor]=None,
+                 llm_description_scheduler_config: Optional[LLMDescriptionSchedulerConfig]=None,
+                 embedding_versions_provider: Optional[Callable[[Language], Awaitable[EmbeddingVersions]]]=None):
         self.root_dir = root_dir
         self.db_dir = db_dir
         self.model_manager = model_manager
         self.hybrid_search_confidence_provider_factory = hybrid_search_confidence_provider_factory
         self.primary_language = primary_language
+        self.derived_data_store = derived_data_store
         self.should_generate_llm_descriptions = should_generate_llm_descriptions
+        # engines can be shared by contexts of the same language, so that their concurrent requests are batched together
+        self.text_embedding_engine = text_embedding_engine
+        self.clip_engine = clip_engine
+        self.ocr_config = ocr_config
+        self.idle_monitor = idle_monitor if idle_monitor is not None else IdleMonitor()
+        # None disables generation of llm descriptions for files added at runtime
+        self.llm_description_scheduler_config = llm_description_scheduler_config
+        self.llm_description_scheduler: Optional[LLMDescriptionScheduler] = None
+        self.embedding_versions_provider = embedding_versions_provider
         self.query_cache = QueryResultsCache()
         self.init_lock = asyncio.Lock()
         self.init_progress_tracker = init_progress_tracker
@@ -57,84 +88,190 @@ class DirectoryContext:
         self.file_change_watcher: FileChangeWatcher = None
 
         self.context_ready = False 
-        self.init_queue: list[tuple[Path, bool]] = []
-        self.paths_waiting_for_deletion: set[Path] = set()
-        self.file_creation_in_progress_paths: set[Path] = set()
+        self.context_queryable = False
+        # events received before context is queryable wait in the queue until its consumer is started
+        self.file_event_queue = FileEventQueue()
+        # serializes writes of initialization and file events handling, sqlite allows only one writer
+        self.db_write_lock = asyncio.Lock()
+        self.files_deleted_during_init: set[int] = set()
+        # fingerprints of files which are not media files, so that reconciliation doesn't check them every time
+        self.unsupported_files: dict[str, tuple[int, int]] = {}
+        self.init_checkpointer: Optional[InitCheckpointer] = None
 
     async def init_directory_context(self, device: torch.device):
         async with self.init_lock:
             self.db = Database(self.db_dir, log_sql=os.getenv(LOG_SQL_ENV, 'false') == 'true')
-            self.thumbnail_manager = ThumbnailManager(self.root_dir)
+            self.thumbnail_manager = ThumbnailManager(self.root_dir, derived_data_store=self.derived_data_store)
             self.lemmatizer = Lemmatizer(self.model_manager)
-            self.ocr_engine = OCREngine(self.model_manager, ['en'] if self.primary_language == 'en' else [self.primary_language, 'en'])
-            self.transcriber = PipelineBasedTranscriber(self.model_manager)
-            self.embedding_persistor = EmbeddingPersistor(self.root_dir)
-
-            self.text_embedding_engine = TextEmbeddingEngine(self.model_manager)
-            self.clip_engine = CLIPEngine(self.model_manager, device)
-            self.embedding_processor = EmbeddingProcessor(self.root_dir, self.embedding_persistor, self.text_embedding_engine, self.clip_engine)
+            self.ocr_engine = OCREngine(self.model_manager, ['en'] if self.primary_language == 'en' else [self.primary_language, 'en'],
+                config=self.ocr_config)
+            transcription_settings = TranscriptionSettings.from_env()
+            self.transcriber = PipelineBasedTranscriber(self.model_manager,
+                max_part_length_seconds=transcription_settings.max_part_length_seconds,
+                max_num_parts=transcription_settings.max_num_parts,
+                batch_size=int(os.getenv(TRANSCRIPTION_BATCH_SIZE_ENV, '8')),
+                vad_config=transcription_settings.vad_config)
+            self.vision_lm_engine = VisionLMEngine(self.model_manager, batch_size=int(os.getenv(VISION_LM_BATCH_SIZE_ENV, '4')))
+            embedding_versions = None
+            if self.embedding_versions_provider is not None:
+                embedding_versions = await self.embedding_versions_provider(self.primary_language)
+            self.embedding_persistor = EmbeddingPersistor(self.root_dir, versions=embedding_versions)
+
+            if self.text_embedding_engine is None:
+                self.text_embedding_engine = TextEmbeddingEngine(self.model_manager)
+            if self.clip_engine is None:
+                self.clip_engine = CLIPEngine(self.model_manager, device)
+            self.embedding_processor = EmbeddingProcessor(self.root_dir, self.embedding_persistor, self.text_embedding_engine, self.clip_engine,
+                derived_data_store=self.derived_data_store)
 
             logger.debug(f'initializing database for {self.root_dir}')
             await self.db.init_db()
 
+            self.lexical_search_initializer = LexicalSearchEngineInitializer(self.lemmatizer)
+            self.file_change_watcher = FileChangeWatcher(self.root_dir, self.file_event_queue,
+                    ignored_files=Database.get_db_file_names())
+
+            logger.debug(f'initializg file change watcher for directory: {self.root_dir}')
+            self.file_change_watcher.start_watcher_thread()
+
             async with self.db.session() as sess:
                 async with sess.begin():
-                    file_repo = FileMetadataRepository(sess)
-                    file_indexer = FileIndexer(self.root_dir, file_repo)
-                    ocr_service = OCRService(self.root_dir, file_repo, self.ocr_engine)
-                    transcription_service = TranscriptionService(self.root_dir, self.transcriber, file_repo)
-                    self.lexical_search_initializer = LexicalSearchEngineInitializer(self.lemmatizer, file_repo)
-                    self.file_change_watcher = FileChangeWatcher(self.root_dir, self._on_file_created, self._on_file_deleted, self._on_file_moved,
-                            ignored_files=set([Database.DB_FILE_NAME, f'{Database.DB_FILE_NAME}-journal']))
+                    logger.info(f'ensuring directory {self.root_dir} initialized')
+                    await FileIndexer(self.root_dir, FileMetadataRepository(sess)).ensure_directory_initialized()
+
+            # objects are shared by concurrent stages, session is used only to load them
+            async with self.db.session(expire_on_commit=False) as sess:
+                logger.info(f'initializing files of directory {self.root_dir}')
+                await self._init_files(sess)
+
+            logger.info(f'directory {self.root_dir} ready')
+            await self._directory_context_initialized()
+
+    async def _init_files(self, sess: AsyncSession):
+        # stages run concurrently, file enters a stage after it passed all stages that the stage depends on,
+        # e.g. embeddings are created after OCR text of that file is available
+        file_repo = FileMetadataRepository(sess)
+        all_files = await file_repo.load_all_files()
+        relemmatize_and_retranscribe = os.getenv(RETRANSCRIBE_AUTO_TRANSCRIBED_ENV, 'false') == 'true'
+
+        def skip_deleted(files: list[FileMetadata]) -> list[FileMetadata]:
+            return [f for f in files if int(f.id) not in self.files_deleted_during_init]
+
+        # results are committed periodically, so they are visible to queries served during initialization
+        # and are not lost if initialization is interrupted
+        checkpointer = InitCheckpointer(self.db, self.db_write_lock, self.init_progress_tracker)
+        await checkpointer.load()
+        self.init_checkpointer = checkpointer
+
+        async def update_files(files: list[FileMetadata]):
+            await checkpointer.add(skip_deleted(files))
+
+        ocr_service = OCRService(self.root_dir, file_repo, self.ocr_engine, self.derived_data_store)
+        ocr_file_ids = set(int(f.id) for f in await ocr_service.get_files_requiring_ocr())
+        async def perform_ocr(files: list[FileMetadata], engine: OCREngine.Engine):
+            await ocr_service.run_ocrs(files, engine)
+            await update_files(files)
+
+        transcription_service = TranscriptionService(self.root_dir, self.transcriber, file_repo, self.derived_data_store)
+        transcription_file_ids = set(int(f.id) for f in await transcription_service.get_files_requiring_transcription(
+            retranscribe_all_auto_trancribed=relemmatize_and_retranscribe))
+        async def transcribe(files: list[FileMetadata], engine: TranscriberEngine):
+            await transcription_service.transcribe_many(files, engine)
+            await update_files(files)
+
+        vision_lm_engine = self.vision_lm_engine
+        vision_lm_service = VisionLMService(self.root_dir, vision_lm_engine, file_repo, self.derived_data_store)
+        llm_description_file_ids = set()
+        if self.should_generate_llm_descriptions:
+            llm_description_file_ids = set(int(f.id) for f in await vision_lm_service.get_files_requiring_description(
+                regenerate_all=os.getenv(REGENERATE_LLM_DESCRIPTIONS_ENV, 'false') == 'true'))
+        async def generate_llm_descriptions(files: list[FileMetadata], engine: VisionLMEngine.Engine):
+            await vision_lm_service.generate_descriptions(files, engine)
+            await update_files(files)
+
+        async def register_lexical(files: list[FileMetadata], engine: Lemmatizer.Engine):
+            dirty_files = []
+            for f in files:
+                if await self.lexical_search_initializer.register_file(f, engine, relemmatize_transcriptions=relemmatize_and_retranscribe):
+                    dirty_files.append(f)
+            await update_files(dirty_files)
+
+        # files are detached, they are never flushed from this session (checkpointer writes their changes
+        # to rows loaded in its own sessions) and the read transaction doesn't stay open for the whole initialization
+        await sess.close()
+
+        self.embedding_processor.begin_init(all_files)
+        self._directory_context_queryable()
+        @asynccontextmanager
+        async def use_embedding_models():
+            async with (
+                self.model_manager.use(ModelType.TEXT_EMBEDDING),
+                self.model_manager.use(ModelType.CLIP)
+            ):
+                yield
+        async def init_embeddings(files: list[FileMetadata], _):
+            for f in files:
+                await self.embedding_processor.init_file_embeddings(f)
+            # embedding generation can fail, that is remembered in the db
+            await update_files(files)
+
+        self.thumbnail_manager.remove_thumbnails_of_deleted_files(all_files)
+        preload_thumbnails = os.getenv(PRELOAD_THUMBNAILS_ENV, 'true') == 'true'
+        async def load_thumbnails(files: list[FileMetadata], _):
+            for f in files:
+                await self.thumbnail_manager.get_encoded_file_thumbnail(f)
+
+        def skipping_deleted(process: StageProcessor) -> StageProcessor:
+            # files can be deleted by file events which are handled concurrently with initialization
+            async def _process(files: list[FileMetadata], stage_context: Any):
+                if files := skip_deleted(files):
+                    await process(files, stage_context)
+            return _process
+
+        text_stages = ('ocr', 'transcription', 'llm-description')
+        scheduler = PipelineScheduler([
+            PipelineStage('ocr', skipping_deleted(perform_ocr), accepts=lambda f: int(f.id) in ocr_file_ids,
+                context_factory=self.ocr_engine.run, model_types=(ModelType.OCR,), max_batch_size=self.ocr_engine.get_preferred_batch_size(), progress_state=InitState.OCR,
+                already_processed=checkpointer.get_already_processed(InitState.OCR, len(ocr_file_ids))),
+            PipelineStage('transcription', skipping_deleted(transcribe), accepts=lambda f: int(f.id) in transcription_file_ids,
+                context_factory=self.transcriber.run, model_types=(ModelType.TRANSCRIBER,), max_batch_size=self.transcriber.batch_size,
+                progress_state=InitState.TRANSCIPTION,
+                already_processed=checkpointer.get_already_processed(InitState.TRANSCIPTION, len(transcription_file_ids))),
+            PipelineStage('llm-description', skipping_deleted(generate_llm_descriptions), accepts=lambda f: int(f.id) in llm_description_file_ids,
+                context_factory=vision_lm_engine.run, model_types=(ModelType.VISION_LM,), max_batch_size=vision_lm_engine.batch_size,
+                progress_state=InitState.LLM_DESCRIPTION,
+                already_processed=checkpointer.get_already_processed(InitState.LLM_DESCRIPTION, len(llm_description_file_ids))),
+            PipelineStage('lexical', skipping_deleted(register_lexical), depends_on=text_stages,
+                context_factory=self.lemmatizer.run, model_types=(ModelType.LEMMATIZER,), max_batch_size=32, progress_state=InitState.LEXICAL),
+            PipelineStage('embedding', skipping_deleted(init_embeddings), depends_on=text_stages,
+                context_factory=use_embedding_models, model_types=(ModelType.TEXT_EMBEDDING, ModelType.CLIP), max_batch_size=8,
+                progress_state=InitState.EMBEDDING),
+            PipelineStage('thumbnails', skipping_deleted(load_thumbnails), accepts=lambda _: preload_thumbnails,
+                max_concurrency=4, max_batch_size=16, progress_state=InitState.THUMBNAILS),
+        ], self.model_manager, self.init_progress_tracker)
 
-                    logger.debug(f'initializg file change watcher for directory: {self.root_dir}')
-                    self.file_change_watcher.start_watcher_thread(asyncio.get_running_loop())
+        try:
+            await scheduler.run(all_files)
+        except BaseException:
+            # cancelled or failed, keep results processed so far, next initialization resumes from there
+            await checkpointer.commit()
+            raise
+        finally:
+            self.init_checkpointer = None
+        await checkpointer.commit(completed=True)
+        if (prefilter := self.ocr_engine.screenshot_prefilter) is not None and prefilter.checked:
+            logger.info(f'OCR skipped for {prefilter.skipped} of {prefilter.checked} images recognized as camera photos ' +
+                f'({prefilter.get_skip_ratio() * 100:.0f}%) in {self.root_dir}')
 
-                    logger.info(f'ensuring directory {self.root_dir} initialized')
-                    await file_indexer.ensure_directory_initialized()
-
-                    await self.model_manager.flush_all_unused()
-
-                    logger.info(f'initializing OCR services for directory {self.root_dir}')
-                    await ocr_service.init_ocrs(self.init_progress_tracker)
-
-                    logger.info(f'initializing transcription services for directory {self.root_dir}')
-                    await transcription_service.init_transcriptions(self.init_progress_tracker,
-                        retranscribe_all_auto_trancribed=os.getenv(RETRANSCRIBE_AUTO_TRANSCRIBED_ENV, 'false') == 'true')
-                    
-                    await self.model_manager.flush_all_unused()
-                    
-                    if self.should_generate_llm_descriptions:
-                        logger.info(f'initializing vision LM description services for directory {self.root_dir}')
-                        vision_lm_engine = VisionLMEngine(self.model_manager)
-                        vision_lm_service = VisionLMService(self.root_dir, vision_lm_engine, file_repo)
-                        await vision_lm_service.init_vision_lm_descriptions(self.init_progress_tracker,
-                            regenerate_all=os.getenv(REGENERATE_LLM_DESCRIPTIONS_ENV, 'false') == 'true')
-                        await self.model_manager.flush_all_unused()
-
-                    logger.info(f'initializing lexical search engines for directory {self.root_dir}')
-                    await self.lexical_search_initializer.init_search_engines(self.init_progress_tracker, 
-                        relemmatize_transcriptions=os.getenv(RETRANSCRIBE_AUTO_TRANSCRIBED_ENV, 'false') == 'true')
-
-                    logger.info(f'initalizing embeddings for directory {self.root_dir}')
-                    async with (
-                        self.model_manager.use(ModelType.TEXT_EMBEDDING),
-                        self.model_manager.use(ModelType.CLIP)
-                    ):
-                        await self.embedding_processor.init_embeddings(file_repo, self.init_progress_tracker)
-
-                    await self.model_manager.flush_all_unused()
-                    
-                    self.thumbnail_manager.remove_thumbnails_of_deleted_files(await file_repo.load_all_files())
-                    if os.getenv(PRELOAD_THUMBNAILS_ENV, 'true') == 'true':
-                        logger.debug(f'preloading thumbnails for directory {self.root_dir}')
-                        await self.thumbnail_manager.preload_thumbnails(await file_repo.load_all_files(), self.init_progress_tracker)
-
-                    logger.info(f'directory {self.root_dir} ready')
-                    await self._directory_context_initialized()
+        self.embedding_processor.finish_init()
+        self.files_deleted_during_init.clear()
 
     async def teardown_directory_context(self):
+        if self.llm_description_scheduler is not None:
+            await self.llm_description_scheduler.cancel()
         async with self.init_lock:
+            # queue must be closed first, watcher thread might be blocked on it
+            await self.file_event_queue.close()
             if self.file_change_watcher is not None:
                 self.file_change_watcher.stop()
             if self.db is not None:
@@ -147,6 +284,7 @@ class DirectoryContext:
             self.lexical_search_initializer.description_lexical_search_engine,
             self.lexical_search_initializer.transcript_lexical_search_engine,
             self.lexical_search_initializer.ocr_text_lexical_search_engine,
+            self.lexical_search_initializer.llm_description_lexical_search_engine,
             self.embedding_processor,
             self.lemmatizer
         )
@@ -166,98 +304,214 @@ class DirectoryContext:
             include_clip_in_hybrid_search=self.primary_language == 'en', # clip model requires english queries
         )
 
+    def is_queryable(self) -> bool:
+        return self.context_queryable
+
+    def get_retriever_coverage(self) -> dict[str, float]:
+        lexical = self.init_progress_tracker.get_state_progress(InitState.LEXICAL)
+        embedding = self.init_progress_tracker.get_state_progress(InitState.EMBEDDING)
+        return {
+            'lexical': lexical,
+            'semantic': embedding,
+            'clip': embedding,
+            'llm_description': min(self.init_progress_tracker.get_state_progress(InitState.LLM_DESCRIPTION), lexical, embedding),
+        }
+
+    async def reconcile_with_file_system(self):
+        '''
+        Detects changes missed by the file watcher and handles them the same way as watcher events,
+        context remains available and search structures are updated only for changed files.
+        '''
+        if not self.context_ready:
+            return
+        async with self.db_write_lock, self.db.session() as sess:
+            async with sess.begin():
+                diff = await FileIndexer(self.root_dir, FileMetadataRepository(sess)).compute_directory_diff(
+                    ignored_files=self.file_change_watcher.ignored_files, unsupported_files=self.unsupported_files)
+        if not (diff.created or diff.deleted or diff.modified):
+            logger.debug(f'directory {self.root_dir} is consistent with the database')
+            return
+        logger.info(f'reconciling directory {self.root_dir}: {len(diff.created)} created, {len(diff.deleted)} deleted, {len(diff.modified)} modified files')
+        # putting events can block when the queue is full, it is drained by the consumer running on this loop
+        await asyncio.get_running_loop().run_in_executor(None, self._enqueue_directory_diff, diff)
+
+    def _enqueue_directory_diff(self, diff: DirectoryDiff):
+        for name in diff.deleted:
+            self.file_event_queue.put_deleted(self.root_dir.joinpath(name))
+        for name in diff.created:
+            self.file_event_queue.put_created(self.root_dir.joinpath(name))
+        # modified files are updated in place, they keep data entered by the user
+        for name in diff.modified:
+            self.file_event_queue.put_modified(self.root_dir.joinpath(name))
+
+    def _directory_context_queryable(self):
+        # search structures exist and are filled as files are processed, file events are handled from now on
+        self.context_queryable = True
+        self.file_event_queue.start_consumer(self._on_file_events)
+
     async def _directory_context_initialized(self):
         self.context_ready = True
-        for path, is_create in self.init_queue:
-            if is_create:
-                await self._on_file_created(path)
-            else:
-                await self._on_file_deleted(path)
         self.init_progress_tracker.set_ready()
-
-    async def _on_file_created(self, path: Path):
+        if self.should_generate_llm_descriptions and self.llm_description_scheduler_config is not None:
+            self.llm_description_scheduler = LLMDescriptionScheduler(self.root_dir, self.db, self.db_write_lock, self.model_manager,
+                self.vision_lm_engine, self.idle_monitor, self.get_metadata_editor, self.derived_data_store,
+                config=self.llm_description_scheduler_config)
+            self.llm_description_scheduler.start()
+
+    async def _on_file_events(self, batch: FileEventBatch):
+        # deletions go first, recreated files are in both lists
+        self.idle_monitor.on_activity()
         self.query_cache.invalidate()
-        if not self.context_ready:
-            self.init_queue.append((path, True))
-            return
-        
-        self.file_creation_in_progress_paths.add(path)
-        try:
-            logger.info(f'handling new file at: {path}')
-            async with self.db.session() as sess:
-                async with sess.begin():
-                    self.query_cache.invalidate()
-                    file_repo = FileMetadataRepository(sess)
-                    file_indexer = FileIndexer(self.root_dir, file_repo)
-                    file = await file_indexer.add_file(path)
+        if batch.deleted:
+            await self._on_files_deleted(batch.deleted)
+        if batch.created:
+            await self._on_files_created(batch.created)
+        if batch.modified:
+            await self._on_files_modified(batch.modified)
+        self.query_cache.invalidate()
+        self.idle_monitor.on_activity()
+
+    async def _on_files_created(self, paths: list[Path]):
+        logger.info(f'handling {len(paths)} new files')
+        async with self.db_write_lock, self.db.session(expire_on_commit=False) as sess:
+            async with sess.begin():
+                files = await FileIndexer(self.root_dir, FileMetadataRepository(sess)).add_files(paths)
+        if files:
+            await self._process_new_files(files)
+            logger.info(f'{len(files)} new files ready for querying')
+
+    async def _on_files_modified(self, paths: list[Path]):
+        logger.info(f'handling {len(paths)} modified files')
+        created, files = [], []
+        async with self.db_write_lock, self.db.session(expire_on_commit=False) as sess:
+            async with sess.begin():
+                file_repo = FileMetadataRepository(sess)
+                file_indexer = FileIndexer(self.root_dir, file_repo)
+                metadata_editor = self.get_metadata_editor(file_repo)
+                for path in paths:
+                    file = await file_repo.get_file_by_name(path.name)
                     if file is None:
-                        return
-                    if file.file_type == FileType.IMAGE:
-                        await OCRService(self.root_dir, file_repo, self.ocr_engine).perform_ocr(file)
-                        await self.model_manager.flush_all_unused()
-                    if file.file_type in (FileType.AUDIO, FileType.VIDEO):
-                        await TranscriptionService(self.root_dir, self.transcriber, file_repo).transcribe_file(file)
-                        await self.model_manager.flush_all_unused()
-                    # TODO currently we don't generate llm descriptions for files added at runtime
-                    # since model requires >5GB of gpu memory and it's probably better not to randomly allocate it
-                    # for this non-critical use
+                        created.append(path)
+                        continue
+                    try:
+                        # search structures are filled again from the new content, user data is registered back with it
+                        await self.embedding_processor.on_file_deleted(file)
+                        await metadata_editor.on_file_deleted(file)
+                        self.thumbnail_manager.on_file_deleted(file)
+                        if await file_indexer.reset_modified_file(file, path):
+                            files.append(file)
+                        else:
+                            logger.info(f'file is no longer supported, removing: {path}')
+                            await file_repo.delete_files([file])
+                    except Exception as e:
+                        logger.error(f'failed to update modified file: {path}', exc_info=e)
+        if files:
+            await self._process_new_files(files)
+            logger.info(f'{len(files)} modified files ready for querying')
+        if created:
+            await self._on_files_created(created)
+
+    async def _process_new_files(self, files: list[FileMetadata]):
+        # files are detached, models run without holding the write lock (initialization and the background
+        # llm scheduler commit under it), changed attributes are written back in a short transaction at the end
+
+        # every stage processes all files at once, so each model is loaded only once per batch
+        if images := [f for f in files if f.file_type == FileType.IMAGE and not f.is_ocr_analyzed]:
+            await OCRService(self.root_dir, None, self.ocr_engine, self.derived_data_store).perform_ocrs(images)
+        if audio_files := [f for f in files if f.file_type in (FileType.AUDIO, FileType.VIDEO) and not f.is_transcript_analyzed]:
+            # must be entered before any db lock, initialization stages hold it while waiting for the write lock
+            async with self.model_manager.exclusive(ModelType.TRANSCRIBER):
+                await TranscriptionService(self.root_dir, self.transcriber, None, self.derived_data_store).transcribe_files(audio_files)
+        # llm descriptions are not generated here, model requires >5GB of gpu memory and it's probably
+        # better not to randomly allocate it for this non-critical use, files wait for the background scheduler
+
+        async with (
+            self.model_manager.use(ModelType.TEXT_EMBEDDING),
+            self.model_manager.use(ModelType.CLIP)
+        ):
+            for file in files:
+                try:
                     await self.embedding_processor.on_file_created(file)
-                    await self.model_manager.flush_all_unused()
-                    await self.get_metadata_editor(file_repo).on_file_created(file)
-                    await self.thumbnail_manager.on_file_created(file)
-                    await file_repo.update_file(file)
-                    logger.info(f'file ready for querying: {path}')
-            self.query_cache.invalidate()
-        finally:
-            self.file_creation_in_progress_paths.remove(path)
-            if path in self.paths_waiting_for_deletion:
-                self.paths_waiting_for_deletion.remove(path)
-                await self._on_file_deleted(path)
+                except Exception as e:
+                    logger.error(f'failed to create embeddings for {file.name}', exc_info=e)
 
-    async def _on_file_deleted(self, path: Path):
-        if not self.context_ready:
-            self.init_queue.append((path, False))
-            return
-        
-        if path in self.file_creation_in_progress_paths:
-            self.paths_waiting_for_deletion.add(path)
-            return
+        metadata_editor = self.get_metadata_editor(None)
+        async with self.model_manager.use(ModelType.LEMMATIZER):
+            for file in files:
+                try:
+                    await metadata_editor.on_file_created(file)
+                except Exception as e:
+                    logger.error(f'failed to update lexical search structures for {file.name}', exc_info=e)
+
+        for file in files:
+            try:
+                await self.thumbnail_manager.on_file_created(file)
+            except Exception as e:
+                logger.error(f'failed to create thumbnail for {file.name}', exc_info=e)
 
-        async with self.db.session() as sess:
+        changes = {int(f.id): get_changed_attributes(f) for f in files}
+        try:
+            async with self.db_write_lock, self.db.session() as sess:
+                async with sess.begin():
+                    await FileMetadataRepository(sess).apply_changes(changes)
+        except Exception as e:
+            # files stay searchable until restart, unsaved analysis is repeated by the next initialization
+            logger.error(f'failed to save results of {len(files)} processed files', exc_info=e)
+        if self.llm_description_scheduler is not None:
+            self.llm_description_scheduler.notify_files_added()
+
+    async def _on_files_deleted(self, paths: list[Path]):
+        async with self.db_write_lock, self.db.session() as sess:
             async with sess.begin():
-                self.query_cache.invalidate()
                 file_repo = FileMetadataRepository(sess)
                 file_indexer = FileIndexer(self.root_dir, file_repo)
-                file = await file_indexer.delete_file(path)
-                if file is None:
-                    return
-                logger.info(f'handling file deleted from: {path}')
-                await self.embedding_processor.on_file_deleted(file)
-                await self.get_metadata_editor(file_repo).on_file_deleted(file)
-                self.thumbnail_manager.on_file_deleted(file)
-        self.query_cache.invalidate()
-
-    async def _on_file_moved(self, old_path: Path, new_path: Path):
-        await self._on_file_deleted(old_path)
-        if new_path.parent.name == self.root_dir.name:
-            await self._on_file_created(new_path)
+                metadata_editor = self.get_metadata_editor(file_repo)
+                for path in paths:
+                    file = await file_indexer.delete_file(path)
+                    if file is None:
+                        continue
+                    logger.info(f'handling file deleted from: {path}')
+                    if not self.context_ready:
+                        self.files_deleted_during_init.add(int(file.id))
+                        if self.init_checkpointer is not None:
+                            self.init_checkpointer.discard(int(file.id))
+                    await self.embedding_processor.on_file_deleted(file)
+                    await metadata_editor.on_file_deleted(file)
+                    self.thumbnail_manager.on_file_deleted(file)
 
 
 class DirectoryContextHolder:
     def __init__(self, model_managers: dict[Language, ModelManager],
             hybrid_search_confidence_provider_factories: dict[Language, HybridSearchConfidenceProviderFactory],
-            device: torch.device):
+            device: torch.device, derived_data_store: DerivedDataStore, max_concurrent_inits: int=2,
+            micro_batcher_config: Optional[MicroBatcherConfig]=None, ocr_config: Optional[OCRConfig]=None,
+            llm_description_scheduler_config: Optional[LLMDescriptionSchedulerConfig]=None,
+            embedding_versions_provider: Optional[Callable[[Language], Awaitable[EmbeddingVersions]]]=None):
         self.model_managers = model_managers
         self.hybrid_search_confidence_provider_factories = hybrid_search_confidence_provider_factories
         self.device = device
+        self.derived_data_store = derived_data_store
+        # guards mutations of context maps, initialization itself runs without holding it
         self.context_change_lock = asyncio.Lock()
+        self.init_scheduler = DirectoryInitScheduler(max_concurrent_inits=max_concurrent_inits)
         self.contexts: dict[str, DirectoryContext] = {}
+        # contexts which are being initialized, they can be used once they are queryable
+        self.initializing_contexts: dict[str, DirectoryContext] = {}
         self.init_progress_trackers: dict[str, InitProgressTracker] = {}
         self.init_failed_contexts: set[str] = set()
         self.stopped = False
         self.initialized = False
         self.directory_init_background_tasks: set[asyncio.Task] = set()
-        self.current_init_directory_context_task: tuple[str, asyncio.Task] = None
+        self.init_directory_context_tasks: dict[str, asyncio.Task] = {}
+        # languages of registered directories, including those which are initializing or failed
+        self.directory_languages: dict[str, Language] = {}
+        self.text_embedding_engines = {lang: TextEmbeddingEngine(mm, micro_batcher_config) for lang, mm in model_managers.items()}
+        self.clip_engines = {lang: CLIPEngine(mm, device, micro_batcher_config) for lang, mm in model_managers.items()}
+        self.ocr_config = ocr_config
+        self.llm_description_scheduler_config = llm_description_scheduler_config
+        self.embedding_versions_provider = embedding_versions_provider
+        # shared by all directories, background work of any of them should not compete with the user
+        self.idle_monitor = IdleMonitor()
 
     def set_initialized(self):
         self.initialized = True
@@ -268,7 +522,8 @@ class DirectoryContextHolder:
     async def register_directory(self, name: str, root_dir: Path, primary_language: Language, should_generate_llm_descriptions: bool):
         async with self.context_change_lock:
             assert not self.stopped
-            assert name not in self.contexts
+            assert name not in self.contexts and name not in self.init_directory_context_tasks
+            self.directory_languages[name] = primary_language
             if not root_dir.exists():
                 self.init_failed_contexts.add(name)
                 raise FileNotFoundError(f'directory {name} does not exist at {root_dir}')
@@ -278,39 +533,89 @@ class DirectoryContextHolder:
             self.init_progress_trackers[name] = progress_tracker
             ctx = DirectoryContext(root_dir, root_dir, self.model_managers[primary_language],
                 self.hybrid_search_confidence_provider_factories[primary_language], primary_language, progress_tracker,
-                should_generate_llm_descriptions=should_generate_llm_descriptions)
-            try:
-                init_task = asyncio.create_task(ctx.init_directory_context(self.device))
-                self.current_init_directory_context_task = (name, init_task)
-                await init_task
-            except (Exception, asyncio.CancelledError) as e:
-                if 'CUDA out of memory' in str(e):
-                    logger.error(
-                        f'Unrecoverable GPU out of memory error occured while initializing directory {name}. ' +
-                         'Consider running the application with --cpu flag or change models.'
-                    )
-                await ctx.teardown_directory_context()
-                self.init_failed_contexts.add(name)
-                raise
-            finally:
-                self.current_init_directory_context_task = None
-            self.contexts[name] = ctx
-            self.init_progress_trackers.pop(name)
+                self.derived_data_store, should_generate_llm_descriptions=should_generate_llm_descriptions,
+                text_embedding_engine=self.text_embedding_engines[primary_language], clip_engine=self.clip_engines[primary_language],
+                ocr_config=self.ocr_config, idle_monitor=self.idle_monitor,
+                llm_description_scheduler_config=self.llm_description_scheduler_config,
+                embedding_versions_provider=self.embedding_versions_provider)
+            self.initializing_contexts[name] = ctx
+            init_task = asyncio.create_task(self._init_directory_context(name, ctx))
+            self.init_directory_context_tasks[name] = init_task
+        await init_task
+
+    async def _init_directory_context(self, name: str, ctx: DirectoryContext):
+        try:
+            # smaller directories are initialized first, so that they become available sooner
+            priority = await asyncio.get_running_loop().run_in_executor(None, _count_directory_files, ctx.root_dir)
+            ctx.init_progress_tracker.set_waiting(True)
+            async with self.init_scheduler.slot(name, priority):
+                ctx.init_progress_tracker.set_waiting(False)
+                await ctx.init_directory_context(self.device)
+            async with self.context_change_lock:
+                if self.stopped:
+                    raise RuntimeError('directory context holder was stopped during initialization')
+                self.contexts[name] = ctx
+                self.initializing_contexts.pop(name, None)
+                self.init_directory_context_tasks.pop(name, None)
+                self.init_progress_trackers.pop(name, None)
+        except (Exception, asyncio.CancelledError) as e:
+            if 'CUDA out of memory' in str(e):
+                logger.error(
+                    f'Unrecoverable GPU out of memory error occured while initializing directory {name}. ' +
+                     'Consider running the application with --cpu flag or change models.'
+                )
+            self.initializing_contexts.pop(name, None)
+            self.init_directory_context_tasks.pop(name, None)
+            ctx.init_progress_tracker.set_waiting(False)
+            await ctx.teardown_directory_context()
+            self.init_failed_contexts.add(name)
+            raise
 
     async def unregister_directory(self, name: str):
+        if (init_task := self.init_directory_context_tasks.get(name)) is not None:
+            init_task.cancel()
+            await asyncio.wait([init_task])
         async with self.context_change_lock:
+            self.directory_languages.pop(name, None)
+            self.init_failed_contexts.discard(name)
+            self.init_progress_trackers.pop(name, None)
             if (ctx := self.contexts.pop(name, None)) is not None:
                 # can be None if initialization was cancelled
                 await ctx.teardown_directory_context()
 
+    def get_used_languages(self) -> set[Language]:
+        return set(self.directory_languages.values())
+
+    def prioritize_directory_initialization(self, name: str):
+        self.init_scheduler.boost(name)
+
+    async def reconcile_directories(self):
+        for name, ctx in list(self.contexts.items()):
+            if self.stopped or self.contexts.get(name) is not ctx:
+                continue # unregistered in the meantime
+            try:
+                await ctx.reconcile_with_file_system()
+            except Exception as e:
+                logger.error(f'Failed to reconcile directory: {name}', exc_info=e)
+
     def has_context(self, name: str) -> bool:
         return name in self.contexts
     
     def has_init_failed(self, name: str) -> bool:
         return name in self.init_failed_contexts
 
+    def is_queryable(self, name: str) -> bool:
+        if name in self.contexts:
+            return True
+        ctx = self.initializing_contexts.get(name)
+        return ctx is not None and ctx.is_queryable()
+
     def get_context(self, name: str) -> DirectoryContext:
-        return self.contexts[name]
+        if (ctx := self.contexts.get(name)) is not None:
+            return ctx
+        if (ctx := self.initializing_contexts.get(name)) is not None and ctx.is_queryable():
+            return ctx
+        raise KeyError(f'directory {name} is not available')
     
     def get_init_progress(self, name: str) -> Optional[tuple[str, float]]:
         if tracker := self.init_progress_trackers.get(name):
@@ -318,17 +623,21 @@ class DirectoryContextHolder:
         return None
     
     def cancel_directory_context_initialization(self, name: str):
-        # directory initialization can be cancelled only if either it is currently being initialized (in progress, not enqueued to be initialized)
+        # initialization can be cancelled both when it is in progress and when it waits for other directories
         if self.stopped:
             return
-        if self.current_init_directory_context_task is None or self.current_init_directory_context_task[0] != name:
+        if (init_task := self.init_directory_context_tasks.get(name)) is None:
             logger.warning(f'Requested cancellation of directory context that is not being currently initialized: {name}')
             return
-        self.current_init_directory_context_task[1].cancel()
+        init_task.cancel()
 
     async def teardown(self):
         for task in list(self.directory_init_background_tasks):
             task.cancel()
+        if init_tasks := list(self.init_directory_context_tasks.values()):
+            for task in init_tasks:
+                task.cancel()
+            await asyncio.wait(init_tasks)
         async with self.context_change_lock:
             self.stopped = True
             for name, ctx in self.contexts.items():
@@ -337,3 +646,7 @@ class DirectoryContextHolder:
                 except Exception as e:
                     logger.error(f'failed to to teardown directory context for directory {name}', exc_info=e)
 
+
+def _count_directory_files(root_dir: Path) -> int:
+    with os.scandir(root_dir) as it:
+        return sum(1 for entry in it if entry.is_file())
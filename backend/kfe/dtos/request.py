@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -18,6 +20,8 @@ class OpenFileRequest(BaseModel):
 
 class SearchRequest(BaseModel):
     query: str
+    # handle returned with previous page of the same query, lets server skip the search
+    result_handle: Optional[str] = None
 
 class FindSimilarItemsRequest(BaseModel):
     file_id: int
@@ -34,9 +34,14 @@ class PaginatedResponse(BaseModel):
 
 class LoadAllFilesResponse(PaginatedResponse):
     files: list[FileMetadataDTO]
+    # pass as `cursor` to load the next page without offset, None if there are no more files
+    next_cursor: Optional[str] = None
 
 class SearchResponse(PaginatedResponse):
     results: list[SearchResultDTO]
+    # fraction of directory files that each retriever can already find, lower than 1 while directory is initializing
+    retriever_coverage: dict[str, float] = Field(default_factory=dict)
+    result_handle: Optional[str] = None
 
 class GetOffsetOfFileInLoadResultsResponse(BaseModel):
     idx: int
@@ -47,6 +52,8 @@ class RegisteredDirectoryDTO(BaseModel):
     failed: bool
     init_progress_description: str = Field(default='Unknown initialization progress')
     init_progress: float = Field(default=0.)
+    # directory can be searched before it is ready, results might be incomplete
+    queryable: bool = Field(default=False)
 
 class SelectDirectoryResponse(BaseModel):
     selected_path: Optional[str]
@@ -29,12 +29,14 @@ async def list_registered_directories(
                 failed=ctx_holder.has_init_failed(d.name),
                 init_progress_description=init_progress[0],
                 init_progress=init_progress[1],
+                queryable=ctx_holder.is_queryable(d.name),
             ))
         else:
             res.append(RegisteredDirectoryDTO(
                 name=d.name,
                 ready=ctx_holder.has_context(d.name),
                 failed=ctx_holder.has_init_failed(d.name),
+                queryable=ctx_holder.is_queryable(d.name),
             ))
     return res
 
@@ -1,8 +1,10 @@
-from typing import Annotated
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 
-from kfe.dependencies import get_file_repo, get_mapper, get_search_service
+from kfe.dependencies import (get_directory_context, get_file_repo, get_mapper,
+                              get_search_service)
+from kfe.directory_context import DirectoryContext
 from kfe.dtos.mappers import Mapper
 from kfe.dtos.request import (FindSimilarImagesToUploadedImageRequest,
                               FindSimilarItemsRequest,
@@ -11,7 +13,8 @@ from kfe.dtos.request import (FindSimilarImagesToUploadedImageRequest,
 from kfe.dtos.response import (GetOffsetOfFileInLoadResultsResponse,
                                LoadAllFilesResponse, SearchResponse,
                                SearchResultDTO)
-from kfe.persistence.file_metadata_repository import FileMetadataRepository
+from kfe.persistence.file_metadata_repository import (FileListCursor,
+                                                      FileMetadataRepository)
 from kfe.service.search import SearchService
 
 router = APIRouter(prefix="/files")
@@ -23,24 +26,36 @@ async def get_directory_files(
     mapper: Annotated[Mapper, Depends(get_mapper)],
     offset: int = 0,
     limit: int = -1,
+    cursor: Optional[str] = None,
 ) -> LoadAllFilesResponse:
-    files = [
-        await mapper.file_metadata_to_dto(file)
-        for file in await repo.load_files(offset, limit if limit != -1 else None)
-    ]
-    return LoadAllFilesResponse(files=files, offset=offset, total=await repo.get_number_of_files())
+    # with cursor the page is found using index instead of skipping `offset` rows, offset is only passed back then
+    if cursor is not None and limit != -1:
+        try:
+            decoded_cursor = FileListCursor.decode(cursor)
+        except Exception:
+            raise HTTPException(status_code=400, detail='invalid cursor')
+        loaded_files = await repo.load_files_after(decoded_cursor, limit)
+    else:
+        loaded_files = await repo.load_files(offset, limit if limit != -1 else None)
+    next_cursor = None
+    if limit != -1 and len(loaded_files) == limit and loaded_files[-1].added_at is not None:
+        next_cursor = FileListCursor.of(loaded_files[-1]).encode()
+    files = [await mapper.file_metadata_to_dto(file) for file in loaded_files]
+    return LoadAllFilesResponse(files=files, offset=offset, total=await repo.get_number_of_files(), next_cursor=next_cursor)
 
 @router.post('/search')
 async def search(
     req: SearchRequest,
     search_service: Annotated[SearchService, Depends(get_search_service)],
     mapper: Annotated[Mapper, Depends(get_mapper)],
+    ctx: Annotated[DirectoryContext, Depends(get_directory_context)],
     offset: int = 0,
     limit: int = -1,
 ) -> SearchResponse:
-    search_results, total_items = await search_service.search(req.query.strip(), offset, limit if limit != -1 else None)
-    results = [await mapper.aggregated_search_result_to_dto(item) for item in search_results]
-    return SearchResponse(results=results, offset=offset, total=total_items)
+    page = await search_service.search(req.query.strip(), offset, limit if limit != -1 else None, result_handle=req.result_handle)
+    results = [await mapper.aggregated_search_result_to_dto(item) for item in page.results]
+    return SearchResponse(results=results, offset=offset, total=page.total, retriever_coverage=ctx.get_retriever_coverage(),
+                          result_handle=page.handle)
 
 @router.post('/find-with-similar-description')
 async def find_items_with_similar_descriptions(
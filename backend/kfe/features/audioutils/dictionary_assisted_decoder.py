@@ -4,18 +4,61 @@ import torch
 from kfe.huggingsound.decoder import Decoder
 from kfe.huggingsound.token_set import TokenSet
 from kfe.utils.datastructures.bktree import BKTree
+from kfe.utils.datastructures.compact_trie import CompactTrie
+from kfe.utils.datastructures.symspell import SymSpellIndex
 from kfe.utils.datastructures.trie import Trie
 
+# impossible alignments have probability 0, finite floor keeps arithmetic on cumulative sums free of nans
+MIN_LOG_PROB = -1e4
+
+
+def get_best_configuration_log_probs(log_probs: np.ndarray, blank_token_id: int, candidates: list[list[int]],
+                                     start_idx: int, end_idx: int) -> np.ndarray:
+    '''
+    Returns log probability of the best ctc alignment of each candidate token sequence to frames [start_idx, end_idx],
+    in which every token takes exactly one frame and the remaining frames are blanks.
+
+    Computes the same recurrence as F[i, j] = max(F[i, j-1] + blank[j], F[i-1, j-1] + token_i[j]) for all candidates
+    at once, one token row at a time. With B being cumulative sum of blank log probs, G[i, j] = F[i, j] - B[j]
+    satisfies G[i, j] = max(G[i, j-1], F[i-1, j-1] + token_i[j] - B[j]), so each row is a cumulative maximum.
+    '''
+    N = end_idx - start_idx + 1
+    results = np.full(len(candidates), -np.inf)
+    lengths = np.array([len(x) for x in candidates], dtype=np.int64)
+    feasible = np.flatnonzero(lengths <= N)
+    if N <= 0 or len(feasible) == 0:
+        return results
+    max_len = int(lengths[feasible].max())
+    lp = np.maximum(log_probs[start_idx:end_idx + 1].astype(np.float64), MIN_LOG_PROB)
+    B = np.concatenate([[0.], np.cumsum(lp[:, blank_token_id])])
+
+    tokens = np.full((len(feasible), max(max_len, 1)), blank_token_id, dtype=np.int64)
+    for row, k in enumerate(feasible):
+        tokens[row, :lengths[k]] = candidates[k]
+    # take[k, i, j] - log prob of i-th token of k-th candidate at j-th frame
+    take = lp[:, tokens].transpose(1, 2, 0)
+
+    F = np.broadcast_to(B, (len(feasible), N + 1))
+    zero_length = lengths[feasible] == 0
+    results[feasible[zero_length]] = B[N]
+    for i in range(1, max_len + 1):
+        C = F[:, i - 1:N] + take[:, i - 1, i - 1:N] - B[i:]
+        F_next = np.full((len(feasible), N + 1), -np.inf)
+        F_next[:, i:] = np.maximum.accumulate(C, axis=1) + B[i:]
+        F = F_next
+        done = lengths[feasible] == i
+        results[feasible[done]] = F[done, N]
+    return results
+
 
 class DictionaryAssistedDecoder(Decoder):
-    def __init__(self, token_set: TokenSet, dictionary: Trie, edit_distance_search_tree: BKTree, disctionary_token_id_lut: dict[str, int],
-                 average_word_length=8, max_correction_alternatives_with_dist_above_1=20):
+    def __init__(self, token_set: TokenSet, dictionary: Trie | CompactTrie, edit_distance_search_tree: BKTree | SymSpellIndex, disctionary_token_id_lut: dict[str, int],
+                 max_correction_alternatives_with_dist_above_1=20):
         super().__init__(token_set)
         self.dictionary = dictionary
         self.edit_distance_search_tree = edit_distance_search_tree
         self.disctionary_token_id_lut = disctionary_token_id_lut
         self.max_correction_alternatives_with_dist_above_1 = max_correction_alternatives_with_dist_above_1
-        self.best_configuration_compute_buff = np.zeros((4 * average_word_length + 1, average_word_length*20), dtype=np.float32)
 
     def _get_predictions(self, logits: torch.Tensor):
         assert logits.shape[0] == 1
@@ -129,7 +172,7 @@ class DictionaryAssistedDecoder(Decoder):
                     continue
                 partial_log_prob += lp
             else:
-                partial_log_prob += self._get_log_probability_of_best_configuration(log_probs, first_tokens, word_start + split_pos, word_end)
+                partial_log_prob += self._get_log_probability_of_best_configuration(log_probs, second_tokens, word_start + split_pos, word_end)
             
             if best_log_prob is None or partial_log_prob > best_log_prob:
                 best_split, best_log_prob = (first_tokens, second_tokens), partial_log_prob
@@ -137,7 +180,7 @@ class DictionaryAssistedDecoder(Decoder):
         return best_split, best_log_prob
     
     def _correct_word(self, log_probs: np.ndarray, word: str, start_idx: int, end_idx: int, max_dist: int) -> tuple[list[int] | None, float | None]:
-        best_alternative_tokens, best_log_prob = None, None
+        candidates = []
         for dist in range(1, max_dist + 1):
             search_limit = None if dist == 1 else self.max_correction_alternatives_with_dist_above_1
             evaluated = 0
@@ -147,37 +190,17 @@ class DictionaryAssistedDecoder(Decoder):
                 evaluated += 1
                 if search_limit is not None and evaluated >= search_limit:
                     break
-                
-                alternative_tokens = self._tokenize_word(alternative[0])
-                lp = self._get_log_probability_of_best_configuration(log_probs, alternative_tokens, start_idx, end_idx)
-                if best_log_prob is None or lp > best_log_prob:
-                    best_alternative_tokens, best_log_prob = alternative_tokens, lp
+                candidates.append(self._tokenize_word(alternative[0]))
 
-        return best_alternative_tokens, best_log_prob
+        if not candidates:
+            return None, None
+        # all candidates are scored in a single batched dp, first one wins ties like in sequential evaluation
+        candidate_log_probs = get_best_configuration_log_probs(log_probs, self.token_set.blank_token_id, candidates, start_idx, end_idx)
+        best = int(np.argmax(candidate_log_probs))
+        return candidates[best], float(candidate_log_probs[best])
 
     def _get_log_probability_of_best_configuration(self, log_probs: np.ndarray, tokens: list[int], start_idx: int, end_idx: int) -> float:
-        N = end_idx - start_idx + 1
-        if len(tokens) > N:
-            return -np.inf
-
-        if self.best_configuration_compute_buff.shape[0] >= len(tokens) + 1 and self.best_configuration_compute_buff.shape[1] >= N + 1:
-            F = self.best_configuration_compute_buff
-        else:
-            F = np.zeros((len(tokens) + 1, N + 1), dtype=np.float32)
-
-        for i in range(1, N+1):
-            F[0, i] = F[0, i-1] + log_probs[start_idx + i - 1, self.token_set.blank_token_id]
-
-        for i in range(1, len(tokens) + 1):
-            for j in range(i, N + 1):
-                take_cur_lp = log_probs[start_idx + j - 1, tokens[i - 1]]
-                blank_lp = log_probs[start_idx + j - 1, self.token_set.blank_token_id]
-                if i == j:
-                    F[i, j] = F[i-1, j-1] + take_cur_lp
-                else:
-                    F[i, j] = max(F[i, j-1] + blank_lp, F[i-1, j-1] + take_cur_lp)
-        
-        return F[len(tokens), N]
+        return float(get_best_configuration_log_probs(log_probs, self.token_set.blank_token_id, [tokens], start_idx, end_idx)[0])
     
     def _accept(self, predicted_ids: list[int], token_ids: list[int], i: int) -> tuple[int, list[int]]:
         if token_ids:
@@ -0,0 +1,133 @@
+from typing import NamedTuple
+
+import numpy as np
+
+
+class VADConfig(NamedTuple):
+    frame_seconds: float = 0.03
+    # frame can be speech only if its energy exceeds the noise floor (low percentile of frame energies) by this margin
+    energy_margin_db: float = 6.
+    # frames quieter than this (relative to full scale) are never speech
+    min_energy_db: float = -55.
+    # minimal fraction of frame energy in 300-3400 Hz band where most of speech energy is
+    min_speech_band_ratio: float = 0.3
+    # noise (wind, hum, hiss) has flat spectrum, voiced speech has harmonics
+    max_spectral_flatness: float = 0.4
+    # speech is modulated at syllabic rate, frames in windows with steadier energy (e.g. sustained music) are dropped,
+    # windows are short, so that music or noise filling pauses between words doesn't hide modulation of the speech
+    modulation_window_seconds: float = 0.6
+    min_window_energy_std_db: float = 1.5
+    # if modulation test rejects everything but this fraction of frames looks like speech otherwise, the test is not applied,
+    # transcribing some music is better than losing speech that is mixed with loud background
+    fallback_min_candidate_ratio: float = 0.2
+    min_speech_seconds: float = 0.25
+    # speech segments separated by shorter pauses are merged
+    max_gap_seconds: float = 0.5
+    padding_seconds: float = 0.2
+    # silence inserted between concatenated segments, so that words of different segments are not glued together
+    separator_seconds: float = 0.1
+
+class SpeechWindows(NamedTuple):
+    windows: list[np.ndarray]
+    # fraction of audio detected as speech
+    speech_coverage: float
+
+
+def _frame_features(frames: np.ndarray, sampling_rate: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(frames.shape[1]), axis=1)) ** 2 + 1e-12
+    freqs = np.fft.rfftfreq(frames.shape[1], 1 / sampling_rate)
+    band = (freqs >= 300) & (freqs <= 3400)
+    band_spectrum = spectrum[:, band]
+    band_ratio = band_spectrum.sum(axis=1) / spectrum.sum(axis=1)
+    flatness = np.exp(np.mean(np.log(band_spectrum), axis=1)) / np.mean(band_spectrum, axis=1)
+    return energy_db, band_ratio, flatness
+
+def detect_speech_segments(samples: np.ndarray, sampling_rate: int, config: VADConfig=VADConfig()) -> list[tuple[int, int]]:
+    '''Returns [start, end) sample ranges of speech, sorted and non-overlapping'''
+    frame_length = max(1, int(config.frame_seconds * sampling_rate))
+    num_frames = len(samples) // frame_length
+    if num_frames == 0:
+        return []
+    frames = samples[:num_frames * frame_length].reshape(num_frames, frame_length).astype(np.float32)
+    energy_db, band_ratio, flatness = _frame_features(frames, sampling_rate)
+
+    # threshold is capped by the loud frames, so that speech without pauses is not rejected because its floor is high
+    energy_threshold = max(config.min_energy_db, min(np.percentile(energy_db, 10) + config.energy_margin_db,
+        np.percentile(energy_db, 90) - config.energy_margin_db))
+    is_candidate = (energy_db > energy_threshold) & (band_ratio >= config.min_speech_band_ratio) & \
+        (flatness <= config.max_spectral_flatness)
+    window_frames = max(2, int(config.modulation_window_seconds / config.frame_seconds))
+    is_modulated = _sliding_std(energy_db, window_frames) >= config.min_window_energy_std_db
+
+    segments = _find_segments(is_candidate & is_modulated, len(samples), frame_length, sampling_rate, config)
+    if not segments and is_candidate.mean() >= config.fallback_min_candidate_ratio:
+        segments = _find_segments(is_candidate, len(samples), frame_length, sampling_rate, config)
+    return segments
+
+def _sliding_std(x: np.ndarray, window: int) -> np.ndarray:
+    '''Standard deviation of values in window centered at each element (shorter at the edges)'''
+    cumsum = np.concatenate([[0.], np.cumsum(x, dtype=np.float64)])
+    cumsum_sq = np.concatenate([[0.], np.cumsum(x.astype(np.float64) ** 2)])
+    idx = np.arange(len(x))
+    starts = np.maximum(idx - window // 2, 0)
+    ends = np.minimum(idx + (window + 1) // 2, len(x))
+    counts = ends - starts
+    mean = (cumsum[ends] - cumsum[starts]) / counts
+    return np.sqrt(np.maximum((cumsum_sq[ends] - cumsum_sq[starts]) / counts - mean ** 2, 0.))
+
+def _find_segments(is_speech: np.ndarray, num_samples: int, frame_length: int, sampling_rate: int,
+                   config: VADConfig) -> list[tuple[int, int]]:
+    # runs of speech frames as [start, end) frame ranges
+    padded = np.concatenate([[False], is_speech, [False]])
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    runs = list(zip(changes[::2], changes[1::2]))
+
+    max_gap_frames = int(config.max_gap_seconds / config.frame_seconds)
+    merged: list[list[int]] = []
+    for start, end in runs:
+        if merged and start - merged[-1][1] <= max_gap_frames:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    min_speech_frames = max(1, int(config.min_speech_seconds / config.frame_seconds))
+    padding = int(config.padding_seconds * sampling_rate)
+    segments: list[tuple[int, int]] = []
+    for start, end in merged:
+        if end - start < min_speech_frames:
+            continue
+        sample_start = max(0, start * frame_length - padding)
+        sample_end = min(num_samples, end * frame_length + padding)
+        if segments and sample_start <= segments[-1][1]:
+            segments[-1] = (segments[-1][0], sample_end)
+        else:
+            segments.append((sample_start, sample_end))
+    return segments
+
+def get_speech_windows(samples: np.ndarray, sampling_rate: int, max_window_seconds: float, config: VADConfig=VADConfig()) -> SpeechWindows:
+    '''Drops non-speech regions and concatenates speech segments into windows of at most `max_window_seconds`'''
+    segments = detect_speech_segments(samples, sampling_rate, config)
+    speech_samples = sum(end - start for start, end in segments)
+    coverage = speech_samples / len(samples) if len(samples) else 0.
+
+    max_window = max(1, int(max_window_seconds * sampling_rate))
+    separator = np.zeros(int(config.separator_seconds * sampling_rate), dtype=samples.dtype)
+    windows: list[np.ndarray] = []
+    current: list[np.ndarray] = []
+    current_length = 0
+    for start, end in segments:
+        # segments longer than the window are split
+        for part_start in range(start, end, max_window):
+            part = samples[part_start:min(end, part_start + max_window)]
+            if current and current_length + len(separator) + len(part) > max_window:
+                windows.append(np.concatenate(current))
+                current, current_length = [], 0
+            if current:
+                current.append(separator)
+                current_length += len(separator)
+            current.append(part)
+            current_length += len(part)
+    if current:
+        windows.append(np.concatenate(current))
+    return SpeechWindows(windows=windows, speech_coverage=coverage)
@@ -1,25 +1,28 @@
-
-
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from typing import Awaitable, Callable
+from typing import Awaitable, Callable, Optional
 
 import numpy as np
 import torch
 from PIL.Image import Image
 from transformers import CLIPModel, CLIPProcessor
 
+from kfe.utils.micro_batcher import MicroBatcher, MicroBatcherConfig
 from kfe.utils.model_manager import ModelManager, ModelType
 
 
 class CLIPEngine:
     '''Returns normalized embeddings'''
 
-    def __init__(self, model_manager: ModelManager, device: torch.device):
+    def __init__(self, model_manager: ModelManager, device: torch.device, micro_batcher_config: Optional[MicroBatcherConfig]=None):
         self.model_manager = model_manager
         self.device = device
         self.executor = ThreadPoolExecutor(max_workers=1)
+        # concurrent requests are embedded in one forward pass, see TextEmbeddingEngine
+        model_provider = lambda: self.model_manager.get_model(ModelType.CLIP)
+        self.text_batcher = MicroBatcher(lambda texts: self._generate_text_embeddings(model_provider, texts), micro_batcher_config)
+        self.image_batcher = MicroBatcher(lambda imgs: self._generate_image_embeddings(model_provider, imgs), micro_batcher_config)
 
     @asynccontextmanager
     async def run(self):
@@ -32,21 +35,29 @@ class CLIPEngine:
             self.model_provider = lazy_model_provider    
 
         async def generate_text_embedding(self, text: str) -> np.ndarray:
-            processor, model = await self.model_provider()
-            def _do_generate():
-                text_inputs = processor(text=[text], images=None, return_tensors='pt', padding=True).to(self.wrapper.device)
-                with torch.no_grad():
-                    embedding = model.get_text_features(**text_inputs).float()
-                embedding = embedding / embedding.norm(dim=-1, keepdim=True)
-                return embedding.detach().cpu().numpy().ravel()
-            return await asyncio.get_running_loop().run_in_executor(self.wrapper.executor, _do_generate)
+            return await self.wrapper.text_batcher.submit(text)
 
         async def generate_image_embedding(self, img: Image) -> np.ndarray:
-            processor, model = await self.model_provider()
-            def _do_generate():
-                img_inputs = processor(text=None, images=img, return_tensors='pt', padding=True).to(self.wrapper.device)
-                with torch.no_grad():
-                    embedding = model.get_image_features(**img_inputs).float()
-                embedding = embedding / embedding.norm(dim=-1, keepdim=True)
-                return embedding.detach().cpu().numpy().ravel()
-            return await asyncio.get_running_loop().run_in_executor(self.wrapper.executor, _do_generate)
+            return await self.wrapper.image_batcher.submit(img)
+
+    async def _generate_text_embeddings(self, model_provider: Callable[[], Awaitable[tuple[CLIPProcessor, CLIPModel]]],
+                                        texts: list[str]) -> list[np.ndarray]:
+        processor, model = await model_provider()
+        def _do_generate():
+            text_inputs = processor(text=texts, images=None, return_tensors='pt', padding=True).to(self.device)
+            with torch.no_grad():
+                embeddings = model.get_text_features(**text_inputs).float()
+            embeddings = embeddings / embeddings.norm(dim=-1, keepdim=True)
+            return list(embeddings.detach().cpu().numpy())
+        return await asyncio.get_running_loop().run_in_executor(self.executor, _do_generate)
+
+    async def _generate_image_embeddings(self, model_provider: Callable[[], Awaitable[tuple[CLIPProcessor, CLIPModel]]],
+                                         imgs: list[Image]) -> list[np.ndarray]:
+        processor, model = await model_provider()
+        def _do_generate():
+            img_inputs = processor(text=None, images=imgs, return_tensors='pt', padding=True).to(self.device)
+            with torch.no_grad():
+                embeddings = model.get_image_features(**img_inputs).float()
+            embeddings = embeddings / embeddings.norm(dim=-1, keepdim=True)
+            return list(embeddings.detach().cpu().numpy())
+        return await asyncio.get_running_loop().run_in_executor(self.executor, _do_generate)
@@ -1,66 +1,210 @@
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Awaitable, Callable, NamedTuple
+from typing import Any, Awaitable, Callable, NamedTuple, Optional, Union
 
 import easyocr
+import numpy as np
+import torch
+from PIL import Image
 from wordfreq import word_frequency
 
+from kfe.features.screenshot_prefilter import ScreenshotPrefilter
+from kfe.utils.constants import (OCR_BATCH_SIZE_ENV, OCR_MAX_IMAGE_SIDE_ENV,
+                                 OCR_PROCESSES_ENV,
+                                 OCR_SKIP_CAMERA_PHOTOS_ENV)
 from kfe.utils.log import logger
 from kfe.utils.model_manager import ModelManager, ModelType
 
+# detections of a single image as (text, confidence) pairs, None if the image couldn't be processed
+TextDetections = Optional[list[tuple[str, float]]]
+
 
 class OCRResult(NamedTuple):
     text: str
     is_screenshot: bool
 
+class OCRConfig(NamedTuple):
+    # images are downscaled so that their longer side is at most this, easyocr detects text on canvas of the same size anyway
+    max_image_side: int = 2560
+    # number of images detected together, images in a batch are padded to the same shape
+    batch_size: int = 8
+    # number of processes with their own readers used for cpu inference, 1 means that reader runs in the main process
+    num_processes: int = 1
+    # whether OCR should be skipped for images which are clearly camera photos, not screenshots
+    skip_camera_photos: bool = True
+
+    @staticmethod
+    def from_env() -> "OCRConfig":
+        default_processes = max(1, min(4, (os.cpu_count() or 1) // 4))
+        return OCRConfig(
+            max_image_side=int(os.getenv(OCR_MAX_IMAGE_SIDE_ENV, '2560')),
+            batch_size=int(os.getenv(OCR_BATCH_SIZE_ENV, '8')),
+            num_processes=int(os.getenv(OCR_PROCESSES_ENV, str(default_processes))),
+            skip_camera_photos=os.getenv(OCR_SKIP_CAMERA_PHOTOS_ENV, 'true') == 'true'
+        )
+
+def _load_image(path: Path, max_side: int) -> np.ndarray:
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        return np.asarray(img)
+
+def _pad_to(img: np.ndarray, height: int, width: int) -> np.ndarray:
+    if img.shape[0] == height and img.shape[1] == width:
+        return img
+    # padding is added at the bottom and right, so coordinates of detected boxes don't change
+    return np.pad(img, ((0, height - img.shape[0]), (0, width - img.shape[1]), (0, 0)), mode='edge')
+
+def _group_by_shape(shapes: dict[int, tuple[int, int]], batch_size: int, max_padding_ratio: float=2.) -> list[list[int]]:
+    # images of the same orientation and similar size are batched together, image is not batched
+    # with others if its padded version would be more than `max_padding_ratio` times larger
+    order = sorted(shapes.keys(), key=lambda i: (shapes[i][0] >= shapes[i][1], -shapes[i][0] * shapes[i][1]))
+    batches: list[list[int]] = []
+    height, width = 0, 0
+    for i in order:
+        h, w = shapes[i]
+        if batches and len(batches[-1]) < batch_size and max(h, height) * max(w, width) <= max_padding_ratio * h * w:
+            batches[-1].append(i)
+            height, width = max(h, height), max(w, width)
+        else:
+            batches.append([i])
+            height, width = h, w
+    return batches
+
+def _to_detections(result: list[Any]) -> list[tuple[str, float]]:
+    return [(text, float(prob)) for (_, text, prob) in result]
+
+def read_texts(reader: easyocr.Reader, image_paths: list[Path], max_side: int, batch_size: int) -> list[TextDetections]:
+    results: list[TextDetections] = [None] * len(image_paths)
+    images: dict[int, np.ndarray] = {}
+    for i, path in enumerate(image_paths):
+        try:
+            images[i] = _load_image(path, max_side)
+        except Exception as e:
+            if path.suffix != '.gif':
+                logger.error(f'Failed to load image for OCR: {path.name}', exc_info=e)
+
+    for batch in _group_by_shape({i: img.shape[:2] for i, img in images.items()}, batch_size):
+        height, width = max(images[i].shape[0] for i in batch), max(images[i].shape[1] for i in batch)
+        try:
+            batch_results = reader.readtext_batched([_pad_to(images[i], height, width) for i in batch])
+            for i, res in zip(batch, batch_results):
+                results[i] = _to_detections(res)
+        except Exception as e:
+            logger.debug(f'batched OCR of {len(batch)} images failed, processing images separately', exc_info=e)
+            for i in batch:
+                try:
+                    results[i] = _to_detections(reader.readtext(images[i]))
+                except Exception as e:
+                    logger.error(f'Failed to perform OCR on {image_paths[i].name}', exc_info=e)
+    return results
+
+
+_worker_reader: Optional[easyocr.Reader] = None
+
+def _init_worker(languages: list[str], num_threads: int):
+    global _worker_reader
+    torch.set_num_threads(num_threads)
+    _worker_reader = easyocr.Reader(languages, gpu=False)
+
+def _worker_read_texts(image_paths: list[Path], max_side: int, batch_size: int) -> list[TextDetections]:
+    return read_texts(_worker_reader, image_paths, max_side, batch_size)
+
+def _worker_ready() -> bool:
+    return _worker_reader is not None
+
+class OCRProcessPool:
+    '''CPU alternative of easyocr.Reader which shards images across processes, each of them with its own reader'''
+
+    def __init__(self, languages: list[str], num_processes: int, num_threads: Optional[int]=None) -> None:
+        self.num_processes = num_processes
+        threads_per_process = max(1, (num_threads or os.cpu_count() or 1) // num_processes)
+        # processes are spawned rather than forked, forking process with running threads and event loop is not safe
+        self.executor = ProcessPoolExecutor(max_workers=num_processes, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(languages, threads_per_process))
+        # readers are created when processes start, wait for it so that model loading includes it
+        for f in [self.executor.submit(_worker_ready) for _ in range(num_processes)]:
+            f.result()
+
+    async def read_texts(self, image_paths: list[Path], max_side: int, batch_size: int) -> list[TextDetections]:
+        shard_size = max(1, -(-len(image_paths) // self.num_processes))
+        loop = asyncio.get_running_loop()
+        shards = await asyncio.gather(*[
+            loop.run_in_executor(self.executor, _worker_read_texts, image_paths[i:i + shard_size], max_side, batch_size)
+            for i in range(0, len(image_paths), shard_size)
+        ])
+        return [res for shard in shards for res in shard]
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
 class OCREngine:
-    def __init__(self, model_manager: ModelManager, languages: list[str], min_screenshot_words_threshold=1) -> None:
+    def __init__(self, model_manager: ModelManager, languages: list[str], min_screenshot_words_threshold=1,
+                 config: Optional[OCRConfig]=None) -> None:
         self.languages = languages
         self.min_screenshot_words_threshold = min_screenshot_words_threshold
         self.model_manager = model_manager
+        self.config = config if config is not None else OCRConfig()
+        self.screenshot_prefilter = ScreenshotPrefilter() if self.config.skip_camera_photos else None
         self.executor = ThreadPoolExecutor(max_workers=1)
 
+    def get_preferred_batch_size(self) -> int:
+        return self.config.batch_size * max(1, self.config.num_processes)
+
     @asynccontextmanager
     async def run(self):
         async with self.model_manager.use(ModelType.OCR):
             yield self.Engine(self, lambda: self.model_manager.get_model(ModelType.OCR))
 
     class Engine:
-        def __init__(self, wrapper: "OCREngine", lazy_model_provider: Callable[[], Awaitable[easyocr.Reader]]) -> None:
+        def __init__(self, wrapper: "OCREngine", lazy_model_provider: Callable[[], Awaitable[Union[easyocr.Reader, OCRProcessPool]]]) -> None:
             self.wrapper = wrapper
             self.model_provider = lazy_model_provider
 
         async def run_ocr(self, image_path: Path) -> OCRResult:
+            return (await self.run_ocrs([image_path]))[0]
+
+        async def run_ocrs(self, image_paths: list[Path]) -> list[OCRResult]:
+            if not image_paths:
+                return []
             model = await self.model_provider()
-            def _do_ocr():
-                try:
-                    res = model.readtext(str(image_path.absolute()))
-                except Exception as e:
-                    if image_path.suffix != '.gif':
-                        logger.error(f'Failed to perform OCR on {image_path.name}', exc_info=e)
-                    return OCRResult(text='', is_screenshot=False)
-                full_text = []
-                total_words_per_language = [0] * len(self.wrapper.languages)
-                some_language_matched = False
-
-                for (_, text, prob) in res:
-                    if prob < 0.1:
-                        continue
-                    full_text.append(text)
-                    if not some_language_matched:
-                        for word in text.split():
-                            for i, lang in enumerate(self.wrapper.languages):
-                                if self._is_real_word(lang, word):
-                                    total_words_per_language[i] += 1
-                                    if total_words_per_language[i] >= self.wrapper.min_screenshot_words_threshold:
-                                        some_language_matched = True
-                                        break
-
-                return OCRResult(text=' '.join(full_text).strip(), is_screenshot=some_language_matched)
-            return await asyncio.get_running_loop().run_in_executor(self.wrapper.executor, _do_ocr)
-        
+            paths = [x.absolute() for x in image_paths]
+            config = self.wrapper.config
+            if isinstance(model, OCRProcessPool):
+                detections = await model.read_texts(paths, config.max_image_side, config.batch_size)
+            else:
+                detections = await asyncio.get_running_loop().run_in_executor(self.wrapper.executor,
+                    read_texts, model, paths, config.max_image_side, config.batch_size)
+            return [self._to_result(x) for x in detections]
+
+        def _to_result(self, detections: TextDetections) -> OCRResult:
+            if detections is None:
+                return OCRResult(text='', is_screenshot=False)
+            full_text = []
+            total_words_per_language = [0] * len(self.wrapper.languages)
+            some_language_matched = False
+
+            for (text, prob) in detections:
+                if prob < 0.1:
+                    continue
+                full_text.append(text)
+                if not some_language_matched:
+                    for word in text.split():
+                        for i, lang in enumerate(self.wrapper.languages):
+                            if self._is_real_word(lang, word):
+                                total_words_per_language[i] += 1
+                                if total_words_per_language[i] >= self.wrapper.min_screenshot_words_threshold:
+                                    some_language_matched = True
+                                    break
+
+            return OCRResult(text=' '.join(full_text).strip(), is_screenshot=some_language_matched)
+
         def _is_real_word(self, lang: str, word: str) -> bool:
             word = word.lower()
             return word.isalpha() and len(word) > 1 and word_frequency(word, lang, wordlist='small') > 1e-6
@@ -0,0 +1,142 @@
+import os
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+from sentence_transformers import SentenceTransformer
+from transformers import CLIPModel, CLIPProcessor
+
+from kfe.utils.log import logger
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+ONNX_OPSET_VERSION = 17
+
+
+def is_onnx_runtime_available() -> bool:
+    return ort is not None
+
+def _create_session(path: Path, num_threads: Optional[int]) -> "ort.InferenceSession":
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads is not None:
+        options.intra_op_num_threads = num_threads
+    return ort.InferenceSession(str(path), sess_options=options, providers=['CPUExecutionProvider'])
+
+def _export(module: torch.nn.Module, inputs: tuple[torch.Tensor, ...], input_names: list[str], output_name: str,
+            dynamic_axes: dict[str, dict[int, str]], path: Path, quantize: bool):
+    if path.exists():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    logger.info(f'exporting model to onnx: {path}')
+    with torch.no_grad():
+        torch.onnx.export(module.eval(), inputs, str(tmp_path), input_names=input_names, output_names=[output_name],
+            dynamic_axes={**dynamic_axes, output_name: {0: 'batch'}}, opset_version=ONNX_OPSET_VERSION)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantized_tmp_path = path.with_suffix('.quantized.tmp')
+        quantize_dynamic(str(tmp_path), str(quantized_tmp_path), weight_type=QuantType.QInt8)
+        os.replace(quantized_tmp_path, tmp_path)
+    # model is written atomically, so that interrupted export is not mistaken for a valid one
+    os.replace(tmp_path, path)
+
+
+class _SentenceEmbeddingModule(torch.nn.Module):
+    def __init__(self, model: SentenceTransformer, input_names: list[str]) -> None:
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *inputs: torch.Tensor) -> torch.Tensor:
+        return self.model(dict(zip(self.input_names, inputs)))['sentence_embedding']
+
+class OnnxSentenceEncoder:
+    '''Serves SentenceTransformer.encode from onnx runtime session, supports only plain text inputs without encode kwargs'''
+    BATCH_SIZE = 32
+
+    def __init__(self, session: "ort.InferenceSession", tokenizer: Any, max_seq_length: Optional[int], do_lower_case: bool) -> None:
+        self.session = session
+        self.tokenizer = tokenizer
+        self.max_seq_length = max_seq_length
+        self.do_lower_case = do_lower_case
+        self.input_names = [x.name for x in session.get_inputs()]
+
+    @staticmethod
+    def export(model: SentenceTransformer, path: Path, quantize: bool=False, num_threads: Optional[int]=None) -> "OnnxSentenceEncoder":
+        transformer = model[0]
+        features = model.tokenize(['sample text used for export'])
+        input_names = list(features.keys())
+        _export(_SentenceEmbeddingModule(model, input_names), tuple(features[x] for x in input_names), input_names,
+            'sentence_embedding', {x: {0: 'batch', 1: 'sequence'} for x in input_names}, path, quantize)
+        return OnnxSentenceEncoder(_create_session(path, num_threads), model.tokenizer,
+            model.get_max_seq_length(), getattr(transformer, 'do_lower_case', False))
+
+    def encode(self, sentences: list[str], **kwargs) -> np.ndarray:
+        texts = [str(x).strip() for x in sentences]
+        if self.do_lower_case:
+            texts = [x.lower() for x in texts]
+        # similar lengths in a batch minimize padding
+        order = np.argsort([-len(x) for x in texts])
+        results: list[Optional[np.ndarray]] = [None] * len(texts)
+        for start in range(0, len(texts), self.BATCH_SIZE):
+            batch_indices = order[start:start + self.BATCH_SIZE]
+            encoded = self.tokenizer([texts[i] for i in batch_indices], padding=True, truncation='longest_first',
+                max_length=self.max_seq_length, return_tensors='np')
+            inputs = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            embeddings = self.session.run(None, inputs)[0]
+            for i, embedding in zip(batch_indices, embeddings):
+                results[i] = embedding
+        return np.stack(results) if results else np.empty((0, self.session.get_outputs()[0].shape[-1]), dtype=np.float32)
+
+
+class _CLIPTextFeaturesModule(torch.nn.Module):
+    def __init__(self, model: CLIPModel) -> None:
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+class _CLIPImageFeaturesModule(torch.nn.Module):
+    def __init__(self, model: CLIPModel) -> None:
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+class OnnxCLIPModel:
+    '''Serves CLIPModel.get_text_features and get_image_features from onnx runtime sessions, returns cpu tensors'''
+
+    def __init__(self, text_session: "ort.InferenceSession", image_session: "ort.InferenceSession") -> None:
+        self.text_session = text_session
+        self.image_session = image_session
+
+    @staticmethod
+    def export(model: CLIPModel, processor: CLIPProcessor, directory: Path,
+               quantize: bool=False, num_threads: Optional[int]=None) -> "OnnxCLIPModel":
+        model = model.float()
+        inputs = processor(text=['a photo'], images=[Image.new('RGB', (224, 224))], return_tensors='pt', padding=True)
+        text_path, image_path = directory.joinpath('text.onnx'), directory.joinpath('image.onnx')
+        _export(_CLIPTextFeaturesModule(model), (inputs['input_ids'], inputs['attention_mask']), ['input_ids', 'attention_mask'],
+            'text_features', {'input_ids': {0: 'batch', 1: 'sequence'}, 'attention_mask': {0: 'batch', 1: 'sequence'}}, text_path, quantize)
+        _export(_CLIPImageFeaturesModule(model), (inputs['pixel_values'],), ['pixel_values'],
+            'image_features', {'pixel_values': {0: 'batch'}}, image_path, quantize)
+        return OnnxCLIPModel(_create_session(text_path, num_threads), _create_session(image_path, num_threads))
+
+    def get_text_features(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, **kwargs) -> torch.Tensor:
+        return torch.from_numpy(self.text_session.run(None, {
+            'input_ids': input_ids.cpu().numpy().astype(np.int64),
+            'attention_mask': attention_mask.cpu().numpy().astype(np.int64),
+        })[0])
+
+    def get_image_features(self, pixel_values: torch.Tensor, **kwargs) -> torch.Tensor:
+        return torch.from_numpy(self.image_session.run(None, {
+            'pixel_values': pixel_values.cpu().float().numpy(),
+        })[0])
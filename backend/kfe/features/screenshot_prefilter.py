@@ -0,0 +1,74 @@
+import asyncio
+from pathlib import Path
+
+from PIL import Image
+
+from kfe.utils.log import logger
+
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+MAKE_TAG = 0x010F
+MODEL_TAG = 0x0110
+USER_COMMENT_TAG = 0x9286
+# tags written by cameras which are not present in screenshots
+CAMERA_EXIF_TAGS = (
+    0x829A, # ExposureTime
+    0x829D, # FNumber
+    0x8827, # ISOSpeedRatings
+    0x920A, # FocalLength
+    0xA434, # LensModel
+)
+
+# resolutions of popular phone, tablet and computer screens, screenshots usually have one of them
+SCREEN_RESOLUTIONS = set((w, h) for (a, b) in [
+    (1280, 720), (1366, 768), (1440, 900), (1536, 864), (1600, 900), (1680, 1050), (1920, 1080), (1920, 1200),
+    (2560, 1080), (2560, 1440), (2560, 1600), (2880, 1800), (3024, 1964), (3456, 2234), (3440, 1440), (3840, 2160),
+    (750, 1334), (828, 1792), (1080, 1920), (1080, 2340), (1080, 2400), (1125, 2436), (1170, 2532), (1179, 2556),
+    (1242, 2688), (1284, 2778), (1290, 2796), (1440, 3088), (1440, 3200), (720, 1600), (1536, 2048), (1620, 2160),
+    (1668, 2388), (2048, 2732),
+] for (w, h) in [(a, b), (b, a)])
+
+
+class ScreenshotPrefilter:
+    '''
+    Recognizes images which are clearly camera photos, so that OCR, which is used to detect screenshots, can be skipped for them.
+    Image is considered a photo only if its EXIF has camera make or model and at least `min_camera_evidence` camera tags in total,
+    and its dimensions don't match any known screen resolution. Images without EXIF are never skipped.
+    '''
+    def __init__(self, min_camera_evidence: int=3) -> None:
+        self.min_camera_evidence = min_camera_evidence
+        self.checked = 0
+        self.skipped = 0
+
+    async def find_camera_photos(self, image_paths: list[Path]) -> list[bool]:
+        def _check():
+            return [self.is_camera_photo(path) for path in image_paths]
+        res = await asyncio.get_running_loop().run_in_executor(None, _check)
+        self.checked += len(res)
+        self.skipped += sum(res)
+        return res
+
+    def get_skip_ratio(self) -> float:
+        return self.skipped / self.checked if self.checked else 0.
+
+    def is_camera_photo(self, path: Path) -> bool:
+        try:
+            with Image.open(path) as img:
+                if img.size in SCREEN_RESOLUTIONS:
+                    return False
+                exif = img.getexif()
+                if not exif:
+                    return False
+                exif_ifd = exif.get_ifd(EXIF_IFD)
+                user_comment = exif_ifd.get(USER_COMMENT_TAG)
+                if isinstance(user_comment, (str, bytes)) and b'screenshot' in (
+                        user_comment.encode() if isinstance(user_comment, str) else user_comment).lower():
+                    return False
+                has_camera = bool(exif.get(MAKE_TAG)) or bool(exif.get(MODEL_TAG))
+                evidence = int(bool(exif.get(MAKE_TAG))) + int(bool(exif.get(MODEL_TAG))) + \
+                    sum(1 for tag in CAMERA_EXIF_TAGS if exif_ifd.get(tag) is not None) + \
+                    int(bool(exif.get_ifd(GPS_IFD)))
+                return has_camera and evidence >= self.min_camera_evidence
+        except Exception as e:
+            logger.debug(f'failed to read exif of {path.name}', exc_info=e)
+            return False
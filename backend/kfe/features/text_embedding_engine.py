@@ -7,6 +7,7 @@ import numpy as np
 import torch
 from sentence_transformers import SentenceTransformer
 
+from kfe.utils.micro_batcher import MicroBatcher, MicroBatcherConfig
 from kfe.utils.model_manager import ModelManager, ModelType
 
 
@@ -20,9 +21,14 @@ class TextModelWithConfig(NamedTuple):
 class TextEmbeddingEngine:
     '''Returns normalized embeddings'''
 
-    def __init__(self, model_manager: ModelManager) -> None:
+    def __init__(self, model_manager: ModelManager, micro_batcher_config: Optional[MicroBatcherConfig]=None) -> None:
         self.model_manager = model_manager
         self.executor = ThreadPoolExecutor(max_workers=1)
+        # single texts requested concurrently (e.g., by queries of different directories) are embedded in one forward pass,
+        # batch is processed only by callers that use the model, so the model can't be freed meanwhile
+        model_provider = lambda: self.model_manager.get_model(ModelType.TEXT_EMBEDDING)
+        self.query_batcher = MicroBatcher(lambda texts: self._generate(model_provider, texts, are_queries=True), micro_batcher_config)
+        self.passage_batcher = MicroBatcher(lambda texts: self._generate(model_provider, texts, are_queries=False), micro_batcher_config)
 
     @asynccontextmanager
     async def run(self):
@@ -35,28 +41,28 @@ class TextEmbeddingEngine:
             self.model_provider = lazy_model_provider
 
         async def generate_query_embedding(self, text: str) -> np.ndarray:
-            return (await self.generate_query_embeddings([text]))[0]
+            return await self.wrapper.query_batcher.submit(text)
 
         async def generate_query_embeddings(self, texts: list[str]) -> list[np.ndarray]:
-            return await self._generate(texts, are_queries=True)
+            return await self.wrapper._generate(self.model_provider, texts, are_queries=True)
 
         async def generate_passage_embedding(self, text: str) -> np.ndarray:
-            return (await self.generate_passage_embeddings([text]))[0]
+            return await self.wrapper.passage_batcher.submit(text)
 
         async def generate_passage_embeddings(self, texts: list[str]) -> list[np.ndarray]:
-            return await self._generate(texts, are_queries=False)
-
-        async def _generate(self, texts: list[str], are_queries: bool) -> list[np.ndarray]:
-            model_with_config = await self.model_provider()
-            model = model_with_config.model
-            prefix = model_with_config.query_prefix if are_queries else model_with_config.passage_prefix
-            encode_kwargs = model_with_config.query_encode_kwargs if are_queries else model_with_config.passage_encode_kwargs
-            if encode_kwargs is None:
-                encode_kwargs = {}
-
-            def _do_generate():
-                with torch.no_grad():
-                    embeddings = model.encode([x + prefix for x in texts], **encode_kwargs)
-                return list(embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True))
-
-            return await asyncio.get_running_loop().run_in_executor(self.wrapper.executor, _do_generate)
+            return await self.wrapper._generate(self.model_provider, texts, are_queries=False)
+
+    async def _generate(self, model_provider: Callable[[], Awaitable[TextModelWithConfig]], texts: list[str], are_queries: bool) -> list[np.ndarray]:
+        model_with_config = await model_provider()
+        model = model_with_config.model
+        prefix = model_with_config.query_prefix if are_queries else model_with_config.passage_prefix
+        encode_kwargs = model_with_config.query_encode_kwargs if are_queries else model_with_config.passage_encode_kwargs
+        if encode_kwargs is None:
+            encode_kwargs = {}
+
+        def _do_generate():
+            with torch.no_grad():
+                embeddings = model.encode([x + prefix for x in texts], **encode_kwargs)
+            return list(embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True))
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, _do_generate)
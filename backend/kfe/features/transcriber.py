@@ -1,26 +1,68 @@
 import asyncio
-import io
+import hashlib
+import os
 from abc import ABC, abstractmethod
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable
+from typing import (AsyncGenerator, Awaitable, Callable, NamedTuple,
+                    Optional, Union)
 
-import librosa
+import numpy as np
 import torch
 from transformers import Pipeline
 
+from kfe.features.audioutils.vad import VADConfig, get_speech_windows
+from kfe.utils.audio_decoder import stream_audio_chunks
+from kfe.utils.constants import (TRANSCRIPTION_CHUNK_SECONDS_ENV,
+                                 TRANSCRIPTION_VAD_ENV)
 from kfe.utils.log import logger
 from kfe.utils.model_manager import ModelManager, ModelType
-from kfe.utils.video_frames_extractor import (get_video_duration_seconds,
-                                              seconds_to_ffmpeg_time)
 
 
+class TranscriptionSettings(NamedTuple):
+    '''Settings which affect produced transcripts'''
+    max_part_length_seconds: float = 29.
+    max_num_parts: int = 20
+    # None disables voice activity detection
+    vad_config: Optional[VADConfig] = VADConfig()
+
+    @staticmethod
+    def from_env() -> "TranscriptionSettings":
+        return TranscriptionSettings(
+            max_part_length_seconds=float(os.getenv(TRANSCRIPTION_CHUNK_SECONDS_ENV, '29')),
+            vad_config=VADConfig() if os.getenv(TRANSCRIPTION_VAD_ENV, 'true') == 'true' else None
+        )
+
+    def get_version_tag(self) -> str:
+        '''Identifies the settings, so that transcripts cached with other settings are not reused'''
+        vad = 'novad' if self.vad_config is None else 'vad'
+        return f'{vad}-{hashlib.sha256(repr(self).encode(), usedforsecurity=False).hexdigest()[:8]}'
+
+class TranscriptionResult(NamedTuple):
+    transcript: str
+    # fraction of audio detected as speech, None if voice activity detection was not used
+    speech_coverage: Optional[float] = None
+
+class AudioParts(NamedTuple):
+    parts: list[np.ndarray]
+    speech_coverage: Optional[float]
+
 class TranscriberEngine(ABC):
     @abstractmethod
     async def transcribe(self, file_path: Path) -> str:
         pass
 
+    async def transcribe_many(self, file_paths: list[Path]) -> list[Union[TranscriptionResult, Exception]]:
+        '''Returns transcription result or exception that occurred during transcription for each file'''
+        results = []
+        for path in file_paths:
+            try:
+                results.append(TranscriptionResult(await self.transcribe(path)))
+            except Exception as e:
+                results.append(e)
+        return results
+
 class Transcriber(ABC):
     @asynccontextmanager
     @abstractmethod
@@ -29,11 +71,16 @@ class Transcriber(ABC):
 
 
 class PipelineBasedTranscriber(Transcriber):
-    def __init__(self, model_manager: ModelManager, max_part_length_seconds: float=29., min_part_length_seconds: float=0.5, max_num_parts: int=20) -> None:
+    def __init__(self, model_manager: ModelManager, max_part_length_seconds: float=29., min_part_length_seconds: float=0.5, max_num_parts: int=20,
+                 batch_size: int=8, max_concurrent_decodes: int=4, vad_config: Optional[VADConfig]=VADConfig()) -> None:
         self.model_manager = model_manager
         self.max_part_length_seconds = max_part_length_seconds
         self.min_part_length_seconds = min_part_length_seconds
         self.max_num_parts = max_num_parts
+        self.batch_size = batch_size
+        self.max_concurrent_decodes = max_concurrent_decodes
+        # None disables voice activity detection, whole audio is transcribed then
+        self.vad_config = vad_config
         self.executor = ThreadPoolExecutor(max_workers=1)
 
     @asynccontextmanager
@@ -47,38 +94,79 @@ class PipelineBasedTranscriber(Transcriber):
             self.model_provider = lazy_model_provider
 
         async def transcribe(self, file_path: Path) -> str:
-            parts = []
+            res = (await self.transcribe_many([file_path]))[0]
+            if isinstance(res, Exception):
+                raise res
+            return res.transcript
+
+        async def transcribe_many(self, file_paths: list[Path]) -> list[Union[TranscriptionResult, Exception]]:
             pipeline, sampling_rate = await self.model_provider()
-            async for audio_file_bytes in self.wrapper._get_preprocessed_audio_file(file_path, sampling_rate):
-                if audio_file_bytes is None:
-                    return
-                def _transcribe():
-                    with torch.no_grad():
-                        return pipeline(audio_file_bytes)
-                parts.append((await asyncio.get_running_loop().run_in_executor(self.wrapper.executor,  _transcribe))['text'])
-            return ' '.join(parts).strip()
-
-    async def _get_preprocessed_audio_file(self, file_path: Path, sampling_rate: int) -> AsyncIterator[io.BytesIO | None]:
-        duration = await get_video_duration_seconds(file_path)
-        for i in range(min(int(duration) // int(self.max_part_length_seconds) + 1, self.max_num_parts)):
-            if i > 0 and duration - i * self.max_part_length_seconds < self.min_part_length_seconds:
-                return
-            proc = await asyncio.subprocess.create_subprocess_exec(
-                'ffmpeg',
-                '-i', str(file_path.absolute()),
-                '-ss', seconds_to_ffmpeg_time(i * self.max_part_length_seconds),
-                '-to', seconds_to_ffmpeg_time(min(duration, (i + 1) * self.max_part_length_seconds)),
-                '-vn', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(sampling_rate), '-f', 'wav', '-',
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await proc.communicate()
-            if proc.returncode != 0:
-                logger.warning(f'ffmpeg returned with {proc.returncode} code for audio transcription preprocessing generation for {file_path.name}')
-                logger.debug(f'ffmpeg stderr: {stderr.decode()}')
-                if i == 0:
-                    yield None # make sure we have a generator
-                return
-            else:
-                audio_samples, _ = librosa.load(io.BytesIO(stdout), sr=None)
-                yield audio_samples
+            errors: dict[int, Exception] = {}
+            speech_coverages: dict[int, Optional[float]] = {}
+            decode_semaphore = asyncio.Semaphore(self.wrapper.max_concurrent_decodes)
+
+            async def _decode(file_idx: int) -> list[tuple[int, int, np.ndarray]]:
+                async with decode_semaphore:
+                    try:
+                        audio_parts = await self.wrapper._get_preprocessed_audio_parts(file_paths[file_idx], sampling_rate)
+                    except Exception as e:
+                        errors[file_idx] = e
+                        return []
+                    speech_coverages[file_idx] = audio_parts.speech_coverage
+                    return [(file_idx, part_idx, samples) for part_idx, samples in enumerate(audio_parts.parts)]
+
+            parts = [part for file_parts in await asyncio.gather(*[_decode(i) for i in range(len(file_paths))]) for part in file_parts]
+            # parts of similar length are batched together, generation of all sequences in a batch takes as long as the longest one
+            parts.sort(key=lambda x: len(x[2]), reverse=True)
+            texts: dict[tuple[int, int], str] = {}
+            for start in range(0, len(parts), self.wrapper.batch_size):
+                batch = [x for x in parts[start:start + self.wrapper.batch_size] if x[0] not in errors]
+                for (file_idx, part_idx, _), text in zip(batch, await self._transcribe_parts(pipeline, batch, errors)):
+                    if text is not None:
+                        texts[file_idx, part_idx] = text
+
+            results: list[Union[TranscriptionResult, Exception]] = []
+            for i in range(len(file_paths)):
+                if i in errors:
+                    results.append(errors[i])
+                else:
+                    file_texts = sorted((part_idx, text) for (file_idx, part_idx), text in texts.items() if file_idx == i)
+                    results.append(TranscriptionResult(' '.join(text for _, text in file_texts).strip(), speech_coverages[i]))
+            return results
+
+        async def _transcribe_parts(self, pipeline: Pipeline, parts: list[tuple[int, int, np.ndarray]],
+                                    errors: dict[int, Exception]) -> list[Optional[str]]:
+            if not parts:
+                return []
+            def _transcribe():
+                with torch.no_grad():
+                    return pipeline([samples for _, _, samples in parts], batch_size=len(parts))
+            try:
+                outputs = await asyncio.get_running_loop().run_in_executor(self.wrapper.executor, _transcribe)
+                return [x['text'] for x in outputs]
+            except Exception as e:
+                if len(parts) == 1:
+                    errors[parts[0][0]] = e
+                    return [None]
+                # one broken part should not fail transcriptions of other files
+                logger.debug(f'batched transcription of {len(parts)} parts failed, transcribing them separately', exc_info=e)
+                return [(await self._transcribe_parts(pipeline, [part], errors))[0] for part in parts]
+
+    async def _get_preprocessed_audio_parts(self, file_path: Path, sampling_rate: int) -> AudioParts:
+        # audio is decoded once, parts are sliced from a single ffmpeg stream
+        min_part_samples = int(self.min_part_length_seconds * sampling_rate)
+        chunks = []
+        async for audio_samples in stream_audio_chunks(file_path, sampling_rate, self.max_part_length_seconds,
+                max_seconds=self.max_part_length_seconds * self.max_num_parts):
+            chunks.append(audio_samples)
+        if self.vad_config is None:
+            if len(chunks) > 1 and len(chunks[-1]) < min_part_samples:
+                chunks.pop()
+            return AudioParts(chunks, speech_coverage=None)
+        if not chunks:
+            return AudioParts([], speech_coverage=0.)
+        def _detect_speech():
+            # silence, noise and music are not sent to the model, speech segments are packed into model-sized windows
+            speech = get_speech_windows(np.concatenate(chunks), sampling_rate, self.max_part_length_seconds, self.vad_config)
+            return AudioParts([x for x in speech.windows if len(x) >= min_part_samples], speech.speech_coverage)
+        return await asyncio.get_running_loop().run_in_executor(None, _detect_speech)
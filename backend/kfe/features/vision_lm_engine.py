@@ -1,29 +1,39 @@
 import asyncio
+import weakref
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Awaitable, Callable, NamedTuple
+from typing import Any, Awaitable, Callable, NamedTuple, Union
 
+import torch
 from PIL import Image
+from transformers import DynamicCache
 
 from kfe.features.visionlmutils.janus.modeling_vlm import MultiModalityCausalLM
 from kfe.features.visionlmutils.janus.processing_vlm import VLChatProcessor
+from kfe.utils.keyframe_selector import get_video_keyframes
 from kfe.utils.log import logger
 from kfe.utils.model_manager import ModelManager, ModelType
-from kfe.utils.video_frames_extractor import (get_video_duration_seconds,
-                                              get_video_frame_at_offset)
 
 
 class VisionLMModel(NamedTuple):
     model: MultiModalityCausalLM
     chat_processor: VLChatProcessor
 
+class PromptPrefixCache(NamedTuple):
+    token_ids: tuple[int, ...]
+    # per layer (key, value) tensors of batch size 1
+    key_values: tuple[tuple[torch.Tensor, torch.Tensor], ...]
+
 class VisionLMEngine:
-    def __init__(self, model_manager: ModelManager, max_tokens=200, min_video_description_characters=70):
+    def __init__(self, model_manager: ModelManager, max_tokens=200, min_video_description_characters=70, batch_size=4):
         self.model_manager = model_manager
         self.max_tokens = max_tokens
         self.min_video_description_characters = min_video_description_characters
+        self.batch_size = batch_size
         self.executor = ThreadPoolExecutor(max_workers=1)
+        # kv states of the prompt part before the image, they are the same for every image; cache is dropped with the model
+        self.prefix_caches: weakref.WeakKeyDictionary[MultiModalityCausalLM, PromptPrefixCache] = weakref.WeakKeyDictionary()
 
     @asynccontextmanager
     async def run(self):
@@ -32,14 +42,15 @@ class VisionLMEngine:
 
     @staticmethod
     def _get_image_description_prompt() -> str:
+        # image is at the end, so that kv states of the instructions don't depend on it and can be reused
         return (
-'''<image_placeholder>
-Describe in around 3 sentences visual and semantic aspects of the image.
+'''Describe in around 3 sentences visual and semantic aspects of the image below.
 Rules:
 - You must describe the meaning of the image (for example 'person driving a car' or 'meme showing a cat dressed like a man') and visual aspects of it, like colors, items or people on the foreground and backgroud, clothes, etc.
 - If image depicts a person or a group of people you must also describe their emotions based on their facial expressions and gestures.
 - Construct the description as follows: in the first sentence describe just the visuals, explain what is on the image. In the second sentence provide more details about depicted people or objects on the foregroud and background. In the third sentence write the general meaning of the image, try to guess what is happening there. 
-Your description will be used as a part of search system and should cover aspects that people might want to search by.''')
+Your description will be used as a part of search system and should cover aspects that people might want to search by.
+<image_placeholder>''')
 
     class Engine:
         def __init__(self, wrapper: "VisionLMEngine", lazy_model_provider: Callable[[], Awaitable[VisionLMModel]]) -> None:
@@ -49,28 +60,57 @@ Your description will be used as a part of search system and should cover aspect
         async def generate_image_description(self, image_path: Path) -> str:
             image = Image.open(image_path).convert('RGB')
             return await self._generate_image_description(image)
+
+        async def generate_image_descriptions(self, image_paths: list[Path]) -> list[Union[str, Exception]]:
+            '''Returns description or exception that occurred during generation for each image, images are processed in batches'''
+            results: list[Union[str, Exception, None]] = [None] * len(image_paths)
+            images: dict[int, Image.Image] = {}
+            for i, path in enumerate(image_paths):
+                try:
+                    images[i] = Image.open(path).convert('RGB')
+                except Exception as e:
+                    results[i] = e
+            indices = list(images.keys())
+            for start in range(0, len(indices), self.wrapper.batch_size):
+                batch = indices[start:start + self.wrapper.batch_size]
+                try:
+                    descriptions = await self._generate_image_descriptions([images[i] for i in batch])
+                except Exception as e:
+                    if len(batch) == 1:
+                        results[batch[0]] = e
+                        continue
+                    logger.debug(f'batched generation of {len(batch)} descriptions failed, generating them separately', exc_info=e)
+                    descriptions = []
+                    for i in batch:
+                        try:
+                            descriptions.append(await self._generate_image_description(images[i]))
+                        except Exception as e:
+                            descriptions.append(e)
+                for i, description in zip(batch, descriptions):
+                    results[i] = description
+            return results
         
         async def generate_video_description(self, video_path: Path) -> str:
-            # TODO maybe use some fast heuristic for selection, e.g., motion with unrecognizable objects
-            # should have bad compression ratio, while static image with uniform-ish objects should
-            # have better compression ratio, for now lets just assume that llm will produce short
-            # output if it fails to recognize anything on the image and longer if it succeeds
-            video_duration = await get_video_duration_seconds(video_path)
-            initial_attempt = video_duration / 2
-            frame = await get_video_frame_at_offset(video_path, initial_attempt)
-            description = await self._generate_image_description(frame)
-            if len(description) >= self.wrapper.min_video_description_characters:
+            # frames are ranked by cheap statistics, llm is expected to produce short output if it fails to recognize
+            # anything on the best frame, then the next one is tried
+            keyframes = await get_video_keyframes(video_path, k=2)
+            if not keyframes:
+                raise ValueError(f'no frames extracted from video: {video_path}')
+            description = await self._generate_image_description(keyframes[0].image)
+            if len(description) >= self.wrapper.min_video_description_characters or len(keyframes) < 2:
                 return description
             try:
-                frame = await get_video_frame_at_offset(video_path, initial_attempt / 2)
-                new_description = await self._generate_image_description(frame)
-                if len(new_description) > description:
+                new_description = await self._generate_image_description(keyframes[1].image)
+                if len(new_description) > len(description):
                     return new_description
             except Exception as e:
-                logger.warning(f'failed to generate second-try description for video: {video_path} at offset {initial_attempt / 2}s', exc_info=e)
+                logger.warning(f'failed to generate second-try description for video: {video_path} at offset {keyframes[1].offset_seconds:.1f}s', exc_info=e)
             return description
 
         async def _generate_image_description(self, image: Image.Image) -> str:
+            return (await self._generate_image_descriptions([image]))[0]
+
+        async def _generate_image_descriptions(self, images: list[Image.Image]) -> list[str]:
             vision_lm = await self.model_provider()
             def _generate():
                 conversation = [
@@ -80,24 +120,79 @@ Your description will be used as a part of search system and should cover aspect
                     },
                     {"role": "Assistant", "content": ""},
                 ]
-                prepare_inputs = vision_lm.chat_processor(
-                    conversations=conversation, images=[image], force_batchify=True
-                ).to(vision_lm.model.device)
-                
-                inputs_embeds = vision_lm.model.prepare_inputs_embeds(**prepare_inputs)
-
-                tokenizer = vision_lm.chat_processor.tokenizer
-                outputs = vision_lm.model.language_model.generate(
-                    inputs_embeds=inputs_embeds,
-                    attention_mask=prepare_inputs.attention_mask,
-                    pad_token_id=tokenizer.eos_token_id,
-                    bos_token_id=tokenizer.bos_token_id,
-                    eos_token_id=tokenizer.eos_token_id,
-                    max_new_tokens=self.wrapper.max_tokens,
-                    do_sample=False,
-                    use_cache=True,
-                )
-
-                answer = tokenizer.decode(outputs[0].cpu().tolist(), skip_special_tokens=True)
-                return answer.strip()
+                chat_processor = vision_lm.chat_processor
+                prepare_inputs = chat_processor.batchify([
+                    chat_processor.process_one(conversations=conversation, images=[image]) for image in images
+                ]).to(vision_lm.model.device)
+
+                with torch.no_grad():
+                    inputs_embeds = vision_lm.model.prepare_inputs_embeds(**prepare_inputs)
+                    if bool(prepare_inputs.attention_mask.all()):
+                        output_ids = self._generate_with_prefix_cache(vision_lm, prepare_inputs, inputs_embeds)
+                    else:
+                        # prompts of different lengths are left-padded, cached prefix can't be shared then
+                        output_ids = self._generate_without_prefix_cache(vision_lm, prepare_inputs, inputs_embeds)
+
+                tokenizer = chat_processor.tokenizer
+                return [tokenizer.decode(x, skip_special_tokens=True).strip() for x in output_ids]
             return await asyncio.get_running_loop().run_in_executor(self.wrapper.executor,  _generate)
+
+        def _generate_without_prefix_cache(self, vision_lm: VisionLMModel, prepare_inputs: Any, inputs_embeds: torch.Tensor) -> list[list[int]]:
+            tokenizer = vision_lm.chat_processor.tokenizer
+            outputs = vision_lm.model.language_model.generate(
+                inputs_embeds=inputs_embeds,
+                attention_mask=prepare_inputs.attention_mask,
+                pad_token_id=tokenizer.eos_token_id,
+                bos_token_id=tokenizer.bos_token_id,
+                eos_token_id=tokenizer.eos_token_id,
+                max_new_tokens=self.wrapper.max_tokens,
+                do_sample=False,
+                use_cache=True,
+            )
+            return outputs.cpu().tolist()
+
+        def _generate_with_prefix_cache(self, vision_lm: VisionLMModel, prepare_inputs: Any, inputs_embeds: torch.Tensor) -> list[list[int]]:
+            # greedy decoding, equivalent to generate with do_sample=False, which continues from cached kv states of the prompt prefix
+            language_model = vision_lm.model.language_model
+            eos_token_id = vision_lm.chat_processor.tokenizer.eos_token_id
+            batch_size = inputs_embeds.shape[0]
+            prefix_length = int(prepare_inputs.images_seq_mask[0].int().argmax())
+            prefix_cache = self._get_prefix_cache(vision_lm, prepare_inputs.input_ids[0, :prefix_length], inputs_embeds[:1, :prefix_length])
+            past_key_values = DynamicCache.from_legacy_cache(tuple(
+                (k.expand(batch_size, -1, -1, -1).contiguous(), v.expand(batch_size, -1, -1, -1).contiguous())
+                for k, v in prefix_cache.key_values
+            ))
+            attention_mask = prepare_inputs.attention_mask
+            step_embeds = inputs_embeds[:, prefix_length:]
+            generated = []
+            finished = torch.zeros(batch_size, dtype=torch.bool, device=inputs_embeds.device)
+            for _ in range(self.wrapper.max_tokens):
+                outputs = language_model.model(inputs_embeds=step_embeds, attention_mask=attention_mask,
+                    past_key_values=past_key_values, use_cache=True)
+                past_key_values = outputs.past_key_values
+                # logits are computed only for the last position, full prompt logits would take hundreds of MB
+                next_tokens = language_model.lm_head(outputs.last_hidden_state[:, -1]).argmax(dim=-1)
+                next_tokens = torch.where(finished, torch.full_like(next_tokens, eos_token_id), next_tokens)
+                generated.append(next_tokens)
+                finished |= next_tokens == eos_token_id
+                if bool(finished.all()):
+                    break
+                attention_mask = torch.cat([attention_mask, attention_mask.new_ones((batch_size, 1))], dim=1)
+                step_embeds = language_model.get_input_embeddings()(next_tokens[:, None])
+
+            output_ids = []
+            for row in torch.stack(generated, dim=1).cpu().tolist():
+                output_ids.append(row[:row.index(eos_token_id)] if eos_token_id in row else row)
+            return output_ids
+
+        def _get_prefix_cache(self, vision_lm: VisionLMModel, prefix_ids: torch.Tensor, prefix_embeds: torch.Tensor) -> PromptPrefixCache:
+            token_ids = tuple(prefix_ids.cpu().tolist())
+            cache = self.wrapper.prefix_caches.get(vision_lm.model)
+            if cache is None or cache.token_ids != token_ids:
+                outputs = vision_lm.model.language_model.model(inputs_embeds=prefix_embeds, use_cache=True)
+                key_values = outputs.past_key_values
+                if hasattr(key_values, 'to_legacy_cache'):
+                    key_values = key_values.to_legacy_cache()
+                cache = PromptPrefixCache(token_ids=token_ids, key_values=tuple((k, v) for k, v in key_values))
+                self.wrapper.prefix_caches[vision_lm.model] = cache
+            return cache
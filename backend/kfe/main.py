@@ -13,7 +13,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 
-from kfe.utils.constants import (DEVICE_ENV, LOG_LEVEL_ENV,
+from kfe.utils.constants import (BACKGROUND_LLM_DESCRIPTIONS_ENV,
+                                 CPU_INFERENCE_BACKEND_ENV,
+                                 CPU_QUANTIZATION_ENV, CPU_THREADS_ENV,
+                                 DEVICE_ENV, LOG_LEVEL_ENV, OCR_PROCESSES_ENV,
                                  PRELOAD_THUMBNAILS_ENV,
                                  REGENERATE_LLM_DESCRIPTIONS_ENV,
                                  RETRANSCRIBE_AUTO_TRANSCRIBED_ENV,
@@ -24,25 +27,39 @@ from kfe.utils.constants import (DEVICE_ENV, LOG_LEVEL_ENV,
 @click.option('--host', default='127.0.0.1', show_default=True, help='Address on which application should be available.')
 @click.option('--port', default=8000, type=int, show_default=True, help='Port on which application should be available.')
 @click.option('--cpu', default=False, is_flag=True, show_default=True, help='Use CPU for models even if GPU is available.')
+@click.option('--cpu-quantization', default=False, is_flag=True, show_default=True, help='Quantize text embedding and CLIP models to int8 when they run on CPU. Inference is faster, embeddings differ slightly from the full precision ones.')
+@click.option('--cpu-inference-backend', default='torch', show_default=True, type=click.Choice(['torch', 'onnx']), help='Backend used by text embedding and CLIP models on CPU. Onnx requires onnxruntime package, models are exported once to the model cache directory. Falls back to torch if export fails.')
+@click.option('--cpu-threads', default=None, type=int, help='Number of threads used by models for CPU inference. By default number of physical cores is used.')
+@click.option('--ocr-processes', default=None, type=int, help='Number of processes used for OCR on CPU, each of them loads its own OCR model. By default it depends on number of CPU cores.')
 @click.option('--transcription-model', default=None, help='Choose transcription model. By default openai/whisper-large-v3 will be used if you have CUDA GPU or Apple silicon, otherwise openai/whisper-base will be used. See https://huggingface.co/openai/whisper-large-v3-turbo#model-details for alternatives, parameter that you pass should be "openai/whisper-<variant>".')
 @click.option('--retranscribe-auto-transcribed', default=False, is_flag=True, show_default=True, help='Whether transcriptions should be regenerated on startup. Transcriptions that you edited manually using GUI will not be affected. This can be useful if you changed the model.')
 @click.option('--regenerate-llm-descriptions', default=False, is_flag=True, show_default=True, help='Whether LLM descriptions should be regenerated on startup. This can be useful if you changed the model or the prompt.')
+@click.option('--no-background-llm-descriptions', default=False, is_flag=True, show_default=True, help='Do not generate LLM descriptions of files added while the application is running. By default they are generated in the background when the application is idle and there is enough free memory.')
 @click.option('--no-preload-thumbnails', default=False, is_flag=True, show_default=True, help='Do not load all file thumbnails to memory on startup. Application will use less memory but queries will be slower.')
 @click.option('--no-firewall', default=False, is_flag=True, show_default=True, help='Do not block connections from external addresses (other than localhost and 0.0.0.0).')
 @click.option('--log-level', default='INFO', show_default=True, type=click.Choice(list(logging._nameToLevel.keys())))
-def main(host: str, port: int, cpu: bool, transcription_model: Optional[str], retranscribe_auto_transcribed: bool, 
-         regenerate_llm_descriptions: bool, no_preload_thumbnails: bool, no_firewall: bool, log_level: str):
+def main(host: str, port: int, cpu: bool, cpu_quantization: bool, cpu_inference_backend: str, cpu_threads: Optional[int], ocr_processes: Optional[int], transcription_model: Optional[str], retranscribe_auto_transcribed: bool, 
+         regenerate_llm_descriptions: bool, no_background_llm_descriptions: bool, no_preload_thumbnails: bool, no_firewall: bool, log_level: str):
     print('starting kfe server...')
 
     os.environ[LOG_LEVEL_ENV] = log_level
     if cpu:
         os.environ[DEVICE_ENV] = 'cpu'
+    if cpu_quantization:
+        os.environ[CPU_QUANTIZATION_ENV] = 'true'
+    os.environ[CPU_INFERENCE_BACKEND_ENV] = cpu_inference_backend
+    if cpu_threads is not None:
+        os.environ[CPU_THREADS_ENV] = str(cpu_threads)
+    if ocr_processes is not None:
+        os.environ[OCR_PROCESSES_ENV] = str(ocr_processes)
     if transcription_model is not None:
         os.environ[TRANSCRIPTION_MODEL_ENV] = transcription_model
     if retranscribe_auto_transcribed:
         os.environ[RETRANSCRIBE_AUTO_TRANSCRIBED_ENV] = 'true'
     if regenerate_llm_descriptions:
         os.environ[REGENERATE_LLM_DESCRIPTIONS_ENV] = 'true'
+    if no_background_llm_descriptions:
+        os.environ[BACKGROUND_LLM_DESCRIPTIONS_ENV] = 'false'
     if no_preload_thumbnails:
         os.environ[PRELOAD_THUMBNAILS_ENV] = 'false'
 
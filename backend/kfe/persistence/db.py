@@ -1,23 +1,71 @@
+import os
 from pathlib import Path
+from typing import Any, NamedTuple, Optional
 
+from sqlalchemy import Connection, event, inspect
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from kfe.persistence.model import Base
+from kfe.utils.constants import (SQLITE_CACHE_SIZE_MB_ENV,
+                                 SQLITE_JOURNAL_MODE_ENV,
+                                 SQLITE_MMAP_SIZE_MB_ENV,
+                                 SQLITE_SYNCHRONOUS_ENV, SQLITE_TEMP_STORE_ENV)
+from kfe.utils.log import logger
+
+
+class SQLiteConfig(NamedTuple):
+    # WAL lets queries read while initialization or file events write, it requires a local file system
+    journal_mode: str = 'WAL'
+    # NORMAL is safe with WAL, only the last transactions can be lost on power failure (not on application crash)
+    synchronous: str = 'NORMAL'
+    # page cache of each connection
+    cache_size_mb: int = 64
+    # 0 disables memory mapped reads
+    mmap_size_mb: int = 256
+    temp_store: str = 'MEMORY'
+
+    @staticmethod
+    def from_env() -> "SQLiteConfig":
+        return SQLiteConfig(
+            journal_mode=os.getenv(SQLITE_JOURNAL_MODE_ENV, 'WAL'),
+            synchronous=os.getenv(SQLITE_SYNCHRONOUS_ENV, 'NORMAL'),
+            cache_size_mb=int(os.getenv(SQLITE_CACHE_SIZE_MB_ENV, '64')),
+            mmap_size_mb=int(os.getenv(SQLITE_MMAP_SIZE_MB_ENV, '256')),
+            temp_store=os.getenv(SQLITE_TEMP_STORE_ENV, 'MEMORY')
+        )
+
+    def get_pragmas(self) -> list[str]:
+        return [
+            f'PRAGMA journal_mode={self.journal_mode}',
+            f'PRAGMA synchronous={self.synchronous}',
+            # negative value is in KiB
+            f'PRAGMA cache_size={-self.cache_size_mb * 1024}',
+            f'PRAGMA mmap_size={self.mmap_size_mb * 2**20}',
+            f'PRAGMA temp_store={self.temp_store}',
+        ]
 
 
 class Database:
     DB_FILE_NAME = '.kfe.db'
 
-    def __init__(self, directory: Path, log_sql=True) -> None:
+    def __init__(self, directory: Path, log_sql=True, config: Optional[SQLiteConfig]=None) -> None:
         self.engine = create_async_engine(
             url=f"sqlite+aiosqlite:///{directory.absolute()}/{self.DB_FILE_NAME}",
             echo=log_sql
         )
+        self.config = config if config is not None else SQLiteConfig.from_env()
+        event.listen(self.engine.sync_engine, 'connect', self._on_connect)
+
+    @staticmethod
+    def get_db_file_names() -> set[str]:
+        '''Returns names of the database file and files which sqlite creates next to it'''
+        return set([Database.DB_FILE_NAME] + [f'{Database.DB_FILE_NAME}-{suffix}' for suffix in ('journal', 'wal', 'shm')])
 
-    async def init_db(self): 
+    async def init_db(self):
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(self._migrate)
         self.session_maker = sessionmaker(
             autocommit=False,
             autoflush=False,
@@ -26,7 +74,44 @@ class Database:
         )
 
     async def close_db(self):
+        try:
+            async with self.engine.connect() as conn:
+                # updates query planner statistics if they are stale, cheap when nothing changed
+                await conn.exec_driver_sql('PRAGMA optimize')
+        except Exception as e:
+            logger.debug('failed to optimize database', exc_info=e)
         await self.engine.dispose()
 
-    def session(self) -> AsyncSession:
-        return self.session_maker()
+    def session(self, expire_on_commit: bool=True) -> AsyncSession:
+        return self.session_maker(expire_on_commit=expire_on_commit)
+
+    def _on_connect(self, dbapi_connection: Any, connection_record: Any):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in self.config.get_pragmas():
+                try:
+                    cursor.execute(pragma)
+                except Exception as e:
+                    logger.warning(f'failed to apply sqlite setting: {pragma}', exc_info=e)
+        finally:
+            cursor.close()
+
+    def _migrate(self, conn: Connection):
+        # create_all doesn't alter existing tables, columns added to the model later
+        # are added here (they must be nullable or have a server-independent default)
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            existing_columns = set(x['name'] for x in inspector.get_columns(table.name))
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=conn.dialect)
+                logger.info(f'migrating database: adding column {table.name}.{column.name}')
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+            # same for indexes added to the model later
+            existing_indexes = set(x['name'] for x in inspector.get_indexes(table.name))
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+                logger.info(f'migrating database: creating index {index.name} on {table.name}')
+                index.create(conn)
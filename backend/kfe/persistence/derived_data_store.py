@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import re
+from enum import Enum
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+from kfe.persistence.model import FileMetadata
+from kfe.utils.log import logger
+
+
+class DerivedArtifactType(str, Enum):
+    OCR         = 'ocr'
+    TRANSCRIPT  = 'transcript'
+    LLM_TEXT    = 'llm-text'
+    CLIP_IMAGE  = 'clip-image'
+    CLIP_VIDEO  = 'clip-video'
+    THUMBNAIL   = 'thumbnail'
+
+class DerivedDataStore:
+    '''
+    Content-addressed store of artifacts that are expensive to derive from a file (model outputs, thumbnails).
+    Artifacts are keyed by sha256 of file content, so byte-identical copies of a file, in the same or
+    in different registered directories, are processed only once. Each artifact type can have a version
+    (e.g., id of the model that produced it), artifacts of other versions are never returned.
+    '''
+    HASH_READ_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, store_dir: Path, artifact_versions: Optional[dict[DerivedArtifactType, str]]=None) -> None:
+        self.store_dir = store_dir
+        self.artifact_versions = artifact_versions if artifact_versions is not None else {}
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+        except Exception as e:
+            logger.error(f'Failed to create derived data store directory at {self.store_dir}', exc_info=e)
+
+    async def get_content_hash(self, root_dir: Path, file: FileMetadata) -> Optional[str]:
+        '''Returns hash of the file content, computing it only if it was not computed before. Result is written to file.content_hash.'''
+        if file.content_hash is not None:
+            return str(file.content_hash)
+        path = root_dir.joinpath(file.name)
+        try:
+            file.content_hash = await asyncio.get_running_loop().run_in_executor(None, self._compute_content_hash, path)
+            return file.content_hash
+        except Exception as e:
+            logger.warning(f'failed to compute content hash of {path}', exc_info=e)
+            return None
+
+    def load_record(self, content_hash: Optional[str], artifact: DerivedArtifactType, variant: str='') -> Optional[dict[str, Any]]:
+        data = self.load_bytes(content_hash, artifact, variant, extension='.json')
+        if data is None:
+            return None
+        try:
+            return json.loads(data.decode())
+        except Exception as e:
+            logger.warning(f'failed to decode stored {artifact} record for {content_hash}', exc_info=e)
+            return None
+
+    def save_record(self, content_hash: Optional[str], artifact: DerivedArtifactType, record: dict[str, Any], variant: str=''):
+        self.save_bytes(content_hash, artifact, json.dumps(record).encode(), variant, extension='.json')
+
+    def load_array(self, content_hash: Optional[str], artifact: DerivedArtifactType, variant: str='') -> Optional[np.ndarray]:
+        data = self.load_bytes(content_hash, artifact, variant, extension='.npy')
+        if data is None:
+            return None
+        try:
+            return np.load(io.BytesIO(data), allow_pickle=False)
+        except Exception as e:
+            logger.warning(f'failed to decode stored {artifact} array for {content_hash}', exc_info=e)
+            return None
+
+    def save_array(self, content_hash: Optional[str], artifact: DerivedArtifactType, array: np.ndarray, variant: str=''):
+        buff = io.BytesIO()
+        np.save(buff, array, allow_pickle=False)
+        self.save_bytes(content_hash, artifact, buff.getvalue(), variant, extension='.npy')
+
+    def load_bytes(self, content_hash: Optional[str], artifact: DerivedArtifactType, variant: str='', extension: str='') -> Optional[bytes]:
+        if content_hash is None:
+            return None
+        try:
+            with open(self._get_artifact_path(content_hash, artifact, variant, extension), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f'failed to load stored {artifact} for {content_hash}', exc_info=e)
+            return None
+
+    def save_bytes(self, content_hash: Optional[str], artifact: DerivedArtifactType, data: bytes, variant: str='', extension: str=''):
+        if content_hash is None:
+            return
+        path = self._get_artifact_path(content_hash, artifact, variant, extension)
+        tmp_path = path.with_name(path.name + '.tmp')
+        try:
+            os.makedirs(path.parent, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            # atomic, concurrent readers (other directories) never see partially written artifacts
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f'failed to store {artifact} for {content_hash}', exc_info=e)
+
+    def _get_artifact_path(self, content_hash: str, artifact: DerivedArtifactType, variant: str, extension: str) -> Path:
+        version = '-'.join(x for x in (self.artifact_versions.get(artifact, ''), variant) if x)
+        artifact_dir = artifact.value if not version else f'{artifact.value}--{self._to_path_safe(version)}'
+        return self.store_dir.joinpath(artifact_dir, content_hash[:2], content_hash + extension)
+
+    def _compute_content_hash(self, path: Path) -> str:
+        content_hash = hashlib.sha256(usedforsecurity=False)
+        with open(path, 'rb') as f:
+            while chunk := f.read(self.HASH_READ_CHUNK_SIZE):
+                content_hash.update(chunk)
+        return content_hash.hexdigest()
+
+    @staticmethod
+    def _to_path_safe(text: str) -> str:
+        return re.sub(r'[^A-Za-z0-9_.+-]', '_', text)
@@ -1,11 +1,12 @@
 import copy
 import hashlib
 import io
+import json
 import os
 from dataclasses import asdict, dataclass
 from enum import Enum
 from pathlib import Path
-from typing import Annotated, Optional, get_args
+from typing import Annotated, NamedTuple, Optional, get_args
 
 import numpy as np
 
@@ -67,16 +68,29 @@ class StoredEmbeddings:
                 return field_type
         raise KeyError(key)
 
+class EmbeddingVersions(NamedTuple):
+    # identify models (and their inference backends) which produce embeddings of each type
+    current: dict[StoredEmbeddingType, str]
+    # assumed for embeddings stored before versions were recorded, types without legacy version are outdated
+    legacy: dict[StoredEmbeddingType, str]
+
 class EmbeddingPersistor:
     HASH_LENGTH = 32
     EMBEDDING_FILE_EXTENSION = '.emb'
+    VERSIONS_FILE_NAME = 'versions.json'
 
-    def __init__(self, root_dir: Path) -> None:
+    def __init__(self, root_dir: Path, versions: Optional[EmbeddingVersions]=None) -> None:
+        '''
+        Stored embeddings of a different version than the current one are removed, so that they
+        are recomputed instead of being compared with embeddings produced by the current models.
+        '''
         self.embedding_dir = root_dir.joinpath('.embeddings')
         try:
             os.mkdir(self.embedding_dir)
         except FileExistsError:
             pass
+        if versions:
+            self._remove_outdated_embeddings(versions)
 
     def save(self, file_name: str, embeddings: StoredEmbeddings):
         path = self._get_file_path(file_name)
@@ -142,6 +156,59 @@ class EmbeddingPersistor:
                 pass
         return res
     
+    def _remove_outdated_embeddings(self, versions: EmbeddingVersions):
+        versions_path = self.embedding_dir.joinpath(self.VERSIONS_FILE_NAME)
+        stored_versions = {}
+        try:
+            with open(versions_path, 'r') as f:
+                stored_versions = json.load(f)
+        except FileNotFoundError:
+            stored_versions = {emb_type.value: version for emb_type, version in versions.legacy.items()}
+        except Exception as e:
+            logger.warning(f'failed to load embedding versions from {versions_path}', exc_info=e)
+        outdated_types = set(emb_type for emb_type, version in versions.current.items() if stored_versions.get(emb_type.value) != version)
+        if not outdated_types and versions_path.exists():
+            return
+        embedded_files = self.get_all_embedded_files() if outdated_types else []
+        if embedded_files:
+            logger.info(f'removing outdated embeddings of types {"".join(sorted(outdated_types))} in {self.embedding_dir}')
+        for file_name in embedded_files:
+            try:
+                self._remove_embeddings(file_name, outdated_types)
+            except Exception as e:
+                logger.error(f'failed to remove outdated embeddings of {file_name}', exc_info=e)
+                self.delete(file_name)
+        stored_versions.update((emb_type.value, version) for emb_type, version in versions.current.items())
+        # written after removal, if it is interrupted it is repeated on the next start
+        with open(versions_path, 'w') as f:
+            json.dump(stored_versions, f)
+
+    def _remove_embeddings(self, file_name: str, emb_types: set[StoredEmbeddingType]):
+        # text hashes are copied as they are, loading would require texts to recompute them
+        path = self._get_file_path(file_name)
+        kept = []
+        with open(path, 'rb') as f:
+            key_size = int(f.read(1).decode('ascii'))
+            key = f.read(key_size).decode('ascii')
+            if not any(emb_type in key for emb_type in emb_types):
+                return
+            for embedding_type in key:
+                field_type = get_args(StoredEmbeddings.get_annotation_for(embedding_type))[0]
+                text_hash = f.read(self.HASH_LENGTH) if field_type == MutableTextEmbedding else b''
+                embedding_vector = self._deserialize_embedding_vector(f)
+                if embedding_type not in emb_types:
+                    kept.append((embedding_type, text_hash, embedding_vector))
+        if not kept:
+            self.delete(file_name)
+            return
+        new_key = ''.join(embedding_type for embedding_type, _, _ in kept)
+        with open(path, 'wb') as f:
+            f.write(str(len(new_key)).encode('ascii'))
+            f.write(new_key.encode('ascii'))
+            for _, text_hash, embedding_vector in kept:
+                f.write(text_hash)
+                self._serialize_embedding_vector(f, embedding_vector)
+
     def _serialize_mutable_text(self, f: io.BufferedWriter, mutable_text: Optional[MutableTextEmbedding]):
         if mutable_text is None or mutable_text.embedding is None:
             return
@@ -1,10 +1,38 @@
-from typing import Optional
+import base64
+from datetime import datetime
+from typing import Any, NamedTuple, Optional
 
-from sqlalchemy import and_, desc, func, or_, select
+from sqlalchemy import desc, func, inspect, select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from kfe.persistence.model import FileMetadata, FileType
 
+# sqlite limits number of bound parameters of a single statement
+MAX_IDS_PER_QUERY = 500
+
+
+class FileListCursor(NamedTuple):
+    '''Position in files sorted by (added_at, id) descending, next page starts right after this file'''
+    added_at: datetime
+    id: int
+
+    @staticmethod
+    def of(file: FileMetadata) -> "FileListCursor":
+        return FileListCursor(file.added_at, int(file.id))
+
+    def encode(self) -> str:
+        return base64.urlsafe_b64encode(f'{self.added_at.isoformat()}|{self.id}'.encode()).decode()
+
+    @staticmethod
+    def decode(cursor: str) -> "FileListCursor":
+        added_at, file_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return FileListCursor(datetime.fromisoformat(added_at), int(file_id))
+
+
+def get_changed_attributes(file: FileMetadata) -> dict[str, Any]:
+    '''Returns attributes changed since the file was loaded or committed, file doesn't have to be attached to a session'''
+    return {attr.key: attr.value for attr in inspect(file).attrs if attr.history.has_changes()}
+
 
 class FileMetadataRepository:
     def __init__(self, sess: AsyncSession) -> None:
@@ -29,21 +57,24 @@ class FileMetadataRepository:
     async def load_files(self, offset: int, limit: Optional[int]=None) -> list[FileMetadata]:
         files = await self.sess.execute(select(FileMetadata).order_by(desc(FileMetadata.added_at), desc(FileMetadata.id)).offset(offset).limit(limit))
         return list(files.scalars().all())
+
+    async def load_files_after(self, cursor: Optional[FileListCursor], limit: int) -> list[FileMetadata]:
+        '''Keyset pagination, unlike `load_files` cost doesn't grow with the position of the page'''
+        query = select(FileMetadata).order_by(desc(FileMetadata.added_at), desc(FileMetadata.id))
+        if cursor is not None:
+            query = query.where(tuple_(FileMetadata.added_at, FileMetadata.id) < tuple_(cursor.added_at, cursor.id))
+        files = await self.sess.execute(query.limit(limit))
+        return list(files.scalars().all())
     
     async def get_file_offset_within_sorted_results(self, file_id: int) -> int:
         file = await self.get_file_by_id(file_id)
         if file is None:
             return 0
+        # row value comparison is answered with a range scan of the (added_at, id) index
         offset_query = await self.sess.execute(
             select(func.count())
             .select_from(FileMetadata)
-            .where(or_(
-                FileMetadata.added_at > file.added_at,
-                and_(
-                    FileMetadata.added_at == file.added_at,
-                    FileMetadata.id > file_id
-                )
-            ))
+            .where(tuple_(FileMetadata.added_at, FileMetadata.id) > tuple_(file.added_at, file_id))
         )
         offset = offset_query.scalar()
         return offset if offset is not None else 0
@@ -73,13 +104,33 @@ class FileMetadataRepository:
         async with self.sess.begin_nested():
             self.sess.add_all(files)
 
+    async def apply_changes(self, changes: dict[int, dict[str, Any]]) -> list[FileMetadata]:
+        '''Sets changed attributes on current rows of files with given ids, files deleted in the meantime are skipped'''
+        rows = await self.get_files_with_ids_by_id(set(changes.keys()))
+        res = []
+        for file_id, changed in changes.items():
+            if (row := rows.get(file_id)) is None:
+                continue
+            for key, value in changed.items():
+                setattr(row, key, value)
+            res.append(row)
+        return res
+
     async def get_files_with_ids(self, ids: set[int]) -> list[FileMetadata]:
-        all_files = await self.load_all_files()
-        return [f for f in all_files if int(f.id) in ids]
+        return list((await self.get_files_with_ids_by_id(ids)).values())
 
     async def get_files_with_ids_by_id(self, ids: set[int]) -> dict[int, FileMetadata]:
-        all_files = await self.load_all_files()
-        return {int(f.id): f for f in all_files if int(f.id) in ids}
+        if len(ids) > 4 * MAX_IDS_PER_QUERY:
+            # a single scan is cheaper than many lookups
+            return {int(f.id): f for f in await self.load_all_files() if int(f.id) in ids}
+        res = {}
+        sorted_ids = sorted(ids)
+        for i in range(0, len(sorted_ids), MAX_IDS_PER_QUERY):
+            files = await self.sess.execute(
+                select(FileMetadata).where(FileMetadata.id.in_(sorted_ids[i:i + MAX_IDS_PER_QUERY]))
+            )
+            res.update((int(f.id), f) for f in files.scalars().all())
+        return res
     
     async def get_all_files_with_type(self, ftype: FileType) -> list[FileMetadata]:
         files = await self.sess.execute(
@@ -102,6 +153,17 @@ class FileMetadataRepository:
         )
         return list(files.scalars().all())
 
+    async def get_files_with_not_generated_llm_description(self, limit: Optional[int]=None) -> list[FileMetadata]:
+        files = await self.sess.execute(
+            select(FileMetadata).
+            where(
+                ((FileMetadata.ftype == FileType.IMAGE.value) | (FileMetadata.ftype == FileType.VIDEO.value)) &
+                (FileMetadata.is_llm_description_analyzed == False)).
+            order_by(FileMetadata.id).
+            limit(limit)
+        )
+        return list(files.scalars().all())
+
     async def get_all_audio_files_with_not_analyzed_trancription(self) -> list[FileMetadata]:
         files = await self.sess.execute(
             select(FileMetadata).
@@ -0,0 +1,17 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from kfe.persistence.model import InitStageCheckpoint
+
+
+class InitCheckpointRepository:
+    def __init__(self, sess: AsyncSession) -> None:
+        self.sess = sess
+
+    async def get_all(self) -> dict[str, InitStageCheckpoint]:
+        res = await self.sess.execute(select(InitStageCheckpoint))
+        return {str(x.stage): x for x in res.scalars().all()}
+
+    async def save(self, checkpoint: InitStageCheckpoint):
+        async with self.sess.begin_nested():
+            await self.sess.merge(checkpoint)
@@ -2,7 +2,8 @@
 from enum import Enum
 from pathlib import Path
 
-from sqlalchemy import Boolean, Column, DateTime, Integer, String, Text
+from sqlalchemy import (Boolean, Column, DateTime, Float, Index, Integer, String,
+                        Text)
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -29,6 +30,8 @@ class FileMetadata(Base):
     is_transcript_analyzed = Column(Boolean, default=False)
     transcript = Column(Text, nullable=True)
     is_transcript_fixed = Column(Boolean, default=False)
+    # fraction of audio detected as speech, 0 means that transcription was skipped since there was no speech
+    speech_coverage = Column(Float, nullable=True)
 
     # for image
     is_ocr_analyzed = Column(Boolean, default=False)
@@ -40,11 +43,27 @@ class FileMetadata(Base):
 
     embedding_generation_failed = Column(Boolean, default=False)
 
+    # sha256 of file content, key of the derived data store, computed lazily
+    content_hash = Column(String, nullable=True)
+
+    # stat fingerprint of the file when it was indexed, used to detect changes missed by the file watcher
+    fs_size = Column(Integer, nullable=True)
+    fs_mtime_ns = Column(Integer, nullable=True)
+
     lemmatized_description     = Column(Text, nullable=True)
     lemmatized_ocr_text        = Column(Text, nullable=True)
     lemmatized_transcript      = Column(Text, nullable=True)
     lemmatized_llm_description = Column(Text, nullable=True)
 
+    __table_args__ = (
+        # listing files sorted by addition time and finding offset of a file in that order
+        Index('ix_files_added_at_id', 'added_at', 'id'),
+        # finding files of given types which still need processing
+        Index('ix_files_ftype_is_ocr_analyzed', 'ftype', 'is_ocr_analyzed'),
+        Index('ix_files_ftype_is_transcript_analyzed', 'ftype', 'is_transcript_analyzed'),
+        Index('ix_files_ftype_is_llm_description_analyzed', 'ftype', 'is_llm_description_analyzed'),
+    )
+
     @property
     def file_type(self) -> FileType:
         return FileType(self.ftype)
@@ -62,3 +81,15 @@ class RegisteredDirectory(Base):
     @property
     def path(self) -> Path:
         return Path(self.fs_path)
+
+
+class InitStageCheckpoint(Base):
+    __tablename__ = 'init_stage_checkpoints'
+
+    # name of the initialization stage
+    stage = Column(String, primary_key=True)
+    # number of files which stage had to process in the run that created the checkpoint (including files processed in earlier runs)
+    total_files = Column(Integer, default=0)
+    processed_files = Column(Integer, default=0)
+    completed = Column(Boolean, default=False)
+    updated_at = Column(DateTime)
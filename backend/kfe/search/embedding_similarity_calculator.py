@@ -8,34 +8,25 @@ from kfe.search.models import SearchResult
 
 class EmbeddingSimilarityCalculator:
 
-    class Builder:
-        def __init__(self) -> None:
-            self.row_to_file_id: list[int] = []
-            self.file_id_to_row: dict[int, int] = {}
-            self.rows: list[np.ndarray] = []
+    def __init__(self, row_to_file_id: Optional[list[int]]=None, file_id_to_row: Optional[dict[int, int]]=None,
+                 embedding_matrix: Optional[np.ndarray]=None) -> None:
+        self.row_to_file_id = row_to_file_id if row_to_file_id is not None else []
+        self.file_id_to_row = file_id_to_row if file_id_to_row is not None else {}
+        # row-wise, has spare capacity so that adding rows is amortized O(1), only first len(row_to_file_id) rows are valid
+        self.storage: Optional[np.ndarray] = embedding_matrix
 
-        def add_row(self, file_id: int | Column[int], embedding: np.ndarray):
-            self.row_to_file_id.append(int(file_id))
-            self.file_id_to_row[int(file_id)] = len(self.rows)
-            self.rows.append(embedding)
-
-        def build(self) -> "EmbeddingSimilarityCalculator":
-            return EmbeddingSimilarityCalculator(
-                row_to_file_id=self.row_to_file_id,
-                file_id_to_row=self.file_id_to_row,
-                embedding_matrix=np.vstack(self.rows) if len(self.rows) > 0 else None
-            )
-
-    def __init__(self, row_to_file_id: list[int], file_id_to_row: dict[int, int], embedding_matrix: Optional[np.ndarray]) -> None:
-        self.row_to_file_id = row_to_file_id
-        self.file_id_to_row = file_id_to_row
-        self.embedding_matrix = embedding_matrix # row-wise
+    @property
+    def embedding_matrix(self) -> Optional[np.ndarray]:
+        if self.storage is None or not self.row_to_file_id:
+            return None
+        return self.storage[:len(self.row_to_file_id)]
 
     def compute_similarity(self, embedding: np.ndarray, k: Optional[int]=None) -> list[SearchResult]:
         # TODO if it becomes slow consider running it in executor and making this async
-        if self.embedding_matrix is None:
+        embedding_matrix = self.embedding_matrix
+        if embedding_matrix is None:
             return []
-        similarities = embedding @ self.embedding_matrix.T
+        similarities = embedding @ embedding_matrix.T
         sorted_by_similarity_asc = np.argsort(similarities)
         if k is None:
             k = len(sorted_by_similarity_asc)
@@ -46,35 +37,44 @@ class EmbeddingSimilarityCalculator:
                 score=similarities[sorted_by_similarity_asc[i]]
             ))
         return res
-    
+
     def get_embedding(self, file_id: int | Column[int]) -> Optional[np.ndarray]:
         row_id = self.file_id_to_row.get(int(file_id))
         if row_id is None:
             return None
-        return self.embedding_matrix[row_id,:]
-    
+        return self.storage[row_id,:]
+
     def replace(self, file_id: int | Column[int], embedding: np.ndarray):
-        self.embedding_matrix[self.file_id_to_row[int(file_id)]] = embedding
+        self.storage[self.file_id_to_row[int(file_id)]] = embedding
 
     def add(self, file_id: int | Column[int], embedding: np.ndarray):
         file_id = int(file_id)
+        if file_id in self.file_id_to_row:
+            self.replace(file_id, embedding)
+            return
+        num_rows = len(self.row_to_file_id)
+        self._ensure_capacity(num_rows + 1, embedding)
+        self.storage[num_rows] = embedding
         self.row_to_file_id.append(file_id)
-        if self.embedding_matrix is None:
-            self.embedding_matrix = np.array([embedding])
-        else:
-            self.embedding_matrix = np.append(self.embedding_matrix, [embedding], axis=0)
-        self.file_id_to_row[file_id] = self.embedding_matrix.shape[0] - 1
+        self.file_id_to_row[file_id] = num_rows
 
     def delete(self, file_id: int | Column[int]):
-        # assumed to be called rarely, might be slow
-        if int(file_id) not in self.file_id_to_row:
+        row = self.file_id_to_row.pop(int(file_id), None)
+        if row is None:
             return
-        if len(self.file_id_to_row) == 1:
-            self.file_id_to_row, self.row_to_file_id, self.embedding_matrix = {}, [], None
-        else:
-            row = self.file_id_to_row.pop(int(file_id))
-            for fid, old_row in self.file_id_to_row.items():
-                if old_row > row:
-                    self.file_id_to_row[fid] = old_row - 1
-            self.row_to_file_id.pop(row)
-            self.embedding_matrix = np.delete(self.embedding_matrix, row, axis=0)
+        # order of rows doesn't matter, move the last row in place of the deleted one
+        last_row = len(self.row_to_file_id) - 1
+        if row != last_row:
+            moved_file_id = self.row_to_file_id[last_row]
+            self.storage[row] = self.storage[last_row]
+            self.row_to_file_id[row] = moved_file_id
+            self.file_id_to_row[moved_file_id] = row
+        self.row_to_file_id.pop()
+
+    def _ensure_capacity(self, num_rows: int, embedding: np.ndarray):
+        if self.storage is None:
+            self.storage = np.empty((max(num_rows, 16), embedding.shape[-1]), dtype=embedding.dtype)
+        elif self.storage.shape[0] < num_rows:
+            new_storage = np.empty((max(num_rows, 2 * self.storage.shape[0]), self.storage.shape[1]), dtype=self.storage.dtype)
+            new_storage[:len(self.row_to_file_id)] = self.storage[:len(self.row_to_file_id)]
+            self.storage = new_storage
@@ -11,31 +11,22 @@ class MultiEmbeddingSimilarityCalculator:
     EmbeddingSimilarityCalculator but single item can have multiple embeddings and search deduplicates results.
     '''
 
-    class Builder:
-        def __init__(self) -> None:
-            self.row_to_file_id: list[int] = []
-            self.rows: list[np.ndarray] = []
+    def __init__(self, row_to_file_id: Optional[list[int]]=None, embedding_matrix: Optional[np.ndarray]=None) -> None:
+        self.row_to_file_id = row_to_file_id if row_to_file_id is not None else []
+        # row-wise, has spare capacity, only first len(row_to_file_id) rows are valid
+        self.storage: Optional[np.ndarray] = embedding_matrix
 
-        def add_rows(self, file_id: int | Column[int], embeddings: np.ndarray):
-            '''Embeddings should be row-wise, all of embeddings should represent this file'''
-            for embedding in embeddings:
-                self.row_to_file_id.append(int(file_id))
-                self.rows.append(embedding)
-
-        def build(self) -> "MultiEmbeddingSimilarityCalculator":
-            return MultiEmbeddingSimilarityCalculator(
-                row_to_file_id=self.row_to_file_id,
-                embedding_matrix=np.vstack(self.rows) if len(self.rows) > 0 else None
-            )
-
-    def __init__(self, row_to_file_id: list[int], embedding_matrix: Optional[np.ndarray]) -> None:
-        self.row_to_file_id = row_to_file_id
-        self.embedding_matrix = embedding_matrix # row-wise
+    @property
+    def embedding_matrix(self) -> Optional[np.ndarray]:
+        if self.storage is None or not self.row_to_file_id:
+            return None
+        return self.storage[:len(self.row_to_file_id)]
 
     def compute_similarity(self, embedding: np.ndarray, k: Optional[int]=None) -> list[SearchResult]:
-        if self.embedding_matrix is None:
+        embedding_matrix = self.embedding_matrix
+        if embedding_matrix is None:
             return []
-        similarities = embedding @ self.embedding_matrix.T
+        similarities = embedding @ embedding_matrix.T
         sorted_by_similarity_asc = np.argsort(similarities)
         if k is None:
             k = len(sorted_by_similarity_asc)
@@ -53,18 +44,24 @@ class MultiEmbeddingSimilarityCalculator:
         return res
 
     def add(self, file_id: int | Column[int], embeddings: np.ndarray):
+        if len(embeddings) == 0:
+            return
+        num_rows = len(self.row_to_file_id)
+        if self.storage is None:
+            self.storage = np.empty((max(len(embeddings), 16), embeddings.shape[1]), dtype=embeddings.dtype)
+        elif self.storage.shape[0] < num_rows + len(embeddings):
+            new_storage = np.empty((max(num_rows + len(embeddings), 2 * self.storage.shape[0]), self.storage.shape[1]), dtype=self.storage.dtype)
+            new_storage[:num_rows] = self.storage[:num_rows]
+            self.storage = new_storage
+        self.storage[num_rows:num_rows + len(embeddings)] = embeddings
         for _ in embeddings:
             self.row_to_file_id.append(int(file_id))
-        if self.embedding_matrix is None:
-            self.embedding_matrix = np.copy(embeddings)
-        else:
-            self.embedding_matrix = np.append(self.embedding_matrix, embeddings, axis=0)
 
     def delete(self, file_id: int | Column[int]):
         file_id = int(file_id)
-        rows = []
-        for row, fid in enumerate(self.row_to_file_id):
-            if file_id == fid:
-                rows.append(row)
-        if rows:
-            self.embedding_matrix = np.delete(self.embedding_matrix, rows, axis=0)
+        keep = np.array([fid != file_id for fid in self.row_to_file_id], dtype=bool)
+        if keep.all():
+            return
+        num_kept = int(keep.sum())
+        self.storage[:num_kept] = self.storage[:len(self.row_to_file_id)][keep]
+        self.row_to_file_id = [fid for fid in self.row_to_file_id if fid != file_id]
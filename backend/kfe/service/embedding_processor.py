@@ -1,150 +1,124 @@
+import asyncio
 from pathlib import Path
 from typing import Awaitable, Callable, NamedTuple, Optional
 
 import numpy as np
 from PIL import Image
-from tqdm import tqdm
 
 from kfe.features.clip_engine import CLIPEngine
 from kfe.features.text_embedding_engine import TextEmbeddingEngine
+from kfe.persistence.derived_data_store import (DerivedArtifactType,
+                                                DerivedDataStore)
 from kfe.persistence.embeddings import (EmbeddingPersistor,
                                         MutableTextEmbedding, StoredEmbeddings,
                                         StoredEmbeddingType)
-from kfe.persistence.file_metadata_repository import FileMetadataRepository
 from kfe.persistence.model import FileMetadata, FileType
 from kfe.search.embedding_similarity_calculator import \
     EmbeddingSimilarityCalculator
 from kfe.search.models import SearchResult
 from kfe.search.multi_embedding_similarity_calculator import \
     MultiEmbeddingSimilarityCalculator
-from kfe.utils.init_progress_tracker import InitProgressTracker, InitState
+from kfe.utils.keyframe_selector import get_video_keyframes
 from kfe.utils.log import logger
 from kfe.utils.search import combine_results_with_rescoring
-from kfe.utils.video_frames_extractor import (get_video_duration_seconds,
-                                              get_video_frame_at_offset)
+from kfe.utils.video_frames_extractor import get_video_duration_seconds
 
 
 class ClipVideoFrameSelectionConfig(NamedTuple):
     max_frames: int = 10
     min_seconds_between_frame: float = 3.
 
+    def get_version_tag(self) -> str:
+        return f'{self.max_frames}x{self.min_seconds_between_frame}s-keyframes'
+
 class EmbeddingProcessor:
     def __init__(self, root_dir: Path,
                  persistor: EmbeddingPersistor,
                  text_embedding_engine: TextEmbeddingEngine,
-                 clip_engine: CLIPEngine, clip_video_cfg: ClipVideoFrameSelectionConfig=None) -> None:
+                 clip_engine: CLIPEngine, clip_video_cfg: ClipVideoFrameSelectionConfig=None,
+                 derived_data_store: Optional[DerivedDataStore]=None) -> None:
         self.root_dir = root_dir
         self.persistor = persistor
         self.text_embedding_engine = text_embedding_engine
         self.clip_engine = clip_engine
         self.clip_video_cfg = clip_video_cfg if clip_video_cfg is not None else ClipVideoFrameSelectionConfig()
+        self.derived_data_store = derived_data_store
             
-        self.description_similarity_calculator: EmbeddingSimilarityCalculator = None 
-        self.ocr_text_similarity_calculator: EmbeddingSimilarityCalculator = None 
-        self.transcription_text_similarity_calculator: EmbeddingSimilarityCalculator = None 
-        self.clip_image_similarity_calculator: EmbeddingSimilarityCalculator = None
-        self.clip_video_similarity_calculator: MultiEmbeddingSimilarityCalculator = None
-        self.llm_text_similarity_calculator: EmbeddingSimilarityCalculator = None
-
-    async def init_embeddings(self, file_repo: FileMetadataRepository, progress_tracker: InitProgressTracker):
-        all_files = await file_repo.load_all_files()
-        files_by_name = {str(x.name): x for x in all_files}
-        description_builder = EmbeddingSimilarityCalculator.Builder()
-        ocr_text_builder = EmbeddingSimilarityCalculator.Builder()
-        transcription_text_builder = EmbeddingSimilarityCalculator.Builder()
-        clip_image_builder = EmbeddingSimilarityCalculator.Builder()
-        clip_video_builder = MultiEmbeddingSimilarityCalculator.Builder()
-        llm_text_builder = EmbeddingSimilarityCalculator.Builder()
-
-        progress_tracker.enter_state(InitState.EMBEDDING, len(all_files))
+        # calculators are queryable during initialization, files are added to them as they are processed
+        self._reset_similarity_calculators()
+        self.init_embedded_file_names: Optional[set[str]] = None
 
-        # reconcile files which have some (possibly outdated) embeddings
-        for file_name in tqdm(self.persistor.get_all_embedded_files(), desc='initializing embeddings'):
-            file = files_by_name.pop(file_name, None)
-            try:
-                if file is None:
+    def begin_init(self, all_files: list[FileMetadata]):
+        '''
+        Prepares structures for initialization of embeddings, after that init_file_embeddings
+        must be called for every file and finally finish_init.
+        '''
+        self._reset_similarity_calculators()
+        existing_file_names = set(str(x.name) for x in all_files)
+        self.init_embedded_file_names = set()
+        for file_name in self.persistor.get_all_embedded_files():
+            if file_name in existing_file_names:
+                self.init_embedded_file_names.add(file_name)
+            else:
+                try:
                     self.persistor.delete(file_name)
-                else:
-                    dirty = False
-                    try:
-                        embeddings = self.persistor.load(file_name, expected_texts=self._get_expected_texts(file))
-                    except Exception:
-                        embeddings = StoredEmbeddings()
-                    if file.description == '':
-                        if embeddings.description is not None:
-                            embeddings = embeddings.without(StoredEmbeddingType.DESCRIPTION)
-                            dirty = True
-                    elif embeddings.description is None:
-                        await self._create_text_embedding(file.description, embeddings, StoredEmbeddingType.DESCRIPTION)
-                        dirty = True
-                    if file.file_type == FileType.IMAGE and embeddings.clip_image is None and not file.embedding_generation_failed:
-                        await self._create_clip_image_embedding(file, embeddings)
-                        dirty = True
-                    if file.file_type == FileType.VIDEO and embeddings.clip_video is None and not file.embedding_generation_failed:
-                        if await self._create_clip_video_embeddings(file, embeddings) is not None:
-                            dirty = True
-                    if file.is_screenshot and file.is_ocr_analyzed and file.ocr_text is not None and file.ocr_text != '' and embeddings.ocr_text is None:
-                        await self._create_text_embedding(file.ocr_text, embeddings, StoredEmbeddingType.OCR_TEXT)
-                        dirty = True
-                    if file.is_transcript_analyzed and file.transcript is not None and file.transcript != '' and embeddings.transcription_text is None:
-                        await self._create_text_embedding(file.transcript, embeddings, StoredEmbeddingType.TRANSCRIPTION_TEXT)
-                        dirty = True
-                    if file.is_llm_description_analyzed and file.llm_description is not None and file.llm_description != '' and embeddings.llm_text is None:
-                        await self._create_text_embedding(file.llm_description, embeddings, StoredEmbeddingType.LLM_TEXT)
-                        dirty = True
+                except Exception as e:
+                    logger.error(f'failed to delete embeddings of {file_name}', exc_info=e)
 
-                    if embeddings.description is not None:
-                        description_builder.add_row(file.id, embeddings.description.embedding)
-                    if embeddings.clip_image is not None:
-                        clip_image_builder.add_row(file.id, embeddings.clip_image)
-                    if embeddings.ocr_text is not None:
-                        ocr_text_builder.add_row(file.id, embeddings.ocr_text.embedding)
-                    if embeddings.transcription_text is not None:
-                        transcription_text_builder.add_row(file.id, embeddings.transcription_text.embedding)
-                    if embeddings.clip_video is not None:
-                        clip_video_builder.add_rows(file.id, embeddings.clip_video)
-                    if embeddings.llm_text is not None:
-                        llm_text_builder.add_row(file.id, embeddings.llm_text.embedding)
+    async def init_file_embeddings(self, file: FileMetadata):
+        '''Reconciles possibly outdated or missing embeddings of the file and registers them in similarity calculators'''
+        try:
+            is_new = str(file.name) not in self.init_embedded_file_names
+            dirty = False
+            embeddings = StoredEmbeddings()
+            if not is_new:
+                try:
+                    embeddings = self.persistor.load(file.name, expected_texts=self._get_expected_texts(file))
+                except Exception:
+                    embeddings = StoredEmbeddings()
+            if file.description == '':
+                if embeddings.description is not None:
+                    embeddings = embeddings.without(StoredEmbeddingType.DESCRIPTION)
+                    dirty = True
+            elif embeddings.description is None:
+                await self._create_text_embedding(file.description, embeddings, StoredEmbeddingType.DESCRIPTION)
+                dirty = True
+            if file.file_type == FileType.IMAGE and embeddings.clip_image is None and not file.embedding_generation_failed:
+                if await self._create_clip_image_embedding(file, embeddings) is not None:
+                    dirty = True
+            if file.file_type == FileType.VIDEO and embeddings.clip_video is None and not file.embedding_generation_failed:
+                if await self._create_clip_video_embeddings(file, embeddings) is not None:
+                    dirty = True
+            if file.is_screenshot and file.is_ocr_analyzed and file.ocr_text is not None and file.ocr_text != '' and embeddings.ocr_text is None:
+                await self._create_text_embedding(file.ocr_text, embeddings, StoredEmbeddingType.OCR_TEXT)
+                dirty = True
+            if file.is_transcript_analyzed and file.transcript is not None and file.transcript != '' and embeddings.transcription_text is None:
+                await self._create_text_embedding(file.transcript, embeddings, StoredEmbeddingType.TRANSCRIPTION_TEXT)
+                dirty = True
+            if file.is_llm_description_analyzed and file.llm_description is not None and file.llm_description != '' and embeddings.llm_text is None:
+                await self._create_text_embedding(file.llm_description, embeddings, StoredEmbeddingType.LLM_TEXT)
+                dirty = True
 
-                    if dirty:
-                        self.persistor.save(file.name, embeddings)
-            except Exception as e:
-                logger.error(f'failed to init embeddings for {file.name}', exc_info=e)
-            progress_tracker.mark_file_processed()
+            if embeddings.description is not None:
+                self.description_similarity_calculator.add(file.id, embeddings.description.embedding)
+            if embeddings.clip_image is not None:
+                self.clip_image_similarity_calculator.add(file.id, embeddings.clip_image)
+            if embeddings.ocr_text is not None:
+                self.ocr_text_similarity_calculator.add(file.id, embeddings.ocr_text.embedding)
+            if embeddings.transcription_text is not None:
+                self.transcription_text_similarity_calculator.add(file.id, embeddings.transcription_text.embedding)
+            if embeddings.clip_video is not None:
+                self.clip_video_similarity_calculator.add(file.id, embeddings.clip_video)
+            if embeddings.llm_text is not None:
+                self.llm_text_similarity_calculator.add(file.id, embeddings.llm_text.embedding)
 
-        # reconcile new files that didn't have any embeddings before
-        for file in tqdm(files_by_name.values(), desc='initializing embeddings'):
-            embeddings = StoredEmbeddings()
-            try:
-                if file.description != '':
-                    await self._create_text_embedding(file.description, embeddings, StoredEmbeddingType.DESCRIPTION)
-                    description_builder.add_row(file.id, embeddings.description.embedding)
-                if file.file_type == FileType.IMAGE and not file.embedding_generation_failed:
-                    if await self._create_clip_image_embedding(file, embeddings) is not None: 
-                        clip_image_builder.add_row(file.id, embeddings.clip_image)
-                if file.file_type == FileType.VIDEO and not file.embedding_generation_failed:
-                    if await self._create_clip_video_embeddings(file, embeddings) is not None:
-                        clip_video_builder.add_rows(file.id, embeddings.clip_video)
-                if file.is_screenshot and file.is_ocr_analyzed and file.ocr_text != '':
-                    await self._create_text_embedding(file.ocr_text, embeddings, StoredEmbeddingType.OCR_TEXT)
-                    ocr_text_builder.add_row(file.id, embeddings.ocr_text.embedding)
-                if file.is_transcript_analyzed and file.transcript is not None and file.transcript != '':
-                    await self._create_text_embedding(file.transcript, embeddings, StoredEmbeddingType.TRANSCRIPTION_TEXT)
-                    transcription_text_builder.add_row(file.id, embeddings.transcription_text.embedding)
-                if file.is_llm_description_analyzed and file.llm_description is not None and file.llm_description != '':
-                    await self._create_text_embedding(file.llm_description, embeddings, StoredEmbeddingType.LLM_TEXT)
-                    llm_text_builder.add_row(file.id, embeddings.llm_text.embedding)
+            if dirty or is_new:
                 self.persistor.save(file.name, embeddings)
-            except Exception as e:
-                logger.error(f'failed to init embeddings for {file.name}', exc_info=e)
-            progress_tracker.mark_file_processed()
+        except Exception as e:
+            logger.error(f'failed to init embeddings for {file.name}', exc_info=e)
 
-        self.description_similarity_calculator = description_builder.build()
-        self.ocr_text_similarity_calculator = ocr_text_builder.build()
-        self.transcription_text_similarity_calculator= transcription_text_builder.build()
-        self.clip_image_similarity_calculator = clip_image_builder.build()
-        self.clip_video_similarity_calculator = clip_video_builder.build()
-        self.llm_text_similarity_calculator = llm_text_builder.build()
+    def finish_init(self):
+        self.init_embedded_file_names = None
 
     async def search_description_based(self, query: str, k: Optional[int]=None) -> list[SearchResult]:
         return self.description_similarity_calculator.compute_similarity(await self._create_query_text_embedding(query), k)
@@ -231,6 +205,10 @@ class EmbeddingProcessor:
     async def update_ocr_text_embedding(self, file: FileMetadata, old_ocr_text: str):
         await self._update_text_embedding(file, old_ocr_text, file.ocr_text, self.ocr_text_similarity_calculator, StoredEmbeddingType.OCR_TEXT)
 
+    async def update_llm_description_embedding(self, file: FileMetadata, old_llm_description: str):
+        new_llm_description = str(file.llm_description) if file.is_llm_description_analyzed and file.llm_description is not None else ''
+        await self._update_text_embedding(file, old_llm_description, new_llm_description, self.llm_text_similarity_calculator, StoredEmbeddingType.LLM_TEXT)
+
     async def on_file_created(self, file: FileMetadata):
         embeddings = StoredEmbeddings()
         if file.description != '':
@@ -320,8 +298,13 @@ class EmbeddingProcessor:
 
     async def _create_clip_image_embedding(self, file: FileMetadata, embeddings: StoredEmbeddings) -> Optional[np.ndarray]:
         try:
+            content_hash = await self._get_content_hash(file)
+            if (stored := self._load_derived_array(content_hash, DerivedArtifactType.CLIP_IMAGE)) is not None:
+                embeddings.clip_image = stored
+                return embeddings.clip_image
             img = Image.open(self.root_dir.joinpath(file.name)).convert('RGB')
             embeddings.clip_image = await self._embed_image_clip(img)
+            self._save_derived_array(content_hash, DerivedArtifactType.CLIP_IMAGE, embeddings.clip_image)
             return embeddings.clip_image
         except Exception as e:
             logger.error(f'failed to generate clip image embedding for file: {file.name}', exc_info=e)
@@ -330,26 +313,56 @@ class EmbeddingProcessor:
     
     async def _create_clip_video_embeddings(self, file: FileMetadata, embeddings: StoredEmbeddings) -> Optional[np.ndarray]: 
         try:
-            video_duration = await get_video_duration_seconds(self.root_dir.joinpath(file.name))
+            content_hash = await self._get_content_hash(file)
+            if (stored := self._load_derived_array(content_hash, DerivedArtifactType.CLIP_VIDEO, self._get_clip_video_variant())) is not None:
+                embeddings.clip_video = stored
+                return embeddings.clip_video
+            path = self.root_dir.joinpath(file.name)
+            video_duration = await get_video_duration_seconds(path)
+            num_video_frames = min(self.clip_video_cfg.max_frames, max(int(video_duration / self.clip_video_cfg.min_seconds_between_frame), 1))
+            # informative and mutually different frames, decoded by a single ffmpeg process
+            keyframes = sorted(await get_video_keyframes(path, num_video_frames, duration=video_duration), key=lambda x: x.offset_seconds)
+            if not keyframes:
+                raise ValueError(f'no frames extracted from video: {file.name}')
             async with self.clip_engine.run() as engine:
-                frame_embeddings = []
-                num_video_frames = min(self.clip_video_cfg.max_frames, max(int(video_duration / self.clip_video_cfg.min_seconds_between_frame), 1))
-                for i in range(num_video_frames):
-                    # TODO smarter frame selection
-                    offset = video_duration * ((2 * i + 1) / (2 * num_video_frames))
-                    img = await get_video_frame_at_offset(self.root_dir.joinpath(file.name), offset)
-                    frame_embeddings.append(await engine.generate_image_embedding(img))
+                frame_embeddings = await asyncio.gather(*[engine.generate_image_embedding(x.image) for x in keyframes])
                 embeddings.clip_video = np.vstack(frame_embeddings)
+            self._save_derived_array(content_hash, DerivedArtifactType.CLIP_VIDEO, embeddings.clip_video, self._get_clip_video_variant())
             return embeddings.clip_video
         except Exception as e:
             logger.error(f'failed to generate clip video embeddings for file: {file.name}', exc_info=e)
             file.embedding_generation_failed = True
             return None
 
+    async def _get_content_hash(self, file: FileMetadata) -> Optional[str]:
+        if self.derived_data_store is None:
+            return None
+        return await self.derived_data_store.get_content_hash(self.root_dir, file)
+
+    def _load_derived_array(self, content_hash: Optional[str], artifact: DerivedArtifactType, variant: str='') -> Optional[np.ndarray]:
+        if self.derived_data_store is None:
+            return None
+        return self.derived_data_store.load_array(content_hash, artifact, variant)
+
+    def _save_derived_array(self, content_hash: Optional[str], artifact: DerivedArtifactType, array: np.ndarray, variant: str=''):
+        if self.derived_data_store is not None:
+            self.derived_data_store.save_array(content_hash, artifact, array, variant)
+
+    def _get_clip_video_variant(self) -> str:
+        return self.clip_video_cfg.get_version_tag()
+
     async def _embed_image_clip(self, image: Image.Image) -> np.ndarray:
         async with self.clip_engine.run() as engine:
             return await engine.generate_image_embedding(image)
 
+    def _reset_similarity_calculators(self):
+        self.description_similarity_calculator = EmbeddingSimilarityCalculator()
+        self.ocr_text_similarity_calculator = EmbeddingSimilarityCalculator()
+        self.transcription_text_similarity_calculator = EmbeddingSimilarityCalculator()
+        self.clip_image_similarity_calculator = EmbeddingSimilarityCalculator()
+        self.clip_video_similarity_calculator = MultiEmbeddingSimilarityCalculator()
+        self.llm_text_similarity_calculator = EmbeddingSimilarityCalculator()
+
     def _get_expected_texts(self, file: FileMetadata) -> dict[StoredEmbeddingType, str]:
         return {
             StoredEmbeddingType.DESCRIPTION: str(file.description),
@@ -1,8 +1,10 @@
+import asyncio
 import io
 import mimetypes
+import os
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import NamedTuple, Optional
 
 import aiofiles
 from PIL import Image
@@ -14,6 +16,12 @@ from kfe.utils.ffprobe import (get_ffprobe_stream_info, has_audio_stream,
 from kfe.utils.log import logger
 
 
+class DirectoryDiff(NamedTuple):
+    created: list[str]
+    deleted: list[str]
+    modified: list[str]
+
+
 class FileIndexer:
     def __init__(self, root_dir: Path, file_repo: FileMetadataRepository) -> None:
         self.root_dir = root_dir
@@ -48,6 +56,45 @@ class FileIndexer:
         
         return len(stored_files)
     
+    async def compute_directory_diff(self, ignored_files: set[str]=frozenset(),
+                                     unsupported_files: Optional[dict[str, tuple[int, int]]]=None) -> DirectoryDiff:
+        '''
+        Compares stored files with the directory content using stat fingerprints (size, modification time).
+        Stored files without fingerprint (indexed before fingerprints were introduced) get it assigned
+        instead of being reported as modified, caller is responsible for committing that.
+        Files which are not stored since they are not media files are not reported as created, if `unsupported_files`
+        is passed their fingerprints are remembered there and their type is checked again only when they change.
+        '''
+        stored_files = await self.file_repo.load_all_files()
+        fingerprints = await asyncio.get_running_loop().run_in_executor(None, self.load_directory_fingerprints)
+
+        deleted, modified = [], []
+        for file in stored_files:
+            fingerprint = fingerprints.get(str(file.name))
+            if fingerprint is None:
+                deleted.append(str(file.name))
+            elif file.fs_size is None or file.fs_mtime_ns is None:
+                file.fs_size, file.fs_mtime_ns = fingerprint
+            elif (int(file.fs_size), int(file.fs_mtime_ns)) != fingerprint:
+                modified.append(str(file.name))
+
+        names_of_stored_files = set(str(x.name) for x in stored_files)
+        created = []
+        for name, fingerprint in fingerprints.items():
+            if name in names_of_stored_files or name in ignored_files:
+                continue
+            if unsupported_files is not None and unsupported_files.get(name) == fingerprint:
+                continue
+            if await FileIndexer.get_file_type(self.root_dir.joinpath(name)) == FileType.OTHER:
+                if unsupported_files is not None:
+                    unsupported_files[name] = fingerprint
+                continue
+            created.append(name)
+        if unsupported_files is not None:
+            for name in [x for x in unsupported_files if x not in fingerprints]:
+                del unsupported_files[name]
+        return DirectoryDiff(created=created, deleted=deleted, modified=modified)
+
     async def update_file_types(self):
         stored_files = await self.file_repo.load_all_files()
         for file in stored_files:
@@ -66,6 +113,45 @@ class FileIndexer:
             logger.error(f'failed to add file from: {path}', exc_info=e)
             return None
 
+    async def add_files(self, paths: list[Path]) -> list[FileMetadata]:
+        res = []
+        for path in paths:
+            if await self.file_repo.get_file_by_name(path.name) is not None:
+                continue # duplicated event
+            if (file := await self.add_file(path)) is not None:
+                res.append(file)
+        return res
+
+    async def reset_modified_file(self, file: FileMetadata, path: Path) -> bool:
+        '''
+        Updates stored file whose content changed, results derived from the old content are reset, so that the file is
+        processed again. Description and manually fixed transcript are kept. Returns False if the file is no longer
+        a supported media file, caller should delete it then.
+        '''
+        file_type = await FileIndexer.get_file_type(path)
+        if file_type == FileType.OTHER:
+            return False
+        stat = path.stat()
+        file.ftype = file_type
+        file.fs_size = stat.st_size
+        file.fs_mtime_ns = stat.st_mtime_ns
+        file.content_hash = None
+        file.is_ocr_analyzed = False
+        file.ocr_text = None
+        file.lemmatized_ocr_text = None
+        if not file.is_transcript_fixed or file_type == FileType.IMAGE:
+            file.is_transcript_analyzed = False
+            file.is_transcript_fixed = False
+            file.transcript = None
+            file.lemmatized_transcript = None
+            file.speech_coverage = None
+        file.is_llm_description_analyzed = False
+        file.llm_description = None
+        file.lemmatized_llm_description = None
+        file.embedding_generation_failed = False
+        await self.file_repo.update_file(file)
+        return True
+
     async def delete_file(self, path: Path) -> Optional[FileMetadata]:
         file = await self.file_repo.get_file_by_name(path.name)
         if file is None:
@@ -77,12 +163,14 @@ class FileIndexer:
         file_type = await FileIndexer.get_file_type(path)
         if file_type == FileType.OTHER:
             return None
-        creation_time = datetime.fromtimestamp(path.stat().st_ctime)
+        stat = path.stat()
         return FileMetadata(
             name=path.name,
-            added_at=creation_time,
+            added_at=datetime.fromtimestamp(stat.st_ctime),
             description="",
-            ftype=file_type
+            ftype=file_type,
+            fs_size=stat.st_size,
+            fs_mtime_ns=stat.st_mtime_ns
         )
 
     def load_directory_files(self) -> list[str]:
@@ -92,6 +180,18 @@ class FileIndexer:
                 res.append(entry.name)
         return res
 
+    def load_directory_fingerprints(self) -> dict[str, tuple[int, int]]:
+        res = {}
+        with os.scandir(self.root_dir) as it:
+            for entry in it:
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        res[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    pass # deleted while scanning
+        return res
+
     @staticmethod
     async def get_file_type(path: Path) -> FileType:
         mime_type = mimetypes.guess_type(path.name)[0]
@@ -0,0 +1,84 @@
+import asyncio
+import time
+from datetime import datetime
+from sqlalchemy.orm.attributes import set_committed_value
+
+from kfe.persistence.db import Database
+from kfe.persistence.file_metadata_repository import (FileMetadataRepository,
+                                                      get_changed_attributes)
+from kfe.persistence.init_checkpoint_repository import InitCheckpointRepository
+from kfe.persistence.model import FileMetadata, InitStageCheckpoint
+from kfe.utils.init_progress_tracker import InitProgressTracker, InitState
+from kfe.utils.log import logger
+
+
+class InitCheckpointer:
+    '''
+    Commits results of directory initialization in bounded batches, together with progress of every init stage.
+    Work that was committed is never repeated (stages select files based on their analysis flags), so initialization
+    interrupted by cancellation or crash resumes where it stopped and stage progress accounts for already processed files.
+    Files modified by stages are not attached to any session, attributes changed since the last commit are written
+    to freshly loaded rows, so files deleted in the meantime are skipped and a failed commit doesn't affect other files.
+    '''
+    def __init__(self, db: Database, write_lock: asyncio.Lock, progress_tracker: InitProgressTracker,
+                 max_pending_files: int=200, max_seconds_between_commits: float=10.) -> None:
+        self.db = db
+        self.write_lock = write_lock
+        self.progress_tracker = progress_tracker
+        self.max_pending_files = max_pending_files
+        self.max_seconds_between_commits = max_seconds_between_commits
+        self.checkpoints: dict[str, InitStageCheckpoint] = {}
+        self.pending_files: dict[int, FileMetadata] = {}
+        self.last_commit_time = time.monotonic()
+
+    async def load(self):
+        async with self.db.session(expire_on_commit=False) as sess:
+            self.checkpoints = await InitCheckpointRepository(sess).get_all()
+
+    def get_already_processed(self, state: InitState, remaining_files: int) -> int:
+        '''Returns number of files processed by the stage in previous, not completed runs'''
+        checkpoint = self.checkpoints.get(state.name)
+        if checkpoint is None or checkpoint.completed:
+            return 0
+        return max(int(checkpoint.total_files) - remaining_files, 0)
+
+    async def add(self, files: list[FileMetadata]):
+        '''Schedules files for commit, commits if there are too many pending files or the last commit was long ago'''
+        for f in files:
+            self.pending_files[int(f.id)] = f
+        if len(self.pending_files) >= self.max_pending_files or time.monotonic() - self.last_commit_time >= self.max_seconds_between_commits:
+            await self.commit()
+
+    def discard(self, file_id: int):
+        self.pending_files.pop(file_id, None)
+
+    async def commit(self, completed: bool=False):
+        async with self.write_lock:
+            files, self.pending_files = self.pending_files, {}
+            changes = {file_id: get_changed_attributes(f) for file_id, f in files.items()}
+            try:
+                async with self.db.session() as sess:
+                    async with sess.begin():
+                        # files deleted during initialization are skipped
+                        await FileMetadataRepository(sess).apply_changes(changes)
+                        checkpoint_repo = InitCheckpointRepository(sess)
+                        for state, (processed, total) in self.progress_tracker.get_state_counts().items():
+                            await checkpoint_repo.save(InitStageCheckpoint(
+                                stage=state.name,
+                                total_files=total,
+                                processed_files=processed,
+                                completed=completed,
+                                updated_at=datetime.now()
+                            ))
+            except Exception as e:
+                logger.error(f'failed to commit batch of {len(files)} initialized files, it will be retried', exc_info=e)
+                for file_id, f in files.items():
+                    self.pending_files.setdefault(file_id, f)
+            else:
+                for file_id, changed in changes.items():
+                    f = files[file_id]
+                    for key, value in changed.items():
+                        # attribute could have been changed again by a stage while committing
+                        if getattr(f, key) is value:
+                            set_committed_value(f, key, value)
+            self.last_commit_time = time.monotonic()
@@ -0,0 +1,155 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
+
+import torch
+
+from kfe.features.vision_lm_engine import VisionLMEngine
+from kfe.persistence.db import Database
+from kfe.persistence.derived_data_store import DerivedDataStore
+from kfe.persistence.file_metadata_repository import FileMetadataRepository
+from kfe.persistence.model import FileMetadata
+from kfe.service.metadata_editor import MetadataEditor
+from kfe.service.vision_lm_service import VisionLMService
+from kfe.utils.constants import (
+    BACKGROUND_LLM_DESCRIPTIONS_MIN_FREE_MEMORY_MB_ENV,
+    BACKGROUND_LLM_DESCRIPTIONS_MIN_IDLE_SECONDS_ENV)
+from kfe.utils.idle_monitor import IdleMonitor
+from kfe.utils.log import logger
+from kfe.utils.model_footprint import (ModelFootprint, format_footprint,
+                                       has_free_memory_for)
+from kfe.utils.model_manager import ModelManager, ModelType
+
+
+class LLMDescriptionSchedulerConfig(NamedTuple):
+    # batch is started only when there was no activity for this long
+    min_idle_seconds: float = 300.
+    # how often idleness and memory are checked while there are pending files
+    poll_interval_seconds: float = 30.
+    # memory that must be free if the model was not loaded yet and its footprint is unknown
+    min_free_memory_mb: int = 6000
+
+    @staticmethod
+    def from_env() -> "LLMDescriptionSchedulerConfig":
+        return LLMDescriptionSchedulerConfig(
+            min_idle_seconds=float(os.getenv(BACKGROUND_LLM_DESCRIPTIONS_MIN_IDLE_SECONDS_ENV, '300')),
+            min_free_memory_mb=int(os.getenv(BACKGROUND_LLM_DESCRIPTIONS_MIN_FREE_MEMORY_MB_ENV, '6000'))
+        )
+
+
+class LLMDescriptionScheduler:
+    '''
+    Generates LLM descriptions of files added after directory initialization. Vision LM is too heavy to be loaded
+    for every file event, so files are processed in batches in the background, only when there was no activity
+    for a while and the model fits in free memory. The queue is the database itself - files that are not described yet
+    have `is_llm_description_analyzed` unset, so pending work survives restarts and deleted files leave the queue with their rows.
+    Descriptions are registered in lexical and embedding search structures incrementally.
+    '''
+    def __init__(self, root_dir: Path, db: Database, db_write_lock: asyncio.Lock, model_manager: ModelManager,
+                 vision_lm_engine: VisionLMEngine, idle_monitor: IdleMonitor,
+                 metadata_editor_factory: Callable[[FileMetadataRepository], MetadataEditor],
+                 derived_data_store: Optional[DerivedDataStore]=None, config: Optional[LLMDescriptionSchedulerConfig]=None) -> None:
+        self.root_dir = root_dir
+        self.db = db
+        self.db_write_lock = db_write_lock
+        self.model_manager = model_manager
+        self.vision_lm_engine = vision_lm_engine
+        self.idle_monitor = idle_monitor
+        self.metadata_editor_factory = metadata_editor_factory
+        self.derived_data_store = derived_data_store
+        self.config = config if config is not None else LLMDescriptionSchedulerConfig()
+        self.pending_files_event = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.described_files = 0
+
+    def start(self):
+        if self.task is None:
+            # files queued before restart are in the database already
+            self.pending_files_event.set()
+            self.task = asyncio.create_task(self._run())
+
+    def notify_files_added(self):
+        self.pending_files_event.set()
+
+    async def cancel(self):
+        '''Stops processing, files which were not described remain queued in the database'''
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.wait([self.task])
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await self.pending_files_event.wait()
+            self.pending_files_event.clear()
+            try:
+                while await self._process_next_batch():
+                    pass
+            except Exception as e:
+                logger.error(f'background LLM description generation failed for {self.root_dir}, it will be retried later', exc_info=e)
+                await asyncio.sleep(self.config.min_idle_seconds)
+                self.pending_files_event.set()
+            finally:
+                # model is not needed until more files are added, memory is given back immediately
+                await self.model_manager.free_if_unused(ModelType.VISION_LM)
+
+    async def _process_next_batch(self) -> bool:
+        '''Returns False if there are no more pending files'''
+        if not await self._load_pending_files():
+            if self.described_files:
+                logger.info(f'generated LLM descriptions of {self.described_files} files added to {self.root_dir}')
+                self.described_files = 0
+            return False
+        await self._wait_until_resources_available()
+        # files could have been deleted while waiting
+        if not (files := await self._load_pending_files()):
+            return True
+
+        # generation is slow, it must not block file events which need the write lock
+        vision_lm_service = VisionLMService(self.root_dir, self.vision_lm_engine, None, self.derived_data_store)
+        async with self.model_manager.exclusive(ModelType.VISION_LM), self.vision_lm_engine.run() as engine:
+            await vision_lm_service.generate_descriptions(files, engine)
+
+        async with self.db_write_lock, self.db.session() as sess:
+            async with sess.begin():
+                file_repo = FileMetadataRepository(sess)
+                metadata_editor = self.metadata_editor_factory(file_repo)
+                for generated in files:
+                    file = await file_repo.get_file_by_id(int(generated.id))
+                    if file is None or file.is_llm_description_analyzed:
+                        continue # deleted or described in the meantime
+                    try:
+                        await metadata_editor.update_llm_description(file, generated.llm_description)
+                        self.described_files += 1
+                    except Exception as e:
+                        logger.error(f'failed to register LLM description of {file.name}', exc_info=e)
+                        file.is_llm_description_analyzed = True
+                        await file_repo.update_file(file)
+        return True
+
+    async def _load_pending_files(self) -> list[FileMetadata]:
+        async with self.db.session(expire_on_commit=False) as sess:
+            return await FileMetadataRepository(sess).get_files_with_not_generated_llm_description(limit=self.vision_lm_engine.batch_size)
+
+    async def _wait_until_resources_available(self):
+        while True:
+            idle_seconds = self.idle_monitor.get_idle_seconds()
+            if idle_seconds >= self.config.min_idle_seconds and self._has_memory_headroom():
+                return
+            await asyncio.sleep(max(self.config.poll_interval_seconds, self.config.min_idle_seconds - idle_seconds))
+
+    def _has_memory_headroom(self) -> bool:
+        if self.model_manager.is_loaded(ModelType.VISION_LM):
+            return True
+        if self.model_manager.is_in_use(ModelType.TRANSCRIBER):
+            # other heavy model is used by file events or initialization
+            return False
+        required = self.model_manager.get_expected_footprint(ModelType.VISION_LM)
+        if required == ModelFootprint():
+            min_free = self.config.min_free_memory_mb * 2**20
+            required = ModelFootprint(vram_bytes=min_free) if torch.cuda.is_available() else ModelFootprint(ram_bytes=min_free)
+        if not self.model_manager.fits_in_budget(ModelType.VISION_LM, required) or not has_free_memory_for(required):
+            logger.debug(f'not enough memory for background LLM descriptions of {self.root_dir}, required: {format_footprint(required)}')
+            return False
+        return True
@@ -15,12 +15,14 @@ class MetadataEditor:
                  description_lexical_search_engine: LexicalSearchEngine,
                  transcript_lexical_search_engine: LexicalSearchEngine,
                  ocr_lexical_search_engine: LexicalSearchEngine,
+                 llm_description_lexical_search_engine: LexicalSearchEngine,
                  embedding_processor: EmbeddingProcessor,
                  lemmatizer: Lemmatizer) -> None:
         self.file_repo = file_repo
         self.description_lexical_search_engine = description_lexical_search_engine
         self.transcript_lexical_search_engine = transcript_lexical_search_engine
         self.ocr_lexical_search_engine = ocr_lexical_search_engine
+        self.llm_description_lexical_search_engine = llm_description_lexical_search_engine
         self.embedding_processor = embedding_processor
         self.lemmatizer = lemmatizer
 
@@ -64,6 +66,20 @@ class MetadataEditor:
         await self.embedding_processor.update_ocr_text_embedding(file, old_ocr_text)
         await self.file_repo.update_file(file)
 
+    async def update_llm_description(self, file: FileMetadata, new_llm_description: Optional[str]):
+        old_llm_description = str(file.llm_description) if file.is_llm_description_analyzed and file.llm_description is not None else ''
+        file.lemmatized_llm_description = await self._update_lexical_structures_and_get_lemmatized_text(
+            file.id,
+            new_llm_description,
+            old_llm_description,
+            file.lemmatized_llm_description,
+            self.llm_description_lexical_search_engine
+        )
+        file.llm_description = new_llm_description
+        file.is_llm_description_analyzed = True
+        await self.embedding_processor.update_llm_description_embedding(file, old_llm_description)
+        await self.file_repo.update_file(file)
+
     async def update_screenshot_type(self, file: FileMetadata, is_screenshot: bool):
         if file.is_screenshot:
             await self.update_ocr_text(file, '')
@@ -90,6 +106,8 @@ class MetadataEditor:
             file.id, None, file.transcript, file.lemmatized_transcript, self.transcript_lexical_search_engine)
         await self._update_lexical_structures_and_get_lemmatized_text(
             file.id, None, file.ocr_text, file.lemmatized_ocr_text, self.ocr_lexical_search_engine)
+        await self._update_lexical_structures_and_get_lemmatized_text(
+            file.id, None, file.llm_description, file.lemmatized_llm_description, self.llm_description_lexical_search_engine)
 
     async def _update_lexical_structures_and_get_lemmatized_text(self, file_id: int | Column[int], new_text: Optional[str | Column[str]], 
             old_text: Optional[str | Column[str]], old_lemmatized_text: Optional[str | Column[str]], search_engine: LexicalSearchEngine) -> Optional[str]:
@@ -1,35 +1,68 @@
 from pathlib import Path
+from typing import Optional
 
-from tqdm import tqdm
-
-from kfe.features.ocr_engine import OCREngine
+from kfe.features.ocr_engine import OCREngine, OCRResult
+from kfe.persistence.derived_data_store import (DerivedArtifactType,
+                                                DerivedDataStore)
 from kfe.persistence.file_metadata_repository import FileMetadataRepository
 from kfe.persistence.model import FileMetadata
-from kfe.utils.init_progress_tracker import InitProgressTracker, InitState
 
 
 class OCRService:
-    def __init__(self, root_dir: Path, file_repo: FileMetadataRepository, ocr_engine: OCREngine) -> None:
+    def __init__(self, root_dir: Path, file_repo: FileMetadataRepository, ocr_engine: OCREngine,
+                 derived_data_store: Optional[DerivedDataStore]=None) -> None:
         self.root_dir = root_dir
         self.file_repo = file_repo
         self.ocr_engine = ocr_engine
+        self.derived_data_store = derived_data_store
 
-    async def init_ocrs(self, progress_tracker: InitProgressTracker):
-        files = await self.file_repo.get_all_images_with_not_analyzed_ocr()
-        progress_tracker.enter_state(InitState.OCR, len(files))
-        async with self.ocr_engine.run() as engine:
-            for f in tqdm(files, desc='generating OCR texts'):
-                await self._run_ocr_and_write_results(f, engine)
-                await self.file_repo.update_file(f)
-                progress_tracker.mark_file_processed()
+    async def get_files_requiring_ocr(self) -> list[FileMetadata]:
+        return await self.file_repo.get_all_images_with_not_analyzed_ocr()
 
     async def perform_ocr(self, file: FileMetadata):
         async with self.ocr_engine.run() as engine:
-            await self._run_ocr_and_write_results(file, engine)
-
-    async def _run_ocr_and_write_results(self, file: FileMetadata, engine: OCREngine.Engine):
-        text, is_screenshot = await engine.run_ocr(self.root_dir.joinpath(file.name))
-        file.is_ocr_analyzed = True
-        file.is_screenshot = is_screenshot
-        if is_screenshot:
-            file.ocr_text = text
+            await self.run_ocr(file, engine)
+
+    async def perform_ocrs(self, files: list[FileMetadata]):
+        async with self.ocr_engine.run() as engine:
+            batch_size = self.ocr_engine.get_preferred_batch_size()
+            for i in range(0, len(files), batch_size):
+                await self.run_ocrs(files[i:i + batch_size], engine)
+
+    async def run_ocr(self, file: FileMetadata, engine: OCREngine.Engine):
+        await self.run_ocrs([file], engine)
+
+    async def run_ocrs(self, files: list[FileMetadata], engine: OCREngine.Engine):
+        for file, (text, is_screenshot) in zip(files, await self._prefilter_and_run_ocrs(files, engine)):
+            file.is_ocr_analyzed = True
+            file.is_screenshot = is_screenshot
+            if is_screenshot:
+                file.ocr_text = text
+
+    async def _prefilter_and_run_ocrs(self, files: list[FileMetadata], engine: OCREngine.Engine) -> list[OCRResult]:
+        if (prefilter := self.ocr_engine.screenshot_prefilter) is None:
+            return await self._get_stored_or_run_ocrs(files, engine)
+        # text of images that are not screenshots is not used, so OCR of camera photos would be wasted
+        is_photo = await prefilter.find_camera_photos([self.root_dir.joinpath(f.name) for f in files])
+        results = [OCRResult(text='', is_screenshot=False) if photo else None for photo in is_photo]
+        if missing := [i for i, res in enumerate(results) if res is None]:
+            for i, res in zip(missing, await self._get_stored_or_run_ocrs([files[i] for i in missing], engine)):
+                results[i] = res
+        return results
+
+    async def _get_stored_or_run_ocrs(self, files: list[FileMetadata], engine: OCREngine.Engine) -> list[OCRResult]:
+        if self.derived_data_store is None:
+            return await engine.run_ocrs([self.root_dir.joinpath(f.name) for f in files])
+        variant = '+'.join(self.ocr_engine.languages)
+        results: list[Optional[OCRResult]] = [None] * len(files)
+        content_hashes = []
+        for i, file in enumerate(files):
+            content_hash = await self.derived_data_store.get_content_hash(self.root_dir, file)
+            content_hashes.append(content_hash)
+            if (record := self.derived_data_store.load_record(content_hash, DerivedArtifactType.OCR, variant)) is not None:
+                results[i] = OCRResult(text=record['text'], is_screenshot=record['is_screenshot'])
+        if missing := [i for i, res in enumerate(results) if res is None]:
+            for i, res in zip(missing, await engine.run_ocrs([self.root_dir.joinpath(files[i].name) for i in missing])):
+                self.derived_data_store.save_record(content_hashes[i], DerivedArtifactType.OCR, res._asdict(), variant)
+                results[i] = res
+        return results
@@ -28,6 +28,12 @@ class HybridSearchConfig(NamedTuple):
     clip_weight: float = 1.
     rrf_k_constant: int = 60
 
+class SearchResultsPage(NamedTuple):
+    results: list[AggregatedSearchResult]
+    total: int
+    # identifies cached results of the query, None if they were not cached
+    handle: Optional[str]
+
 class SearchService:
     NUM_MAX_SIMILAR_ITEMS_TO_RETURN = 500
 
@@ -55,14 +61,19 @@ class SearchService:
         self.include_clip_in_hybrid_search = include_clip_in_hybrid_search
         self.hybrid_search_config = hybrid_search_config if hybrid_search_config is not None else HybridSearchConfig()
 
-    async def search(self, query: str, offset: int, limit: Optional[int]=None) -> tuple[list[AggregatedSearchResult], int]:
+    async def search(self, query: str, offset: int, limit: Optional[int]=None,
+                     result_handle: Optional[str]=None) -> SearchResultsPage:
+        '''
+        Results are computed and filtered only for the first page, they are cached and next pages (requested with
+        the returned handle, or the same query) only load files of the page.
+        '''
         parsed_query = self.parser.parse(query)
         query_text = parsed_query.query_text
-        results = self.query_cache.get(query)
-        if results is None:
+        cached = self.query_cache.get(query, result_handle)
+        if cached is None:
             if query_text != '':
                 if (named_file := await self.file_repo.get_file_by_name(query_text)) is not None:
-                    return ([AggregatedSearchResult(named_file, dense_score=0., lexical_score=0., total_score=0.)], 1)
+                    return SearchResultsPage([AggregatedSearchResult(named_file, dense_score=0., lexical_score=0., total_score=0.)], 1, None)
                 if parsed_query.search_metric == SearchMetric.HYBRID:
                     results = await self.search_hybrid(query_text)
                 elif parsed_query.search_metric == SearchMetric.COMBINED_LEXICAL:
@@ -87,26 +98,32 @@ class SearchService:
                     results = await self.search_llm_description_based(query_text)
                 else:
                     raise ValueError('unexpected search metric')
-                self.query_cache.put(query, results)
+                files_by_id = await self.file_repo.get_files_with_ids_by_id(set(x.item_id for x in results))
             else:
-                results = [SearchResult(item_id=int(x.id), score=1.) for x in await self.file_repo.load_all_files()]
+                all_files = await self.file_repo.load_all_files()
+                results = [SearchResult(item_id=int(x.id), score=1.) for x in all_files]
+                files_by_id = {int(x.id): x for x in all_files}
+            results = [
+                res for res in results
+                # file could be missing if there is some consistency issue when file was deleted
+                if (file := files_by_id.get(res.item_id)) is not None and self._filter(parsed_query, file)
+            ]
+            result_handle = self.query_cache.put(query, results)
+        else:
+            results, result_handle = cached.results, cached.handle
 
         if not results:
-            return [], 0
+            return SearchResultsPage([], 0, result_handle)
 
-        file_ids = set(x.item_id for x in results)
-        files_by_id = await self.file_repo.get_files_with_ids_by_id(file_ids)
-        aggregated_results = []
-        for res in results:
-            file = files_by_id.get(res.item_id)
-            if file is None:
-                continue # could be some consistency issue when file was deleted
-            if not self._filter(parsed_query, file):
-                continue
-            aggregated_results.append(AggregatedSearchResult(file=file, dense_score=-1., lexical_score=-1., total_score=res.score))
-
-        end = len(aggregated_results) if limit is None else offset + limit
-        return aggregated_results[offset:end], len(aggregated_results)
+        end = len(results) if limit is None else offset + limit
+        page = results[offset:end]
+        files_by_id = await self.file_repo.get_files_with_ids_by_id(set(x.item_id for x in page))
+        aggregated_results = [
+            AggregatedSearchResult(file=files_by_id[res.item_id], dense_score=-1., lexical_score=-1., total_score=res.score)
+            for res in page
+            if res.item_id in files_by_id
+        ]
+        return SearchResultsPage(aggregated_results, len(results), result_handle)
     
     async def search_hybrid(self, query: str) -> list[SearchResult]:
         lexical_tokens = await self._get_lexical_search_tokens(query)
@@ -3,13 +3,15 @@ import base64
 import io
 import os
 from pathlib import Path
+from typing import Optional
 
 import aiofiles
 from lru import LRU
 from PIL import Image, ImageOps
 
+from kfe.persistence.derived_data_store import (DerivedArtifactType,
+                                                DerivedDataStore)
 from kfe.persistence.model import FileMetadata, FileType
-from kfe.utils.init_progress_tracker import InitProgressTracker, InitState
 from kfe.utils.log import logger
 from kfe.utils.video_frames_extractor import (get_video_duration_seconds,
                                               seconds_to_ffmpeg_time)
@@ -18,22 +20,18 @@ from kfe.utils.video_frames_extractor import (get_video_duration_seconds,
 class ThumbnailManager:
     THUMBNAIL_FILE_EXTENSION = '.tn'
 
-    def __init__(self, root_dir: Path, thumbnails_dir_name: str='.thumbnails', size: int=300, cache_item_limit=5000) -> None:
+    def __init__(self, root_dir: Path, thumbnails_dir_name: str='.thumbnails', size: int=300, cache_item_limit=5000,
+                 derived_data_store: Optional[DerivedDataStore]=None) -> None:
         self.root_dir = root_dir
         self.thumbnails_dir = root_dir.joinpath(thumbnails_dir_name)
         self.thumbnail_size = size
+        self.derived_data_store = derived_data_store
         self.thumbnail_cache: dict[str, str] = LRU(cache_item_limit)
         try:
             os.mkdir(self.thumbnails_dir)
         except FileExistsError:
             pass
 
-    async def preload_thumbnails(self, files: list[FileMetadata], progress_tracker: InitProgressTracker):
-        progress_tracker.enter_state(InitState.THUMBNAILS, len(files))
-        for f in files:
-            await self.get_encoded_file_thumbnail(f)
-            progress_tracker.mark_file_processed()
-
     def remove_thumbnails_of_deleted_files(self, existing_files: list[FileMetadata]):
         file_names = set(str(file.name) for file in existing_files)
         for item in os.scandir(self.thumbnails_dir):
@@ -57,11 +55,7 @@ class ThumbnailManager:
                 except Exception as e:
                     logger.warning('failed to load preprocessed thumbnail', exc_info=e)
             if recreate:
-                logger.debug(f'creating preprocessed thumbnail for {file.name}')
-                if file.file_type == FileType.VIDEO:
-                    buff = await self._create_video_thumbnail(file_path)
-                else:
-                    buff = await self._create_image_thumbnail(file_path)
+                buff = await self._get_stored_or_create_thumbnail(file, file_path)
                 await self._write_preprocessed_thumbnail(preprocessed_thumbnail_path, buff)
             thumbnail = base64.b64encode(buff.getvalue()).decode()
             self.thumbnail_cache[str(file.name)] = thumbnail
@@ -86,6 +80,21 @@ class ThumbnailManager:
         except Exception as e:
             logger.error(f'Failed to remove thumbnail from {path}', exc_info=e)
 
+    async def _get_stored_or_create_thumbnail(self, file: FileMetadata, file_path: Path) -> io.BytesIO:
+        content_hash, variant = None, str(self.thumbnail_size)
+        if self.derived_data_store is not None:
+            content_hash = await self.derived_data_store.get_content_hash(self.root_dir, file)
+            if (data := self.derived_data_store.load_bytes(content_hash, DerivedArtifactType.THUMBNAIL, variant)) is not None:
+                return io.BytesIO(data)
+        logger.debug(f'creating preprocessed thumbnail for {file.name}')
+        if file.file_type == FileType.VIDEO:
+            buff = await self._create_video_thumbnail(file_path, size=self.thumbnail_size)
+        else:
+            buff = await self._create_image_thumbnail(file_path, size=self.thumbnail_size)
+        if self.derived_data_store is not None:
+            self.derived_data_store.save_bytes(content_hash, DerivedArtifactType.THUMBNAIL, buff.getvalue(), variant)
+        return buff
+
     async def _create_video_thumbnail(self, path: Path, size: int=300) -> io.BytesIO:
         ss = '00:00:01.00'
         for i in range(2):
@@ -1,49 +1,78 @@
 
 from pathlib import Path
-
-from tqdm import tqdm
+from typing import Optional
 
 from kfe.features.transcriber import Transcriber, TranscriberEngine
+from kfe.persistence.derived_data_store import (DerivedArtifactType,
+                                                DerivedDataStore)
 from kfe.persistence.file_metadata_repository import FileMetadataRepository
 from kfe.persistence.model import FileMetadata
 from kfe.utils.ffprobe import get_ffprobe_stream_info, has_audio_stream
-from kfe.utils.init_progress_tracker import InitProgressTracker, InitState
 from kfe.utils.log import logger
 
 
 class TranscriptionService:
-    def __init__(self, root_dir: Path, transcriber: Transcriber, file_repo: FileMetadataRepository) -> None:
+    def __init__(self, root_dir: Path, transcriber: Transcriber, file_repo: FileMetadataRepository,
+                 derived_data_store: Optional[DerivedDataStore]=None) -> None:
         self.root_dir = root_dir
         self.trancriber = transcriber
         self.file_repo = file_repo
+        self.derived_data_store = derived_data_store
 
-    async def init_transcriptions(self, progress_tracker: InitProgressTracker, retranscribe_all_auto_trancribed=False):
+    async def get_files_requiring_transcription(self, retranscribe_all_auto_trancribed=False) -> list[FileMetadata]:
         if retranscribe_all_auto_trancribed:
-            files = await self.file_repo.get_all_audio_files_with_not_manually_fixed_transcript() 
-        else:
-            files = await self.file_repo.get_all_audio_files_with_not_analyzed_trancription()
-        progress_tracker.enter_state(InitState.TRANSCIPTION, len(files))
-
-        if not files:
-            return
+            return await self.file_repo.get_all_audio_files_with_not_manually_fixed_transcript() 
+        return await self.file_repo.get_all_audio_files_with_not_analyzed_trancription()
 
+    async def transcribe_file(self, file: FileMetadata):
         async with self.trancriber.run() as engine:
-            logger.info(f'generating transcriptions for {len(files)} files...')
-            for f in tqdm(files, desc='generating transcriptions'):
-                await self._run_transcriber_and_write_results(f, engine)
-                await self.file_repo.update_file(f)
-                progress_tracker.mark_file_processed()
+            await self.transcribe(file, engine)
 
-    async def transcribe_file(self, file: FileMetadata):
+    async def transcribe_files(self, files: list[FileMetadata]):
         async with self.trancriber.run() as engine:
-            await self._run_transcriber_and_write_results(file, engine)
+            await self.transcribe_many(files, engine)
+
+    async def transcribe(self, file: FileMetadata, engine: TranscriberEngine):
+        await self.transcribe_many([file], engine)
+
+    async def transcribe_many(self, files: list[FileMetadata], engine: TranscriberEngine):
+        # files are transcribed together, so that the engine can batch their audio
+        content_hashes: list[Optional[str]] = [None] * len(files)
+        missing = []
+        for i, file in enumerate(files):
+            try:
+                if self.derived_data_store is not None:
+                    content_hashes[i] = await self.derived_data_store.get_content_hash(self.root_dir, file)
+                    if (record := self.derived_data_store.load_record(content_hashes[i], DerivedArtifactType.TRANSCRIPT)) is not None:
+                        file.transcript = record['transcript']
+                        file.speech_coverage = record.get('speech_coverage')
+                        file.is_transcript_analyzed = True
+                        continue
+                missing.append(i)
+            except Exception as e:
+                await self._on_transcription_failed(file, e)
+
+        if missing:
+            try:
+                results = await engine.transcribe_many([self.root_dir.joinpath(files[i].name) for i in missing])
+            except Exception as e:
+                results = [e] * len(missing)
+            for i, res in zip(missing, results):
+                file = files[i]
+                if isinstance(res, Exception):
+                    await self._on_transcription_failed(file, res)
+                    continue
+                file.transcript = res.transcript
+                file.speech_coverage = res.speech_coverage
+                file.is_transcript_analyzed = True
+                if self.derived_data_store is not None:
+                    self.derived_data_store.save_record(content_hashes[i], DerivedArtifactType.TRANSCRIPT,
+                        {'transcript': file.transcript, 'speech_coverage': file.speech_coverage})
 
-    async def _run_transcriber_and_write_results(self, file: FileMetadata, engine: TranscriberEngine):
-        file_path = self.root_dir.joinpath(file.name)
+    async def _on_transcription_failed(self, file: FileMetadata, e: Exception):
+        file.is_transcript_analyzed = True
         try:
-            file.transcript = await engine.transcribe(file_path)
-        except Exception as e:
-            if has_audio_stream(await get_ffprobe_stream_info(file_path)):
+            if has_audio_stream(await get_ffprobe_stream_info(self.root_dir.joinpath(file.name))):
                 logger.error(f'Failed to create transcription for {file.name}', exc_info=e)
-        finally:
-            file.is_transcript_analyzed = True
+        except Exception as probe_error:
+            logger.error(f'Failed to create transcription for {file.name}', exc_info=probe_error)
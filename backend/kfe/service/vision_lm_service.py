@@ -1,43 +1,79 @@
 from pathlib import Path
-
-from tqdm import tqdm
+from typing import Optional
 
 from kfe.features.vision_lm_engine import VisionLMEngine
+from kfe.persistence.derived_data_store import (DerivedArtifactType,
+                                                DerivedDataStore)
 from kfe.persistence.file_metadata_repository import FileMetadataRepository
-from kfe.persistence.model import FileType
-from kfe.utils.init_progress_tracker import InitProgressTracker, InitState
+from kfe.persistence.model import FileMetadata, FileType
 from kfe.utils.log import logger
 
 
 class VisionLMService:
-    def __init__(self, root_dir: Path, vision_lm_engine: VisionLMEngine, file_repo: FileMetadataRepository) -> None:
+    def __init__(self, root_dir: Path, vision_lm_engine: VisionLMEngine, file_repo: FileMetadataRepository,
+                 derived_data_store: Optional[DerivedDataStore]=None) -> None:
         self.root_dir = root_dir
         self.vision_lm_engine = vision_lm_engine
         self.file_repo = file_repo
+        self.derived_data_store = derived_data_store
 
-    async def init_vision_lm_descriptions(self, progress_tracker: InitProgressTracker, regenerate_all: bool=False):
+    async def get_files_requiring_description(self, regenerate_all: bool=False) -> list[FileMetadata]:
         files = await self.file_repo.get_all_files_with_one_of_types([FileType.IMAGE, FileType.VIDEO])
         if not regenerate_all:
             files = [f for f in files if not f.is_llm_description_analyzed]
-        progress_tracker.enter_state(InitState.LLM_DESCRIPTION, len(files))
-
-        if not files:
-            return
-
-        async with self.vision_lm_engine.run() as engine:
-            logger.info(f'generating LLM descriptions for {len(files)} files...')
-            for f in tqdm(files, desc='generating LLM descriptions'):
-                try:
-                    path = self.root_dir.joinpath(f.name)
-                    if f.file_type == FileType.IMAGE:
-                        description = await engine.generate_image_description(path)
-                    elif f.file_type == FileType.VIDEO:
-                        description = await engine.generate_video_description(path)
-                    else:
-                        raise Exception(f'Unexpected file type: {f.file_type}')
-                    f.llm_description = description
-                except Exception as e:
-                    logger.error(f'Failed to create LLM description for {f.name}', exc_info=e)
-                f.is_llm_description_analyzed = True
-                await self.file_repo.update_file(f)
-                progress_tracker.mark_file_processed()
+        return files
+
+    async def generate_description(self, file: FileMetadata, engine: VisionLMEngine.Engine):
+        try:
+            file.llm_description = await self._get_stored_or_generate_description(file, engine)
+        except Exception as e:
+            logger.error(f'Failed to create LLM description for {file.name}', exc_info=e)
+        file.is_llm_description_analyzed = True
+
+    async def generate_descriptions(self, files: list[FileMetadata], engine: VisionLMEngine.Engine):
+        # images are described in batches by the engine, videos need frame selection so they are handled one by one
+        images: list[tuple[FileMetadata, Optional[str]]] = []
+        for file in files:
+            if file.file_type != FileType.IMAGE:
+                await self.generate_description(file, engine)
+                continue
+            try:
+                content_hash = None
+                if self.derived_data_store is not None:
+                    content_hash = await self.derived_data_store.get_content_hash(self.root_dir, file)
+                    if (record := self.derived_data_store.load_record(content_hash, DerivedArtifactType.LLM_TEXT)) is not None:
+                        file.llm_description = record['description']
+                        file.is_llm_description_analyzed = True
+                        continue
+                images.append((file, content_hash))
+            except Exception as e:
+                logger.error(f'Failed to create LLM description for {file.name}', exc_info=e)
+                file.is_llm_description_analyzed = True
+
+        if images:
+            descriptions = await engine.generate_image_descriptions([self.root_dir.joinpath(file.name) for file, _ in images])
+            for (file, content_hash), description in zip(images, descriptions):
+                if isinstance(description, Exception):
+                    logger.error(f'Failed to create LLM description for {file.name}', exc_info=description)
+                else:
+                    file.llm_description = description
+                    if self.derived_data_store is not None:
+                        self.derived_data_store.save_record(content_hash, DerivedArtifactType.LLM_TEXT, {'description': description})
+                file.is_llm_description_analyzed = True
+
+    async def _get_stored_or_generate_description(self, file: FileMetadata, engine: VisionLMEngine.Engine) -> str:
+        content_hash = None
+        if self.derived_data_store is not None:
+            content_hash = await self.derived_data_store.get_content_hash(self.root_dir, file)
+            if (record := self.derived_data_store.load_record(content_hash, DerivedArtifactType.LLM_TEXT)) is not None:
+                return record['description']
+        path = self.root_dir.joinpath(file.name)
+        if file.file_type == FileType.IMAGE:
+            description = await engine.generate_image_description(path)
+        elif file.file_type == FileType.VIDEO:
+            description = await engine.generate_video_description(path)
+        else:
+            raise Exception(f'Unexpected file type: {file.file_type}')
+        if self.derived_data_store is not None:
+            self.derived_data_store.save_record(content_hash, DerivedArtifactType.LLM_TEXT, {'description': description})
+        return description
@@ -0,0 +1,49 @@
+import asyncio
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import numpy as np
+
+PCM_S16_BYTES_PER_SAMPLE = 2
+
+
+async def stream_audio_chunks(path: Path, sampling_rate: int, chunk_seconds: float,
+                              max_seconds: Optional[float]=None) -> AsyncIterator[np.ndarray]:
+    '''
+    Decodes audio of the file once with a single ffmpeg process and yields consecutive float32 mono chunks
+    of `chunk_seconds` length (the last one can be shorter), resampled to `sampling_rate`.
+    Raises ValueError if ffmpeg failed before producing any audio.
+    '''
+    args = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', str(path.absolute())]
+    if max_seconds is not None:
+        args.extend(['-t', str(max_seconds)])
+    # raw pcm has no container, samples can be sliced directly from the pipe
+    args.extend(['-vn', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(sampling_rate), '-f', 's16le', '-'])
+    proc = await asyncio.subprocess.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    # stderr is drained concurrently, otherwise ffmpeg could block on full stderr pipe while we wait for stdout
+    stderr_task = asyncio.create_task(proc.stderr.read())
+    chunk_bytes = max(1, int(chunk_seconds * sampling_rate)) * PCM_S16_BYTES_PER_SAMPLE
+    produced_audio = False
+    try:
+        while True:
+            try:
+                data = await proc.stdout.readexactly(chunk_bytes)
+            except asyncio.IncompleteReadError as e:
+                data = e.partial
+            # odd trailing byte can only appear if ffmpeg was interrupted in the middle of a sample
+            data = data[:len(data) - len(data) % PCM_S16_BYTES_PER_SAMPLE]
+            if data:
+                produced_audio = True
+                yield np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.
+            if len(data) < chunk_bytes:
+                break
+        stderr = await stderr_task
+        if await proc.wait() != 0 and not produced_audio:
+            raise ValueError(f'failed to decode audio of: {path}\nerror: {stderr.decode()}')
+    finally:
+        if proc.returncode is None:
+            # consumer stopped early
+            proc.kill()
+            await proc.wait()
+        if not stderr_task.done():
+            stderr_task.cancel()
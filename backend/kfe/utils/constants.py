@@ -3,11 +3,35 @@ from typing import Literal
 PRELOAD_THUMBNAILS_ENV = 'PRELOAD_THUMBNAILS'
 GENERATE_OPENAPI_SCHEMA_ON_STARTUP_ENV = 'GENERATE_OPENAPI_SCHEMA_ON_STARTUP'
 LOG_SQL_ENV = 'LOG_SQL'
+SQLITE_JOURNAL_MODE_ENV = 'SQLITE_JOURNAL_MODE'
+SQLITE_SYNCHRONOUS_ENV = 'SQLITE_SYNCHRONOUS'
+SQLITE_CACHE_SIZE_MB_ENV = 'SQLITE_CACHE_SIZE_MB'
+SQLITE_MMAP_SIZE_MB_ENV = 'SQLITE_MMAP_SIZE_MB'
+SQLITE_TEMP_STORE_ENV = 'SQLITE_TEMP_STORE'
 LOG_LEVEL_ENV = 'LOG_LEVEL'
 DEVICE_ENV = 'DEVICE'
 TRANSCRIPTION_MODEL_ENV = 'TRANSCRIPTION_MODEL'
+TRANSCRIPTION_CHUNK_SECONDS_ENV = 'TRANSCRIPTION_CHUNK_SECONDS'
+TRANSCRIPTION_BATCH_SIZE_ENV = 'TRANSCRIPTION_BATCH_SIZE'
+TRANSCRIPTION_VAD_ENV = 'TRANSCRIPTION_VAD'
 RETRANSCRIBE_AUTO_TRANSCRIBED_ENV = 'RETRANSCRIBE_AUTO_TRANSCRIBED'
 REGENERATE_LLM_DESCRIPTIONS_ENV = 'REGENERATE_LLM_DESCRIPTIONS'
+VISION_LM_BATCH_SIZE_ENV = 'VISION_LM_BATCH_SIZE'
+BACKGROUND_LLM_DESCRIPTIONS_ENV = 'BACKGROUND_LLM_DESCRIPTIONS'
+BACKGROUND_LLM_DESCRIPTIONS_MIN_IDLE_SECONDS_ENV = 'BACKGROUND_LLM_DESCRIPTIONS_MIN_IDLE_SECONDS'
+BACKGROUND_LLM_DESCRIPTIONS_MIN_FREE_MEMORY_MB_ENV = 'BACKGROUND_LLM_DESCRIPTIONS_MIN_FREE_MEMORY_MB'
+MAX_CONCURRENT_DIRECTORY_INITS_ENV = 'MAX_CONCURRENT_DIRECTORY_INITS'
+MODEL_RAM_BUDGET_MB_ENV = 'MODEL_RAM_BUDGET_MB'
+MODEL_VRAM_BUDGET_MB_ENV = 'MODEL_VRAM_BUDGET_MB'
+CPU_QUANTIZATION_ENV = 'CPU_QUANTIZATION'
+CPU_THREADS_ENV = 'CPU_THREADS'
+CPU_INFERENCE_BACKEND_ENV = 'CPU_INFERENCE_BACKEND'
+MICRO_BATCH_MAX_WAIT_MS_ENV = 'MICRO_BATCH_MAX_WAIT_MS'
+MICRO_BATCH_MAX_SIZE_ENV = 'MICRO_BATCH_MAX_SIZE'
+OCR_MAX_IMAGE_SIDE_ENV = 'OCR_MAX_IMAGE_SIDE'
+OCR_BATCH_SIZE_ENV = 'OCR_BATCH_SIZE'
+OCR_PROCESSES_ENV = 'OCR_PROCESSES'
+OCR_SKIP_CAMERA_PHOTOS_ENV = 'OCR_SKIP_CAMERA_PHOTOS'
 
 DIRECTORY_NAME_HEADER = 'X-Directory'
 
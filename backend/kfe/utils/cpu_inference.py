@@ -0,0 +1,35 @@
+import os
+from typing import NamedTuple, Optional
+
+import torch
+
+from kfe.utils.constants import (CPU_INFERENCE_BACKEND_ENV, CPU_QUANTIZATION_ENV,
+                                 CPU_THREADS_ENV)
+from kfe.utils.log import logger
+
+
+class CPUInferenceConfig(NamedTuple):
+    # dynamic int8 quantization of linear layers, weights are quantized once, activations on the fly
+    quantize: bool = False
+    # intra-op threads used by torch and onnx runtime, None means their default (number of physical cores)
+    num_threads: Optional[int] = None
+    # 'torch' or 'onnx', onnx runtime falls back to torch if it is not installed or the model can't be exported
+    backend: str = 'torch'
+
+    @staticmethod
+    def from_env() -> "CPUInferenceConfig":
+        num_threads = os.getenv(CPU_THREADS_ENV)
+        return CPUInferenceConfig(
+            quantize=os.getenv(CPU_QUANTIZATION_ENV, 'false') == 'true',
+            num_threads=int(num_threads) if num_threads else None,
+            backend=os.getenv(CPU_INFERENCE_BACKEND_ENV, 'torch')
+        )
+
+def configure_cpu_threads(config: CPUInferenceConfig):
+    if config.num_threads is not None:
+        torch.set_num_threads(config.num_threads)
+        logger.info(f'using {config.num_threads} threads for cpu inference')
+
+def quantize_for_cpu(model: torch.nn.Module) -> torch.nn.Module:
+    '''Returns copy of the model with linear layers dynamically quantized to int8, model must be on cpu'''
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
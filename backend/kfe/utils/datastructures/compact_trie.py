@@ -0,0 +1,120 @@
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+
+class CompactTrie:
+    '''
+    Immutable trie stored in flat numpy arrays (CSR child table), drop-in replacement of Trie for lookups.
+    Nodes are integers, children of node n are child_nodes[child_offsets[n]:child_offsets[n+1]],
+    labeled by sorted child_tokens of the same range. Arrays can be saved and memory mapped when loaded.
+    '''
+    ROOT = 0
+    CHILD_OFFSETS_FILE = 'child_offsets.npy'
+    CHILD_TOKENS_FILE = 'child_tokens.npy'
+    CHILD_NODES_FILE = 'child_nodes.npy'
+    IS_TERMINAL_FILE = 'is_terminal.npy'
+    NUM_TOKENS_FILE = 'num_tokens.npy'
+
+    def __init__(self, num_tokens: int, child_offsets: np.ndarray, child_tokens: np.ndarray,
+                 child_nodes: np.ndarray, is_terminal: np.ndarray) -> None:
+        self.num_tokens = num_tokens
+        self.child_offsets = child_offsets
+        self.child_tokens = child_tokens
+        self.child_nodes = child_nodes
+        self.is_terminal = is_terminal
+        self.root = self.ROOT
+
+    @staticmethod
+    def build(words: Iterable[list[int]], num_tokens: int) -> "CompactTrie":
+        # words are sorted, so that a word shares its path with the previous one up to their common prefix
+        # and nodes can be created without any per-node lookup structure
+        sorted_words = sorted(set(tuple(x) for x in words if x))
+        parents, tokens, terminal = [], [], [False]
+        path = [CompactTrie.ROOT]
+        previous: tuple[int, ...] = ()
+        for word in sorted_words:
+            common = 0
+            while common < min(len(word), len(previous)) and word[common] == previous[common]:
+                common += 1
+            del path[common + 1:]
+            for token in word[common:]:
+                parents.append(path[-1])
+                tokens.append(token)
+                terminal.append(False)
+                path.append(len(terminal) - 1)
+            terminal[path[-1]] = True
+            previous = word
+
+        num_nodes = len(terminal)
+        parents_arr = np.array(parents, dtype=np.int32)
+        # edge e creates node e + 1, sorting by parent groups children, stable sort keeps them sorted by token
+        order = np.argsort(parents_arr, kind='stable')
+        child_offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+        child_offsets[1:] = np.cumsum(np.bincount(parents_arr, minlength=num_nodes))
+        return CompactTrie(
+            num_tokens=num_tokens,
+            child_offsets=child_offsets,
+            child_tokens=np.array(tokens, dtype=np.int32)[order],
+            child_nodes=(order + 1).astype(np.int32),
+            is_terminal=np.array(terminal, dtype=np.bool_)
+        )
+
+    def save(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory.joinpath(self.CHILD_OFFSETS_FILE), self.child_offsets)
+        np.save(directory.joinpath(self.CHILD_TOKENS_FILE), self.child_tokens)
+        np.save(directory.joinpath(self.CHILD_NODES_FILE), self.child_nodes)
+        np.save(directory.joinpath(self.IS_TERMINAL_FILE), self.is_terminal)
+        np.save(directory.joinpath(self.NUM_TOKENS_FILE), np.array([self.num_tokens]))
+
+    @staticmethod
+    def load(directory: Path, mmap: bool=True) -> "CompactTrie":
+        mmap_mode = 'r' if mmap else None
+        return CompactTrie(
+            num_tokens=int(np.load(directory.joinpath(CompactTrie.NUM_TOKENS_FILE))[0]),
+            child_offsets=np.load(directory.joinpath(CompactTrie.CHILD_OFFSETS_FILE), mmap_mode=mmap_mode),
+            child_tokens=np.load(directory.joinpath(CompactTrie.CHILD_TOKENS_FILE), mmap_mode=mmap_mode),
+            child_nodes=np.load(directory.joinpath(CompactTrie.CHILD_NODES_FILE), mmap_mode=mmap_mode),
+            is_terminal=np.load(directory.joinpath(CompactTrie.IS_TERMINAL_FILE), mmap_mode=mmap_mode)
+        )
+
+    @staticmethod
+    def load_or_build(directory: Path, words: Callable[[], Iterable[list[int]]], num_tokens: int) -> "CompactTrie":
+        '''Loads trie persisted in the directory, builds and saves it first if it doesn't exist'''
+        if not CompactTrie.exists(directory):
+            CompactTrie.build(words(), num_tokens).save(directory)
+        return CompactTrie.load(directory)
+
+    @staticmethod
+    def exists(directory: Path) -> bool:
+        return all(directory.joinpath(x).exists() for x in (CompactTrie.CHILD_OFFSETS_FILE, CompactTrie.CHILD_TOKENS_FILE,
+            CompactTrie.CHILD_NODES_FILE, CompactTrie.IS_TERMINAL_FILE, CompactTrie.NUM_TOKENS_FILE))
+
+    def _get_child(self, node: int, token: int) -> Optional[int]:
+        start, end = int(self.child_offsets[node]), int(self.child_offsets[node + 1])
+        if start == end:
+            return None
+        idx = start + int(np.searchsorted(self.child_tokens[start:end], token))
+        if idx < end and self.child_tokens[idx] == token:
+            return int(self.child_nodes[idx])
+        return None
+
+    def search(self, word_token_ids: list[int]) -> tuple[bool, int, int]:
+        '''Returns: True iff word exists, length of the longest prefix, last node on the path'''
+        cur = self.root
+        for i, token in enumerate(word_token_ids):
+            child = self._get_child(cur, token)
+            if child is None:
+                return False, i, cur
+            cur = child
+        return bool(self.is_terminal[cur]), len(word_token_ids), cur
+
+    def has(self, word_token_ids: list[int]) -> bool:
+        return self.search(word_token_ids)[0]
+
+    def get_possible_next_tokens(self, node: Optional[int]) -> list[int]:
+        if node is None:
+            return []
+        return self.child_tokens[self.child_offsets[node]:self.child_offsets[node + 1]].tolist()
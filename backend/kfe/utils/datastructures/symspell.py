@@ -0,0 +1,113 @@
+import hashlib
+from pathlib import Path
+from typing import Callable, Generator, Iterable
+
+import editdistance
+import numpy as np
+
+
+def _hash(s: str) -> int:
+    # must be stable across processes, builtin hash of str is randomized
+    return int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'little')
+
+def _deletions(word: str, max_deletions: int) -> set[str]:
+    res = {word}
+    frontier = {word}
+    for _ in range(max_deletions):
+        frontier = {x[:i] + x[i + 1:] for x in frontier for i in range(len(x))}
+        res |= frontier
+    return res
+
+
+class SymSpellIndex:
+    '''
+    Dictionary index for edit distance search based on deletion neighbourhoods (SymSpell). Every word is indexed under all strings
+    obtained by deleting up to `max_distance` characters, a query looks up its own deletions and verifies the candidates
+    with exact edit distance. Index consists of flat numpy arrays which can be saved and memory mapped when loaded.
+    '''
+    WORDS_FILE = 'words.npy'
+    WORD_OFFSETS_FILE = 'word_offsets.npy'
+    KEYS_FILE = 'deletion_keys.npy'
+    WORD_IDS_FILE = 'deletion_word_ids.npy'
+    MAX_DISTANCE_FILE = 'max_distance.npy'
+
+    def __init__(self, words: np.ndarray, word_offsets: np.ndarray, keys: np.ndarray, word_ids: np.ndarray, max_distance: int) -> None:
+        # utf-8 bytes of all words concatenated, word i is words[word_offsets[i]:word_offsets[i+1]]
+        self.words = words
+        self.word_offsets = word_offsets
+        # sorted hashes of deletions and ids of words that have them, hash collisions only add candidates which are rejected
+        self.keys = keys
+        self.word_ids = word_ids
+        self.max_distance = max_distance
+
+    @staticmethod
+    def build(words: Iterable[str], max_distance: int=2) -> "SymSpellIndex":
+        unique_words = sorted(set(words))
+        encoded = [x.encode() for x in unique_words]
+        word_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        word_offsets[1:] = np.cumsum([len(x) for x in encoded])
+        all_keys, all_word_ids = [], []
+        for word_id, word in enumerate(unique_words):
+            for deletion in _deletions(word, max_distance):
+                all_keys.append(_hash(deletion))
+                all_word_ids.append(word_id)
+        keys = np.array(all_keys, dtype=np.uint64)
+        word_ids = np.array(all_word_ids, dtype=np.uint32)
+        order = np.argsort(keys, kind='stable')
+        return SymSpellIndex(np.frombuffer(b''.join(encoded), dtype=np.uint8), word_offsets, keys[order], word_ids[order], max_distance)
+
+    def save(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory.joinpath(self.WORDS_FILE), self.words)
+        np.save(directory.joinpath(self.WORD_OFFSETS_FILE), self.word_offsets)
+        np.save(directory.joinpath(self.KEYS_FILE), self.keys)
+        np.save(directory.joinpath(self.WORD_IDS_FILE), self.word_ids)
+        np.save(directory.joinpath(self.MAX_DISTANCE_FILE), np.array([self.max_distance]))
+
+    @staticmethod
+    def load(directory: Path, mmap: bool=True) -> "SymSpellIndex":
+        mmap_mode = 'r' if mmap else None
+        return SymSpellIndex(
+            words=np.load(directory.joinpath(SymSpellIndex.WORDS_FILE), mmap_mode=mmap_mode),
+            word_offsets=np.load(directory.joinpath(SymSpellIndex.WORD_OFFSETS_FILE), mmap_mode=mmap_mode),
+            keys=np.load(directory.joinpath(SymSpellIndex.KEYS_FILE), mmap_mode=mmap_mode),
+            word_ids=np.load(directory.joinpath(SymSpellIndex.WORD_IDS_FILE), mmap_mode=mmap_mode),
+            max_distance=int(np.load(directory.joinpath(SymSpellIndex.MAX_DISTANCE_FILE))[0])
+        )
+
+    @staticmethod
+    def load_or_build(directory: Path, words: Callable[[], Iterable[str]], max_distance: int=2) -> "SymSpellIndex":
+        '''Loads index persisted in the directory (e.g. next to the dictionary), builds and saves it first if it doesn't exist'''
+        if not SymSpellIndex.exists(directory) or SymSpellIndex.load(directory).max_distance < max_distance:
+            SymSpellIndex.build(words(), max_distance).save(directory)
+        return SymSpellIndex.load(directory)
+
+    @staticmethod
+    def exists(directory: Path) -> bool:
+        return all(directory.joinpath(x).exists() for x in (SymSpellIndex.WORDS_FILE, SymSpellIndex.WORD_OFFSETS_FILE,
+            SymSpellIndex.KEYS_FILE, SymSpellIndex.WORD_IDS_FILE, SymSpellIndex.MAX_DISTANCE_FILE))
+
+    def __len__(self) -> int:
+        return len(self.word_offsets) - 1
+
+    def get_word(self, word_id: int) -> str:
+        return bytes(self.words[self.word_offsets[word_id]:self.word_offsets[word_id + 1]]).decode()
+
+    def search(self, word: str, max_distance: int=1) -> Generator[tuple[str, int], None, None]:
+        '''Yields (dictionary word, edit distance) for all dictionary words within `max_distance` of the word, in no particular order'''
+        if max_distance > self.max_distance:
+            raise ValueError(f'index was built for max distance {self.max_distance}, requested {max_distance}')
+        hashes = np.array([_hash(x) for x in _deletions(word, max_distance)], dtype=np.uint64)
+        starts = np.searchsorted(self.keys, hashes, side='left')
+        ends = np.searchsorted(self.keys, hashes, side='right')
+        candidate_ids = set()
+        for start, end in zip(starts, ends):
+            if start < end:
+                candidate_ids.update(self.word_ids[start:end].tolist())
+        for word_id in candidate_ids:
+            candidate = self.get_word(word_id)
+            if abs(len(candidate) - len(word)) > max_distance:
+                continue
+            dist = editdistance.eval(word, candidate)
+            if dist <= max_distance:
+                yield candidate, dist
@@ -0,0 +1,62 @@
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from kfe.utils.log import logger
+
+
+class DirectoryInitScheduler:
+    '''
+    Limits the number of directories that are initialized concurrently. Waiting initializations are started
+    in order of priority (lower value first, ties in order of arrival), priority of waiting initialization can be boosted,
+    e.g., when user opens the directory. Models and GPU memory of concurrent initializations are arbitrated by ModelManager,
+    which shares loaded models between them and runs heavy models exclusively.
+    '''
+    BOOSTED_PRIORITY = float('-inf')
+
+    def __init__(self, max_concurrent_inits: int=2) -> None:
+        assert max_concurrent_inits > 0
+        self.max_concurrent_inits = max_concurrent_inits
+        self.running: set[str] = set()
+        # name -> [priority, arrival number, future resolved when initialization may start]
+        self.waiting: dict[str, list] = {}
+        self.arrival_counter = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, name: str, priority: float) -> AsyncIterator[None]:
+        if len(self.running) < self.max_concurrent_inits and not self.waiting:
+            self.running.add(name)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.waiting[name] = [priority, next(self.arrival_counter), future]
+            logger.info(f'initialization of directory {name} is waiting for other directories')
+            try:
+                await future # name is added to running when the future is resolved
+            except asyncio.CancelledError:
+                self.waiting.pop(name, None)
+                self._release(name)
+                raise
+        try:
+            yield
+        finally:
+            self._release(name)
+
+    def boost(self, name: str):
+        if (entry := self.waiting.get(name)) is not None:
+            entry[0] = self.BOOSTED_PRIORITY
+
+    def is_waiting(self, name: str) -> bool:
+        return name in self.waiting
+
+    def _release(self, name: str):
+        if name not in self.running:
+            return
+        self.running.remove(name)
+        while self.waiting and len(self.running) < self.max_concurrent_inits:
+            next_name = min(self.waiting, key=lambda x: self.waiting[x][:2])
+            future = self.waiting.pop(next_name)[2]
+            if future.done():
+                continue
+            self.running.add(next_name)
+            future.set_result(None)
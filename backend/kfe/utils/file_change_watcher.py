@@ -1,8 +1,6 @@
-import asyncio
 import queue
 import threading
 from pathlib import Path
-from typing import Awaitable, Callable
 
 from watchdog.events import (DirCreatedEvent, DirDeletedEvent, FileClosedEvent,
                              FileCreatedEvent, FileDeletedEvent,
@@ -10,21 +8,15 @@ from watchdog.events import (DirCreatedEvent, DirDeletedEvent, FileClosedEvent,
                              FileSystemEventHandler)
 from watchdog.observers import Observer
 
-FileCreatedObserver = Callable[[Path], Awaitable[None]]
-FileDeletedObserver = FileCreatedObserver
-FileMovedObserver = Callable[[Path, Path], Awaitable[None]] # (old, new)
+from kfe.utils.file_event_queue import FileEventQueue
+
 
 class FileChangeWatcher:
-    def __init__(self, root_dir: Path, file_created_observer: FileCreatedObserver,
-                 file_deleted_observer: FileDeletedObserver, file_moved_observer: FileMovedObserver,
-                 ignored_files: set[str] = None):
+    def __init__(self, root_dir: Path, event_queue: FileEventQueue, ignored_files: set[str] = None):
         self.root_dir = root_dir
-        self.file_created_observer = file_created_observer
-        self.file_deleted_observer = file_deleted_observer
-        self.file_moved_observer = file_moved_observer
+        self.event_queue = event_queue
         self.ignored_files = ignored_files if ignored_files is not None else set()
         self.observer = None
-        self.callback_loop = None
         self.handler = None
 
     class WatchdogEventHandler(FileSystemEventHandler):
@@ -121,8 +113,7 @@ class FileChangeWatcher:
             self.sleep_event.set() # interrupt
 
 
-    def start_watcher_thread(self, loop: asyncio.AbstractEventLoop):
-        self.callback_loop = loop
+    def start_watcher_thread(self):
         self.observer = Observer()
         self.handler = self.WatchdogEventHandler(self)
         self.observer.schedule(
@@ -133,21 +124,19 @@ class FileChangeWatcher:
         )
         self.observer.start()
 
+    # events are pushed to the queue which coalesces them and may block this (watchdog) thread if consumer falls behind
     def _on_created(self, path: Path):
         if path.name not in self.ignored_files:
-            self.callback_loop.call_soon_threadsafe(lambda: self.callback_loop.create_task(self.file_created_observer(path)))
+            self.event_queue.put_created(path)
 
     def _on_deleted(self, path: Path):
         if path.name not in self.ignored_files:
-            self.callback_loop.call_soon_threadsafe(lambda: self.callback_loop.create_task(self.file_deleted_observer(path)))
+            self.event_queue.put_deleted(path)
     
     def _on_moved(self, old_path: Path, new_path: Path):
-        if old_path.name not in self.ignored_files and new_path.name not in self.ignored_files:
-            self.callback_loop.call_soon_threadsafe(lambda: self.callback_loop.create_task(self.file_moved_observer(old_path, new_path)))
-        elif old_path.name in self.ignored_files:
+        self._on_deleted(old_path)
+        if new_path.parent.name == self.root_dir.name:
             self._on_created(new_path)
-        elif new_path.name in self.ignored_files:
-            self._on_deleted(old_path)
 
     def stop(self):
         if self.observer is not None:
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+from enum import Enum
+from pathlib import Path
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from kfe.utils.log import logger
+
+
+class PendingFileEvent(str, Enum):
+    CREATED = 'created'
+    DELETED = 'deleted'
+    RECREATED = 'recreated' # deleted and created again, stale data must be removed before file is processed
+    MODIFIED = 'modified' # content of known file changed, data entered by the user must be kept
+
+class FileEventBatch(NamedTuple):
+    deleted: list[Path]
+    created: list[Path]
+    modified: list[Path]
+
+class FileEventQueueConfig(NamedTuple):
+    debounce_seconds: float = 1.
+    max_batch_size: int = 256
+    max_pending_paths: int = 10000
+
+FileEventBatchHandler = Callable[[FileEventBatch], Awaitable[None]]
+
+class FileEventQueue:
+    '''
+    Collects file system events produced by the watcher thread and delivers them in batches to a single consumer task.
+    Events are coalesced per path: only the net effect of all events received for a path is delivered
+    (e.g., file created and deleted before it was processed is delivered as deletion, which is a no-op for unknown files).
+    Path is delivered only after it didn't receive any events for `debounce_seconds`. If the consumer falls behind
+    and there are more than `max_pending_paths` pending paths, put blocks the producer (watcher) thread.
+    '''
+    def __init__(self, config: Optional[FileEventQueueConfig]=None) -> None:
+        self.config = config if config is not None else FileEventQueueConfig()
+        self.lock = threading.Lock()
+        self.not_full = threading.Condition(self.lock)
+        # dicts preserve insertion order, oldest paths are delivered first
+        self.pending: dict[Path, tuple[PendingFileEvent, float]] = {}
+        self.closed = False
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup_event: Optional[asyncio.Event] = None
+        self.consumer_task: Optional[asyncio.Task] = None
+
+    def put_created(self, path: Path):
+        self._put(path, PendingFileEvent.CREATED)
+
+    def put_deleted(self, path: Path):
+        self._put(path, PendingFileEvent.DELETED)
+
+    def put_modified(self, path: Path):
+        self._put(path, PendingFileEvent.MODIFIED)
+
+    def start_consumer(self, handler: FileEventBatchHandler):
+        assert self.consumer_task is None
+        self.loop = asyncio.get_running_loop()
+        self.wakeup_event = asyncio.Event()
+        self.consumer_task = asyncio.create_task(self._consume(handler))
+
+    def get_number_of_pending_paths(self) -> int:
+        with self.lock:
+            return len(self.pending)
+
+    async def close(self):
+        with self.lock:
+            self.closed = True
+            self.pending.clear()
+            self.not_full.notify_all()
+        if self.consumer_task is not None:
+            self.consumer_task.cancel()
+            try:
+                await self.consumer_task
+            except asyncio.CancelledError:
+                pass
+
+    def _put(self, path: Path, event: PendingFileEvent):
+        with self.lock:
+            while not self.closed and path not in self.pending and len(self.pending) >= self.config.max_pending_paths:
+                self.not_full.wait()
+            if self.closed:
+                return
+            previous = self.pending.pop(path, None)
+            if event == PendingFileEvent.CREATED and previous is not None and previous[0] != PendingFileEvent.CREATED:
+                event = PendingFileEvent.RECREATED
+            elif event == PendingFileEvent.MODIFIED and previous is not None and previous[0] != PendingFileEvent.MODIFIED:
+                # new file is processed from scratch anyway, deleted file that exists again is handled as recreated
+                event = PendingFileEvent.CREATED if previous[0] == PendingFileEvent.CREATED else PendingFileEvent.RECREATED
+            self.pending[path] = (event, time.monotonic())
+        self._wakeup_consumer()
+
+    def _wakeup_consumer(self):
+        if self.loop is not None and self.wakeup_event is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.wakeup_event.set)
+            except RuntimeError:
+                pass # loop closed
+
+    def _take_ready_batch(self) -> tuple[Optional[FileEventBatch], Optional[float]]:
+        '''Returns batch of paths that are ready to be processed, or time in seconds after which next path will be ready'''
+        now = time.monotonic()
+        deleted, created, modified = [], [], []
+        next_ready_in = None
+        with self.lock:
+            for path, (event, last_event_time) in list(self.pending.items()):
+                if len(deleted) + len(created) + len(modified) >= self.config.max_batch_size:
+                    break
+                ready_in = last_event_time + self.config.debounce_seconds - now
+                if ready_in > 0:
+                    next_ready_in = ready_in if next_ready_in is None else min(next_ready_in, ready_in)
+                    continue
+                del self.pending[path]
+                if event in (PendingFileEvent.DELETED, PendingFileEvent.RECREATED):
+                    deleted.append(path)
+                if event in (PendingFileEvent.CREATED, PendingFileEvent.RECREATED):
+                    created.append(path)
+                if event == PendingFileEvent.MODIFIED:
+                    modified.append(path)
+            if deleted or created or modified:
+                self.not_full.notify_all()
+                return FileEventBatch(deleted=deleted, created=created, modified=modified), None
+        return None, next_ready_in
+
+    async def _consume(self, handler: FileEventBatchHandler):
+        while True:
+            self.wakeup_event.clear()
+            batch, next_ready_in = self._take_ready_batch()
+            if batch is None:
+                try:
+                    await asyncio.wait_for(self.wakeup_event.wait(), timeout=next_ready_in)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                logger.debug(f'handling file events batch with {len(batch.deleted)} deleted, {len(batch.created)} created ' +
+                    f'and {len(batch.modified)} modified files')
+                await handler(batch)
+            except Exception as e:
+                logger.error(f'failed to handle file events batch', exc_info=e)
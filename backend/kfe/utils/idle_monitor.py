@@ -0,0 +1,13 @@
+import time
+
+
+class IdleMonitor:
+    '''Tracks time of the last activity (e.g. user requests or file changes), so that low priority work can run only when nothing else happens'''
+    def __init__(self) -> None:
+        self.last_activity = time.monotonic()
+
+    def on_activity(self):
+        self.last_activity = time.monotonic()
+
+    def get_idle_seconds(self) -> float:
+        return time.monotonic() - self.last_activity
@@ -17,35 +17,52 @@ class InitState(InitStateInfo, Enum):
     THUMBNAILS = InitStateInfo("Initializing file thumbnails", 0.05)
 
 class InitProgressTracker:
+    # states can be processed concurrently, each of them has its own progress
     def __init__(self):
-        self.current_state: InitState = None
-        self.total_files_to_process = 0
-        self.processed_files = 0
-        self.running_progress = 0.
+        self.states: dict[InitState, list[int]] = {} # state -> [processed, total]
         self.ready = False
+        self.waiting = False
 
-    def enter_state(self, state: InitState, total_files_to_process: int):
-        if self.current_state is not None:
-            self.running_progress += self.current_state.weight
-        self.processed_files = 0
-        self.current_state = state
-        self.total_files_to_process = total_files_to_process
+    def set_waiting(self, waiting: bool):
+        self.waiting = waiting
 
-    def mark_file_processed(self):
-        self.processed_files += 1
+    def enter_state(self, state: InitState, total_files_to_process: int, already_processed_files: int=0):
+        self.states[state] = [already_processed_files, total_files_to_process]
+
+    def mark_file_processed(self, state: InitState):
+        self.states[state][0] += 1
+
+    def get_state_progress(self, state: InitState) -> float:
+        '''Returns fraction of files that were already processed in given state, 0 if state was not entered yet'''
+        if self.ready:
+            return 1.
+        if state not in self.states:
+            return 0.
+        processed_files, total_files_to_process = self.states[state]
+        if total_files_to_process == 0:
+            return 1.
+        return min(processed_files / total_files_to_process, 1.)
+
+    def get_state_counts(self) -> dict[InitState, tuple[int, int]]:
+        '''Returns (processed, total) number of files of every entered state'''
+        return {state: (processed, total) for state, (processed, total) in self.states.items()}
 
     def get_progress_status(self) -> tuple[str, float]:
         if self.ready:
             return "Ready", 1.
-        if self.current_state is None:
+        if self.waiting:
+            return "Waiting for initialization of other directories", 0.
+        if not self.states:
             return "Initializing structures", 0.
-        state_progress = 0.
-        if self.total_files_to_process != 0:
-            state_progress = min(self.processed_files / self.total_files_to_process, 1.)
-        return (
-            f'{self.current_state.description}, processed {self.processed_files} / {self.total_files_to_process} files.',
-            min(self.running_progress + self.current_state.weight * state_progress, 1.)
-        )
+        progress = 0.
+        descriptions = []
+        for state, (processed_files, total_files_to_process) in self.states.items():
+            progress += state.weight * self.get_state_progress(state)
+            if processed_files < total_files_to_process:
+                descriptions.append(f'{state.description}, processed {processed_files} / {total_files_to_process} files.')
+        if not descriptions:
+            descriptions.append('Finalizing initialization')
+        return ' '.join(descriptions), min(progress, 1.)
 
     def set_ready(self):
         self.ready = True
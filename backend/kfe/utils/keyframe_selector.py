@@ -0,0 +1,146 @@
+import asyncio
+import io
+import struct
+import zlib
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+from PIL import Image
+
+from kfe.utils.video_frames_extractor import get_video_duration_seconds
+
+BMP_HEADER_BYTES = 14
+
+
+class KeyframeSelectorConfig(NamedTuple):
+    # number of evenly spaced candidate frames from which keyframes are selected
+    num_candidates: int = 24
+    # frames are decoded at reduced resolution which is still enough for vision models (CLIP uses 224px, vision LM 384px)
+    max_frame_side: int = 448
+    # side of thumbnails on which statistics are computed
+    analysis_side: int = 64
+    # frames closer than this (mean absolute difference of grayscale thumbnails in 0-1 range) are considered duplicates
+    min_frame_difference: float = 0.03
+    # frames with lower grayscale standard deviation (e.g. black or fading frames) are selected only if there is nothing else
+    min_contrast: float = 0.04
+
+class Keyframe(NamedTuple):
+    offset_seconds: float
+    image: Image.Image
+    score: float
+
+
+async def extract_candidate_frames(path: Path, duration: float, num_candidates: int, max_side: int,
+                                   keyframes_only: bool=True) -> list[tuple[float, Image.Image]]:
+    '''
+    Decodes frames sampled evenly in time with a single ffmpeg process. If `keyframes_only` is set, only I-frames
+    are decoded (which is much cheaper) and every sample is the last I-frame before its time, consecutive samples can be
+    duplicates then. Returns (offset in seconds, frame) tuples.
+    '''
+    rate = num_candidates / max(duration, 1e-3)
+    args = ['ffmpeg', '-nostdin', '-loglevel', 'error']
+    if keyframes_only:
+        args.extend(['-skip_frame', 'nokey'])
+    args.extend([
+        '-i', str(path.absolute()), '-an',
+        '-vf', f'fps={rate:.6f},scale={max_side}:{max_side}:force_original_aspect_ratio=decrease',
+        '-frames:v', str(num_candidates),
+        # bmp is not compressed and its header contains file size, so frames can be split without decoding
+        '-c:v', 'bmp', '-f', 'image2pipe', '-'
+    ])
+    proc = await asyncio.subprocess.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await proc.communicate()
+    frames = []
+    pos = 0
+    while pos + BMP_HEADER_BYTES <= len(stdout):
+        size = struct.unpack_from('<I', stdout, pos + 2)[0]
+        if size <= BMP_HEADER_BYTES or pos + size > len(stdout):
+            break
+        frames.append((len(frames) / rate, Image.open(io.BytesIO(stdout[pos:pos + size])).convert('RGB')))
+        pos += size
+    if proc.returncode != 0 and not frames:
+        raise ValueError(f'failed to extract frames of video: {path}\nerror: {stderr.decode()}')
+    return frames
+
+def _thumbnail(image: Image.Image, side: int) -> np.ndarray:
+    thumbnail = image.copy()
+    thumbnail.thumbnail((side, side))
+    return np.asarray(thumbnail, dtype=np.float32) / 255.
+
+def score_frames(thumbnails: list[np.ndarray], config: KeyframeSelectorConfig=KeyframeSelectorConfig()) -> np.ndarray:
+    '''
+    Scores how informative frames are, based on statistics of their RGB thumbnails (in 0-1 range). Detailed, sharp and colourful
+    frames score high. Dark or uniform frames and frames that change a lot from their neighbours (transitions, motion blur) score low.
+    '''
+    if not thumbnails:
+        return np.zeros(0)
+    grays = [x.mean(axis=2) for x in thumbnails]
+    contrast = np.array([x.std() for x in grays])
+    colourfulness = np.array([np.abs(x - x.mean(axis=2, keepdims=True)).mean() for x in thumbnails])
+    sharpness = np.array([
+        np.var(4 * g[1:-1, 1:-1] - g[:-2, 1:-1] - g[2:, 1:-1] - g[1:-1, :-2] - g[1:-1, 2:]) if min(g.shape) > 2 else 0.
+        for g in grays
+    ])
+    # detailed frames compress worse, uniform ones (title cards, black frames) compress very well
+    compression_ratio = np.array([len(zlib.compress((g * 255).astype(np.uint8).tobytes(), 1)) / g.size for g in grays])
+    differences = np.zeros(len(grays))
+    for i in range(len(grays)):
+        neighbours = [_frame_difference(grays[i], grays[j]) for j in (i - 1, i + 1) if 0 <= j < len(grays)]
+        differences[i] = np.mean(neighbours) if neighbours else 0.
+
+    def _standardize(x: np.ndarray) -> np.ndarray:
+        std = x.std()
+        return (x - x.mean()) / std if std > 1e-9 else np.zeros_like(x)
+
+    scores = _standardize(np.log(contrast + 1e-3)) + _standardize(np.log(sharpness + 1e-6)) + \
+        _standardize(compression_ratio) + 0.5 * _standardize(colourfulness) - _standardize(differences)
+    scores[contrast < config.min_contrast] -= 100.
+    return scores
+
+def _frame_difference(a: np.ndarray, b: np.ndarray) -> float:
+    if a.shape != b.shape:
+        return 1.
+    return float(np.abs(a - b).mean())
+
+def select_keyframes(thumbnails: list[np.ndarray], scores: np.ndarray, k: int,
+                     config: KeyframeSelectorConfig=KeyframeSelectorConfig()) -> list[int]:
+    '''Returns indices of at most `k` frames, best first. Frames too similar to already selected ones are skipped, so there can be fewer of them.'''
+    grays = [x.mean(axis=2) for x in thumbnails]
+    order = [int(i) for i in np.argsort(-scores, kind='stable')]
+    selected: list[int] = []
+    for i in order:
+        if len(selected) == k:
+            break
+        if all(_frame_difference(grays[i], grays[j]) >= config.min_frame_difference for j in selected):
+            selected.append(i)
+    return selected
+
+async def get_video_keyframes(path: Path, k: int, config: KeyframeSelectorConfig=KeyframeSelectorConfig(),
+                              duration: Optional[float]=None) -> list[Keyframe]:
+    '''Returns at most `k` informative and mutually different frames of the video, best first'''
+    if duration is None:
+        duration = await get_video_duration_seconds(path)
+    num_candidates = max(config.num_candidates, k)
+    loop = asyncio.get_running_loop()
+
+    def _deduplicate(frames: list[tuple[float, Image.Image]]) -> tuple[list[tuple[float, Image.Image]], list[np.ndarray]]:
+        unique_frames, thumbnails = [], []
+        for offset, image in frames:
+            thumbnail = _thumbnail(image, config.analysis_side)
+            if not thumbnails or _frame_difference(thumbnail, thumbnails[-1]) > 0:
+                unique_frames.append((offset, image))
+                thumbnails.append(thumbnail)
+        return unique_frames, thumbnails
+
+    frames, thumbnails = await loop.run_in_executor(None, _deduplicate,
+        await extract_candidate_frames(path, duration, num_candidates, config.max_frame_side, keyframes_only=True))
+    if len(frames) < min(k + 1, num_candidates // 2):
+        # I-frames are too sparse (e.g. short clip), all frames have to be decoded
+        frames, thumbnails = await loop.run_in_executor(None, _deduplicate,
+            await extract_candidate_frames(path, duration, num_candidates, config.max_frame_side, keyframes_only=False))
+
+    def _score_and_select() -> list[Keyframe]:
+        scores = score_frames(thumbnails, config)
+        return [Keyframe(frames[i][0], frames[i][1], float(scores[i])) for i in select_keyframes(thumbnails, scores, k, config)]
+    return await loop.run_in_executor(None, _score_and_select)
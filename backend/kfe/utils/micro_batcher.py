@@ -0,0 +1,88 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, NamedTuple, Optional, TypeVar
+
+from kfe.utils.log import logger
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class MicroBatcherConfig(NamedTuple):
+    # how long the first item of a batch waits for other items when no batch is being processed
+    max_wait_seconds: float = 0.003
+    max_batch_size: int = 32
+
+class MicroBatcher(Generic[T, R]):
+    '''
+    Collects items submitted by concurrent callers and processes them with a single call of `process_batch`,
+    which must return results in order of items. At most one batch is processed at a time, items submitted while
+    a batch is processed are dispatched as the next batch immediately after it finishes. Item waits for other items
+    at most `max_wait_seconds` when there is no batch being processed, so latency of a single request is barely affected.
+    '''
+    def __init__(self, process_batch: Callable[[list[T]], Awaitable[list[R]]], config: Optional[MicroBatcherConfig]=None) -> None:
+        self.process_batch = process_batch
+        self.config = config if config is not None else MicroBatcherConfig()
+        self.pending: list[tuple[T, asyncio.Future]] = []
+        self.in_flight = False
+        self.flush_task: Optional[asyncio.Task] = None
+        self.batch_tasks: set[asyncio.Task] = set()
+
+    async def submit(self, item: T) -> R:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((item, future))
+        if not self.in_flight:
+            if len(self.pending) >= self.config.max_batch_size:
+                self._dispatch()
+            elif self.flush_task is None:
+                self.flush_task = asyncio.create_task(self._flush_after_delay())
+        return await future
+
+    async def _flush_after_delay(self):
+        await asyncio.sleep(self.config.max_wait_seconds)
+        self.flush_task = None
+        if not self.in_flight:
+            self._dispatch()
+
+    def _dispatch(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        # futures of cancelled callers are skipped
+        self.pending = [x for x in self.pending if not x[1].done()]
+        if not self.pending:
+            return
+        batch = self.pending[:self.config.max_batch_size]
+        self.pending = self.pending[self.config.max_batch_size:]
+        self.in_flight = True
+        task = asyncio.create_task(self._process(batch))
+        self.batch_tasks.add(task)
+        task.add_done_callback(self.batch_tasks.discard)
+
+    async def _process(self, batch: list[tuple[T, asyncio.Future]]):
+        try:
+            await self._run_batch(batch)
+        finally:
+            self.in_flight = False
+            if self.pending:
+                self._dispatch()
+
+    async def _run_batch(self, batch: list[tuple[T, asyncio.Future]]):
+        try:
+            results = await self.process_batch([item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+            else:
+                # one bad item should not fail requests of others
+                logger.debug(f'micro batch of {len(batch)} items failed, processing items separately', exc_info=e)
+                for item, future in batch:
+                    if not future.done():
+                        await self._run_batch([(item, future)])
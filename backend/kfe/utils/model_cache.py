@@ -1,5 +1,6 @@
 import os
 import shutil
+from pathlib import Path
 from typing import Callable, NamedTuple, Optional, TypeVar
 
 from kfe.utils.log import logger
@@ -21,6 +22,13 @@ def get_cache_dir() -> Optional[str]:
         return None
     return str(MODEL_CACHE_DIR.absolute())
 
+def get_onnx_export_dir(model_id: str, variant: str='') -> Optional[Path]:
+    '''Returns directory for onnx exports of the model, deleting it forces the model to be exported again'''
+    if _failed_to_init_cache_dir:
+        return None
+    name = model_id.replace('/', '--') + (f'--{variant}' if variant else '')
+    return MODEL_CACHE_DIR.joinpath('onnx').joinpath(name)
+
 class LoadCachedModelArgs(NamedTuple):
     model_path: str
     cache_dir: str
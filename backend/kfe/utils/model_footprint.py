@@ -0,0 +1,99 @@
+from typing import Any, NamedTuple, Optional
+
+import torch
+
+from kfe.utils.platform import (get_available_ram_bytes,
+                                get_process_rss_bytes)
+
+
+class ModelFootprint(NamedTuple):
+    ram_bytes: int = 0
+    vram_bytes: int = 0
+
+    def __add__(self, other: "ModelFootprint") -> "ModelFootprint":
+        return ModelFootprint(self.ram_bytes + other.ram_bytes, self.vram_bytes + other.vram_bytes)
+
+    def __sub__(self, other: "ModelFootprint") -> "ModelFootprint":
+        return ModelFootprint(self.ram_bytes - other.ram_bytes, self.vram_bytes - other.vram_bytes)
+
+
+class FootprintMeasurement:
+    '''
+    Measures memory used by a model that is being loaded. GPU memory is measured exactly with torch allocator statistics
+    (models are loaded one at a time), RAM is estimated from sizes of CPU tensors reachable from the model or,
+    if there are none (e.g., non-torch models), from growth of the process resident memory.
+    '''
+    MAX_DEPTH = 4
+
+    def __init__(self) -> None:
+        self.vram_before = self._get_allocated_vram()
+        self.rss_before = get_process_rss_bytes()
+
+    def finish(self, model: Any) -> ModelFootprint:
+        vram = max(self._get_allocated_vram() - self.vram_before, 0)
+        ram = self._get_cpu_tensors_bytes(model)
+        if ram == 0 and self.rss_before is not None and (rss_after := get_process_rss_bytes()) is not None:
+            ram = max(rss_after - self.rss_before, 0)
+        return ModelFootprint(ram_bytes=ram, vram_bytes=vram)
+
+    @staticmethod
+    def _get_allocated_vram() -> int:
+        try:
+            return torch.cuda.memory_allocated() if torch.cuda.is_available() else 0
+        except Exception:
+            return 0
+
+    @classmethod
+    def _get_cpu_tensors_bytes(cls, model: Any) -> int:
+        visited: set[int] = set()
+        total = 0
+
+        def _visit(obj: Any, depth: int):
+            nonlocal total
+            if id(obj) in visited or depth > cls.MAX_DEPTH:
+                return
+            visited.add(id(obj))
+            if isinstance(obj, torch.nn.Module):
+                for tensor in (*obj.parameters(), *obj.buffers()):
+                    if id(tensor) not in visited and tensor.device.type != 'cuda':
+                        visited.add(id(tensor))
+                        total += tensor.numel() * tensor.element_size()
+                return
+            if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+                return
+            if isinstance(obj, dict):
+                children = obj.values()
+            elif isinstance(obj, (list, tuple, set)):
+                children = obj
+            elif hasattr(obj, '__dict__'):
+                children = vars(obj).values()
+            else:
+                return
+            for child in children:
+                _visit(child, depth + 1)
+
+        _visit(model, 0)
+        return total
+
+
+def format_footprint(footprint: Optional[ModelFootprint]) -> str:
+    if footprint is None:
+        return 'unknown'
+    return f'{footprint.ram_bytes / 2**20:.0f} MB RAM, {footprint.vram_bytes / 2**20:.0f} MB VRAM'
+
+
+def has_free_memory_for(footprint: ModelFootprint) -> bool:
+    '''Checks if currently free RAM and GPU memory can fit the footprint, memory that can't be measured is assumed to be free'''
+    if footprint.ram_bytes > 0 and (available_ram := get_available_ram_bytes()) is not None and available_ram < footprint.ram_bytes:
+        return False
+    if footprint.vram_bytes > 0:
+        try:
+            if torch.cuda.is_available():
+                free_vram, _ = torch.cuda.mem_get_info()
+                # memory cached by torch allocator is free for our purposes
+                free_vram += torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+                if free_vram < footprint.vram_bytes:
+                    return False
+        except Exception:
+            pass
+    return True
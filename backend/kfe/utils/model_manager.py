@@ -1,13 +1,18 @@
 import asyncio
 import gc
+import time
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from enum import Enum
-from typing import Any, Callable, Optional
+from typing import Any, Callable, NamedTuple, Optional
 
 import torch
 
 from kfe.utils.log import logger
+from kfe.utils.model_footprint import (FootprintMeasurement, ModelFootprint,
+                                       format_footprint)
 
 Model = Any
 ModelProvider = Callable[[], Model]
@@ -20,17 +25,161 @@ class ModelType(str, Enum):
     LEMMATIZER = 'lemmatizer'
     VISION_LM = 'vision-lm'
 
+class ModelMemoryBudget(NamedTuple):
+    # None means unlimited
+    ram_bytes: Optional[int] = None
+    vram_bytes: Optional[int] = None
+
+    def is_exceeded_by(self, footprint: ModelFootprint) -> bool:
+        return (self.ram_bytes is not None and footprint.ram_bytes > self.ram_bytes) or \
+            (self.vram_bytes is not None and footprint.vram_bytes > self.vram_bytes)
+
+@dataclass
+class ModelMetrics:
+    footprint: Optional[ModelFootprint] = None
+    load_count: int = 0
+    last_load_seconds: float = 0.
+    total_load_seconds: float = 0.
+    eviction_count: int = 0
+    resident: bool = False
+
+class ModelResidency:
+    '''
+    Tracks models loaded by all managers that share the memory. Unused models stay loaded until a model that
+    is being loaded doesn't fit in the memory budget, then the least recently used models which are not in use are evicted.
+    '''
+    def __init__(self, budget: Optional[ModelMemoryBudget]=None) -> None:
+        self.budget = budget if budget is not None else ModelMemoryBudget()
+        # least recently used first
+        self.resident: OrderedDict[tuple[str, ModelType], "ModelManager"] = OrderedDict()
+        self.metrics: dict[tuple[str, ModelType], ModelMetrics] = {}
+
+    def get_metrics(self) -> dict[tuple[str, ModelType], ModelMetrics]:
+        return dict(self.metrics)
+
+    def get_usage(self) -> ModelFootprint:
+        usage = ModelFootprint()
+        for key in self.resident:
+            if (footprint := self.metrics[key].footprint) is not None:
+                usage = usage + footprint
+        return usage
+
+    def get_expected_footprint(self, key: tuple[str, ModelType]) -> ModelFootprint:
+        '''Returns footprint measured when the model was loaded previously, zero if it wasn't loaded yet'''
+        metrics = self.metrics.get(key)
+        return metrics.footprint if metrics is not None and metrics.footprint is not None else ModelFootprint()
+
+    def fits_in_budget(self, required: ModelFootprint) -> bool:
+        '''Returns True if required memory fits in the budget once models which are not in use are evicted'''
+        in_use = ModelFootprint()
+        for key, manager in self.resident.items():
+            if manager.is_in_use(key[1]) and (footprint := self.metrics[key].footprint) is not None:
+                in_use = in_use + footprint
+        return not self.budget.is_exceeded_by(in_use + required)
+
+    def touch(self, key: tuple[str, ModelType]):
+        if key in self.resident:
+            self.resident.move_to_end(key)
+
+    def make_room(self, required: ModelFootprint):
+        '''Evicts least recently used unused models until required memory fits in the budget, if possible'''
+        for key, manager in list(self.resident.items()):
+            if not self.budget.is_exceeded_by(self.get_usage() + required):
+                return
+            manager._evict_if_unused(key[1])
+        if self.budget.is_exceeded_by(self.get_usage() + required):
+            logger.warning(f'models in use exceed memory budget, usage: {format_footprint(self.get_usage())}, ' +
+                f'required: {format_footprint(required)}, budget: {self._format_budget()}')
+
+    def evict_unused_exclusive(self, key: tuple[str, ModelType]):
+        '''
+        Evicts other memory heavy models (of any manager) which are not in use. They are not expected to fit in memory
+        together with the model that is being loaded and its footprint is not known before the first load.
+        '''
+        for other_key, manager in list(self.resident.items()):
+            if other_key != key and other_key[1] in manager.exclusive_models:
+                manager._evict_if_unused(other_key[1])
+
+    def on_loaded(self, key: tuple[str, ModelType], manager: "ModelManager", footprint: ModelFootprint, load_seconds: float):
+        metrics = self.metrics.setdefault(key, ModelMetrics())
+        metrics.footprint = footprint
+        metrics.load_count += 1
+        metrics.last_load_seconds = load_seconds
+        metrics.total_load_seconds += load_seconds
+        metrics.resident = True
+        self.resident[key] = manager
+        logger.info(f'initialized model: {key[1]} of {key[0]} manager in {load_seconds:.1f}s, footprint: {format_footprint(footprint)}, ' +
+            f'total usage: {format_footprint(self.get_usage())}, budget: {self._format_budget()}')
+
+    def on_evicted(self, key: tuple[str, ModelType]):
+        self.resident.pop(key, None)
+        if (metrics := self.metrics.get(key)) is not None:
+            metrics.eviction_count += 1
+            metrics.resident = False
+
+    def _format_budget(self) -> str:
+        ram = 'unlimited' if self.budget.ram_bytes is None else f'{self.budget.ram_bytes / 2**20:.0f} MB'
+        vram = 'unlimited' if self.budget.vram_bytes is None else f'{self.budget.vram_bytes / 2**20:.0f} MB'
+        return f'{ram} RAM, {vram} VRAM'
+
 class ModelManager:
-    MODEL_CLEANUP_DELAY_SECONDS = 60.
+    # models that require a lot of (GPU) memory, at most one of them should be used at the same time
+    DEFAULT_EXCLUSIVE_MODELS = (ModelType.TRANSCRIBER, ModelType.VISION_LM)
 
-    def __init__(self, model_providers: dict[ModelType, ModelProvider], loader_executor: Optional[ThreadPoolExecutor]=None) -> None:
+    def __init__(self, model_providers: dict[ModelType, ModelProvider], loader_executor: Optional[ThreadPoolExecutor]=None,
+                 max_concurrency: Optional[dict[ModelType, int]]=None, exclusive_models: Optional[set[ModelType]]=None,
+                 memory_budget: Optional[ModelMemoryBudget]=None, residency: Optional[ModelResidency]=None, name: str='primary') -> None:
+        self.name = name
         self.model_locks = {m: asyncio.Lock() for m in ModelType}
         self.model_providers = model_providers
         self.models: dict[ModelType, Model] = {}
         self.model_request_counters: dict[ModelType, int] = {}
-        self.model_cleanup_tasks: dict[ModelType, asyncio.Task] = {}
         # models should not be loaded concurrently because it causes problems with torch precision mixing (and maybe other things)
         self.loader_executor = loader_executor if loader_executor is not None else ThreadPoolExecutor(max_workers=1)
+        # engines run inference in single worker executors, more concurrent requests would only wait in their queues
+        self.max_concurrency = max_concurrency if max_concurrency is not None else {}
+        self.exclusive_models = exclusive_models if exclusive_models is not None else set(self.DEFAULT_EXCLUSIVE_MODELS)
+        self.exclusive_models_lock = asyncio.Lock()
+        self.residency = residency if residency is not None else ModelResidency(memory_budget)
+        self.usage_listeners: list[Callable[[ModelType], None]] = []
+
+    def get_max_concurrency(self, model_type: ModelType) -> int:
+        '''Returns how many requests for the model should be processed concurrently by batch workloads'''
+        return self.max_concurrency.get(model_type, 1)
+
+    def get_metrics(self) -> dict[tuple[str, ModelType], ModelMetrics]:
+        '''Returns load time and memory footprint metrics of models of all managers that share the memory budget'''
+        return self.residency.get_metrics()
+
+    def is_loaded(self, model_type: ModelType) -> bool:
+        return model_type in self.models
+
+    def is_in_use(self, model_type: ModelType) -> bool:
+        return self.model_request_counters.get(model_type, 0) > 0
+
+    def get_expected_footprint(self, model_type: ModelType) -> ModelFootprint:
+        '''Returns footprint measured when the model was loaded previously, zero if it wasn't loaded yet'''
+        return self.residency.get_expected_footprint((self.name, model_type))
+
+    def fits_in_budget(self, model_type: ModelType, footprint: Optional[ModelFootprint]=None) -> bool:
+        '''Returns True if the model (with the given or previously measured footprint) fits in the memory budget shared with other managers'''
+        return self.residency.fits_in_budget(footprint if footprint is not None else self.get_expected_footprint(model_type))
+
+    def add_usage_listener(self, listener: Callable[[ModelType], None]):
+        '''Registers listener called whenever usage of a model is requested with `use`'''
+        self.usage_listeners.append(listener)
+
+    @asynccontextmanager
+    async def exclusive(self, model_type: ModelType):
+        '''
+        If the model is one of memory heavy models, waits until no other such model is used in exclusive mode
+        and holds the exclusivity for duration of the context manager. Otherwise does nothing.
+        '''
+        if model_type in self.exclusive_models:
+            async with self.exclusive_models_lock:
+                yield
+        else:
+            yield
 
     async def require_eager(self, model_type: ModelType):
         '''Immediately loads the model if it was not loaded before'''
@@ -44,9 +193,11 @@ class ModelManager:
     async def use(self, model_type: ModelType):
         '''
         Registers model for usage for duration of the context manager.
-        Model is not created unless get_model is called, but if it was called
-        and there are no more requests the model will be deallocated once contextmanager exits.
+        Model is not created unless get_model is called. Once there are no more requests the model
+        stays loaded until memory is needed for other models.
         '''
+        for listener in self.usage_listeners:
+            listener(model_type)
         await self._acquire(model_type)
         yield
         await self._release(model_type)
@@ -57,43 +208,65 @@ class ModelManager:
         The model MUST NOT be kept by the caller after it relased the request.
         '''
         async with self.model_locks[model_type]:
+            key = (self.name, model_type)
             if model_type not in self.models:
                 logger.info(f'initializing model: {model_type}')
+                if model_type in self.exclusive_models:
+                    self.residency.evict_unused_exclusive(key)
+                self.residency.make_room(self.residency.get_expected_footprint(key))
                 def _init():
-                    return self.model_providers[model_type]()
-                self.models[model_type] = await asyncio.get_running_loop().run_in_executor(self.loader_executor, _init)
+                    measurement = FootprintMeasurement()
+                    start_time = time.monotonic()
+                    model = self.model_providers[model_type]()
+                    return model, measurement.finish(model), time.monotonic() - start_time
+                model, footprint, load_seconds = await asyncio.get_running_loop().run_in_executor(self.loader_executor, _init)
+                self.models[model_type] = model
+                self.residency.on_loaded(key, self, footprint, load_seconds)
+                # footprint of the first load is not known in advance
+                self.residency.make_room(ModelFootprint())
+            self.residency.touch(key)
             return self.models[model_type]
 
     async def flush_all_unused(self):
+        '''Frees all models that are not in use, regardless of the memory budget'''
         for model_type in ModelType:
             async with self.model_locks[model_type]:
                 self._del_model_if_unused(model_type)
         
+    async def free_if_unused(self, model_type: ModelType):
+        '''Frees the model if it is not in use, regardless of the memory budget'''
+        async with self.model_locks[model_type]:
+            self._del_model_if_unused(model_type)
+
     async def _acquire(self, model_type: ModelType):
         async with self.model_locks[model_type]:
             self.model_request_counters[model_type] = self.model_request_counters.get(model_type, 0) + 1
-            if (task := self.model_cleanup_tasks.pop(model_type, None)) is not None:
-                task.cancel()
     
     async def _release(self, model_type: ModelType):
         async with self.model_locks[model_type]:
             count = self.model_request_counters.get(model_type, 0) - 1
             self.model_request_counters[model_type] = count
             assert count >= 0
-            if count == 0 and model_type in self.models:
-                if (task := self.model_cleanup_tasks.get(model_type)) is not None:
-                    task.cancel()
-                self.model_cleanup_tasks[model_type] = asyncio.create_task(self._del_model_after_delay_if_not_reacquired(model_type))
+            if count == 0:
+                self.residency.touch((self.name, model_type))
 
-    async def _del_model_after_delay_if_not_reacquired(self, model_type: ModelType):
-        await asyncio.sleep(self.MODEL_CLEANUP_DELAY_SECONDS)
-        async with self.model_locks[model_type]:
+    def _evict_if_unused(self, model_type: ModelType):
+        # called by residency when other model is loaded, model which lock is held might be just being acquired or loaded
+        if not self.model_locks[model_type].locked():
             self._del_model_if_unused(model_type)
     
     def _del_model_if_unused(self, model_type: ModelType):
         if self.model_request_counters.get(model_type, 0) == 0 and model_type in self.models:
             logger.info(f'freeing model: {model_type}')
-            del self.models[model_type]
+            model = self.models.pop(model_type)
+            # some models hold resources other than memory, e.g. worker processes
+            if callable(close := getattr(model, 'close', None)):
+                try:
+                    close()
+                except Exception as e:
+                    logger.warning(f'failed to close model {model_type}', exc_info=e)
+            del model
+            self.residency.on_evicted((self.name, model_type))
             try:
                 gc.collect()
                 if torch.cuda.is_available():
@@ -102,10 +275,14 @@ class ModelManager:
                 logger.warning(f'garbage collection triggered for cleanup of model {model_type} failed', exc_info=e)
 
 class SecondaryModelManager(ModelManager):
-    def __init__(self, primary: ModelManager, owned_model_providers: dict[ModelType, ModelProvider]):
-        super().__init__(owned_model_providers, loader_executor=primary.loader_executor)
+    def __init__(self, primary: ModelManager, owned_model_providers: dict[ModelType, ModelProvider], name: str='secondary'):
+        super().__init__(owned_model_providers, loader_executor=primary.loader_executor,
+            max_concurrency=primary.max_concurrency, exclusive_models=primary.exclusive_models,
+            residency=primary.residency, name=name)
         self.primary = primary
         self.owned_model_providers = owned_model_providers
+        # models of all managers share memory
+        self.exclusive_models_lock = primary.exclusive_models_lock
 
     async def _acquire(self, model_type: ModelType):
         if model_type in self.owned_model_providers:
@@ -125,6 +302,27 @@ class SecondaryModelManager(ModelManager):
         else:
             return await self.primary.get_model(model_type)
 
+    def is_loaded(self, model_type: ModelType) -> bool:
+        if model_type in self.owned_model_providers:
+            return super().is_loaded(model_type)
+        return self.primary.is_loaded(model_type)
+
+    def is_in_use(self, model_type: ModelType) -> bool:
+        if model_type in self.owned_model_providers:
+            return super().is_in_use(model_type)
+        return self.primary.is_in_use(model_type)
+
+    def get_expected_footprint(self, model_type: ModelType) -> ModelFootprint:
+        if model_type in self.owned_model_providers:
+            return super().get_expected_footprint(model_type)
+        return self.primary.get_expected_footprint(model_type)
+
+    async def free_if_unused(self, model_type: ModelType):
+        if model_type in self.owned_model_providers:
+            await super().free_if_unused(model_type)
+        else:
+            await self.primary.free_if_unused(model_type)
+
     async def flush_all_unused(self):
         await self.primary.flush_all_unused()
         for model_type in ModelType:
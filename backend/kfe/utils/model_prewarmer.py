@@ -0,0 +1,97 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from kfe.utils.constants import Language
+from kfe.utils.log import logger
+from kfe.utils.model_manager import ModelManager, ModelType
+
+_serving_query: ContextVar[bool] = ContextVar('serving_query', default=False)
+
+@dataclass(frozen=False)
+class ModelManagementTasks:
+    # model -> task that requires it, model is released by the cleaner task
+    loader_tasks: dict[ModelType, asyncio.Task] = field(default_factory=dict)
+    cleaner_task: asyncio.Task = None
+
+class ModelPrewarmer:
+    '''
+    Loads models that are likely to be needed by queries ahead of demand, when user activity is observed
+    (e.g., text embedding and lemmatizer models while user is typing the query). Models are loaded in the background
+    by the loader executor of the model manager. For each language, models that served its queries within
+    `usage_window_seconds` are prewarmed; `default_model_types` are used until any query of the language is observed.
+    Prewarmed models are held until there is no activity for `release_delay_seconds`, then they can be evicted by the model manager.
+    '''
+    def __init__(self, model_managers: dict[Language, ModelManager], default_model_types: list[ModelType],
+                 usage_window_seconds: float=3600*24., release_delay_seconds: float=60*30):
+        self.model_managers = model_managers
+        self.default_model_types = default_model_types
+        self.usage_window_seconds = usage_window_seconds
+        self.release_delay_seconds = release_delay_seconds
+        self.tasks: dict[Language, ModelManagementTasks] = {lang: ModelManagementTasks() for lang in model_managers}
+        self.release_locks: dict[Language, asyncio.Lock] = {lang: asyncio.Lock() for lang in model_managers}
+        # language -> model -> time when it was last used by a query
+        self.last_query_usage: dict[Language, dict[ModelType, float]] = {lang: {} for lang in model_managers}
+        for language, model_manager in model_managers.items():
+            model_manager.add_usage_listener(lambda model_type, language=language: self._on_model_used(language, model_type))
+
+    @contextmanager
+    def track_queries(self):
+        '''Models used while the context manager is active (also by tasks created within it) are considered used by queries'''
+        token = _serving_query.set(True)
+        try:
+            yield
+        finally:
+            _serving_query.reset(token)
+
+    def get_models_to_prewarm(self, language: Language) -> list[ModelType]:
+        usage = self.last_query_usage[language]
+        if not usage:
+            return list(self.default_model_types)
+        now = time.monotonic()
+        return [model for model, last_used in usage.items() if now - last_used <= self.usage_window_seconds]
+
+    async def on_user_activity(self, used_languages: set[Language]):
+        for language in used_languages:
+            async with self.release_locks[language]:
+                tasks = self.tasks[language]
+                for model in self.get_models_to_prewarm(language):
+                    if model not in tasks.loader_tasks:
+                        tasks.loader_tasks[model] = asyncio.create_task(self._require_model(language, model))
+                # reset timer
+                if tasks.cleaner_task is not None:
+                    tasks.cleaner_task.cancel()
+                tasks.cleaner_task = asyncio.create_task(self._release_models_in_background(language))
+
+    def _on_model_used(self, language: Language, model_type: ModelType):
+        if _serving_query.get():
+            self.last_query_usage[language][model_type] = time.monotonic()
+
+    async def _require_model(self, language: Language, model_type: ModelType):
+        try:
+            await self.model_managers[language].require_eager(model_type)
+        except Exception as e:
+            logger.warning(f'failed to prewarm model {model_type} for language {language}', exc_info=e)
+
+    async def _release_models_in_background(self, language: Language):
+        await asyncio.sleep(self.release_delay_seconds)
+
+        # make sure we don't get canceled in the middle
+        async with self.release_locks[language]:
+            model_manager = self.model_managers[language]
+            tasks = self.tasks[language]
+            if tasks.loader_tasks:
+                await asyncio.wait(tasks.loader_tasks.values())
+            for model in tasks.loader_tasks:
+                await model_manager.release_eager(model)
+            tasks.loader_tasks.clear()
+            tasks.cleaner_task = None
+    
+    async def teardown(self):
+        for language_tasks in self.tasks.values():
+            for task in language_tasks.loader_tasks.values():
+                task.cancel()
+            if language_tasks.cleaner_task is not None:
+                language_tasks.cleaner_task.cancel()
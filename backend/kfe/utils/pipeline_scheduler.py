@@ -0,0 +1,172 @@
+import asyncio
+from contextlib import AsyncExitStack
+from typing import (Any, AsyncContextManager, Awaitable, Callable, NamedTuple,
+                    Optional)
+
+from kfe.utils.init_progress_tracker import InitProgressTracker, InitState
+from kfe.utils.log import logger
+from kfe.utils.model_manager import ModelManager, ModelType
+
+Item = Any
+StageContext = Any
+StageProcessor = Callable[[list[Item], StageContext], Awaitable[None]]
+
+
+class PipelineStage(NamedTuple):
+    name: str
+    # processes a batch of items, second argument is the value yielded by context_factory (or None)
+    process: StageProcessor
+    # items which are not accepted skip the stage, their dependants don't wait for it
+    accepts: Callable[[Item], bool] = lambda _: True
+    depends_on: tuple[str, ...] = ()
+    # entered before the first item is processed and exited after the last one, e.g., engine.run
+    context_factory: Optional[Callable[[], AsyncContextManager[StageContext]]] = None
+    # models used by the stage, they determine stage concurrency and memory exclusivity
+    model_types: tuple[ModelType, ...] = ()
+    # used only if stage doesn't use any models
+    max_concurrency: int = 1
+    max_batch_size: int = 1
+    progress_state: Optional[InitState] = None
+    # items processed by the stage before (e.g., in interrupted run), reported as progress
+    already_processed: int = 0
+
+
+class PipelineScheduler:
+    '''
+    Streams items through stages. Each stage has its own queue and workers, so stages run concurrently,
+    but an item enters a stage only after it passed all (accepted) stages the stage depends on.
+    Stages which depend on each other must not use exclusive models, otherwise they could deadlock.
+    '''
+    _STAGE_FINISHED = object()
+
+    def __init__(self, stages: list[PipelineStage], model_manager: ModelManager,
+                 progress_tracker: Optional[InitProgressTracker]=None) -> None:
+        self.stages = {s.name: s for s in stages}
+        self.model_manager = model_manager
+        self.progress_tracker = progress_tracker
+        for stage in stages:
+            for dep in stage.depends_on:
+                assert dep in self.stages, f'stage {stage.name} depends on unknown stage {dep}'
+        self.dependants = {name: [s.name for s in stages if name in s.depends_on] for name in self.stages}
+
+    async def run(self, items: list[Item]):
+        accepted = {name: [stage.accepts(item) for item in items] for name, stage in self.stages.items()}
+        queues = {name: asyncio.Queue() for name in self.stages}
+        # number of dependencies that item still waits for, per stage
+        waiting_for = {name: [0] * len(items) for name in self.stages}
+        remaining = {name: sum(accepted[name]) for name in self.stages}
+
+        def effective_dependencies(stage_name: str, idx: int) -> list[str]:
+            # not deduplicated, stage is counted once for every dependency path which leads to it
+            res = []
+            for dep in self.stages[stage_name].depends_on:
+                res.extend([dep] if accepted[dep][idx] else effective_dependencies(dep, idx))
+            return res
+
+        def enqueue(stage_name: str, idx: int):
+            queues[stage_name].put_nowait(idx)
+            remaining[stage_name] -= 1
+            if remaining[stage_name] == 0:
+                for _ in range(self._get_concurrency(self.stages[stage_name])):
+                    queues[stage_name].put_nowait(self._STAGE_FINISHED)
+
+        def on_processed(stage_name: str, idx: int):
+            for dependant in self.dependants[stage_name]:
+                if accepted[dependant][idx]:
+                    waiting_for[dependant][idx] -= 1
+                    if waiting_for[dependant][idx] == 0:
+                        enqueue(dependant, idx)
+                else:
+                    # item skips the dependant, its dependants were waiting for this stage instead
+                    on_processed(dependant, idx)
+
+        for name, stage in self.stages.items():
+            if self.progress_tracker is not None and stage.progress_state is not None:
+                self.progress_tracker.enter_state(stage.progress_state, stage.already_processed + remaining[name], stage.already_processed)
+            if remaining[name] == 0:
+                for _ in range(self._get_concurrency(stage)):
+                    queues[name].put_nowait(self._STAGE_FINISHED)
+
+        ready_items = {name: [] for name in self.stages}
+        for idx in range(len(items)):
+            for name in self.stages:
+                if not accepted[name][idx]:
+                    continue
+                waiting_for[name][idx] = len(effective_dependencies(name, idx))
+                if waiting_for[name][idx] == 0:
+                    ready_items[name].append(idx)
+        for name, indices in ready_items.items():
+            for idx in indices:
+                enqueue(name, idx)
+
+        stage_tasks = [
+            asyncio.create_task(self._run_stage(stage, items, queues[stage.name], on_processed))
+            for stage in self.stages.values()
+        ]
+        try:
+            await asyncio.gather(*stage_tasks)
+        finally:
+            for task in stage_tasks:
+                task.cancel()
+            await asyncio.gather(*stage_tasks, return_exceptions=True)
+
+    async def _run_stage(self, stage: PipelineStage, items: list[Item], queue: asyncio.Queue,
+                         on_processed: Callable[[str, int], None]):
+        context_lock = asyncio.Lock()
+        context: list[StageContext] = []
+
+        async with AsyncExitStack() as exit_stack:
+            async def get_context() -> StageContext:
+                # stage context is entered lazily, so that models of stages without items are never loaded
+                async with context_lock:
+                    if not context:
+                        async with AsyncExitStack() as stack:
+                            for model_type in stage.model_types:
+                                await stack.enter_async_context(self.model_manager.exclusive(model_type))
+                            ctx = None
+                            if stage.context_factory is not None:
+                                ctx = await stack.enter_async_context(stage.context_factory())
+                            # entered successfully, keep it until the stage finishes
+                            await exit_stack.enter_async_context(stack.pop_all())
+                        context.append(ctx)
+                    return context[0]
+
+            async def worker():
+                while True:
+                    batch = await self._get_batch(queue, stage.max_batch_size)
+                    if not batch:
+                        return
+                    try:
+                        await stage.process([items[idx] for idx in batch], await get_context())
+                    except Exception as e:
+                        logger.error(f'pipeline stage {stage.name} failed to process batch of {len(batch)} items', exc_info=e)
+                    for idx in batch:
+                        if self.progress_tracker is not None and stage.progress_state is not None:
+                            self.progress_tracker.mark_file_processed(stage.progress_state)
+                        on_processed(stage.name, idx)
+
+            workers = [asyncio.create_task(worker()) for _ in range(self._get_concurrency(stage))]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for w in workers:
+                    w.cancel()
+        # models of finished stage stay loaded, model manager evicts them if other stages need the memory
+
+    async def _get_batch(self, queue: asyncio.Queue, max_batch_size: int) -> list[int]:
+        first = await queue.get()
+        if first is self._STAGE_FINISHED:
+            return []
+        batch = [first]
+        while len(batch) < max_batch_size and not queue.empty():
+            idx = queue.get_nowait()
+            if idx is self._STAGE_FINISHED:
+                queue.put_nowait(idx) # leave it for this worker's next call
+                break
+            batch.append(idx)
+        return batch
+
+    def _get_concurrency(self, stage: PipelineStage) -> int:
+        if not stage.model_types:
+            return max(stage.max_concurrency, 1)
+        return max(min(self.model_manager.get_max_concurrency(m) for m in stage.model_types), 1)
@@ -18,3 +18,49 @@ def is_apple_silicon() -> bool:
 
 def get_home_dir_path() -> Optional[str]:
     return os.getenv('USERPROFILE') if is_windows() else os.getenv('HOME')
+
+def _get_windows_memory_status():
+    import ctypes
+    class MEMORYSTATUSEX(ctypes.Structure):
+        _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+            ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+            ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+            ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+            ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+    status = MEMORYSTATUSEX()
+    status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+    if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+        return None
+    return status
+
+def get_total_ram_bytes() -> Optional[int]:
+    try:
+        if is_windows():
+            status = _get_windows_memory_status()
+            return int(status.ullTotalPhys) if status is not None else None
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except Exception:
+        return None
+
+def get_available_ram_bytes() -> Optional[int]:
+    '''Returns memory that can be allocated without swapping, None if it can't be determined (e.g. on mac os)'''
+    try:
+        if is_windows():
+            status = _get_windows_memory_status()
+            return int(status.ullAvailPhys) if status is not None else None
+        if is_linux():
+            with open('/proc/meminfo') as f:
+                for line in f:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) * 1024
+        return None
+    except Exception:
+        return None
+
+def get_process_rss_bytes() -> Optional[int]:
+    '''Returns resident memory of this process, only supported on linux'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return None
@@ -1,19 +1,57 @@
-from typing import Optional
+import secrets
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
 
 from kfe.search.models import SearchResult
 
 
+class CachedQueryResults(NamedTuple):
+    handle: str
+    query: str
+    results: list[SearchResult]
+
+
 class QueryResultsCache:
-    def __init__(self):
-        self.last_query: Optional[str] = None
-        self.last_results: Optional[list[SearchResult]] = None
+    '''
+    Keeps results of recent queries, so that subsequent pages are sliced from them instead of repeating the search.
+    Each entry is identified by a handle which clients can pass with next page requests, entries expire when
+    they were not accessed for `ttl_seconds`. All entries must be invalidated when files or their metadata change.
+    '''
+    def __init__(self, ttl_seconds: float=600., max_entries: int=8):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[CachedQueryResults, float]] = OrderedDict()
 
-    def put(self, query: str, results: list[SearchResult]):
-        self.last_query = query
-        self.last_results = results
+    def put(self, query: str, results: list[SearchResult]) -> str:
+        self._evict_expired()
+        handle = secrets.token_urlsafe(12)
+        self.entries[handle] = (CachedQueryResults(handle, query, results), time.monotonic())
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return handle
+
+    def get(self, query: str, handle: Optional[str]=None) -> Optional[CachedQueryResults]:
+        self._evict_expired()
+        if handle is None or handle not in self.entries:
+            # most recent results of the same query, e.g. client that doesn't pass handles
+            handle = next((h for h, (entry, _) in reversed(self.entries.items()) if entry.query == query), None)
+        if handle is None:
+            return None
+        entry, _ = self.entries[handle]
+        if entry.query != query:
+            return None
+        self.entries[handle] = (entry, time.monotonic())
+        self.entries.move_to_end(handle)
+        return entry
 
-    def get(self, query: str) -> Optional[list[SearchResult]]:
-        return self.last_results if query == self.last_query else None
-    
     def invalidate(self):
-        self.last_query = self.last_results = None
+        self.entries.clear()
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        while self.entries:
+            _, last_access = next(iter(self.entries.values()))
+            if now - last_access < self.ttl_seconds:
+                break
+            self.entries.popitem(last=False)